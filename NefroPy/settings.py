@@ -39,10 +39,12 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'core',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricasMiddleware',  # primeiro, para medir também sessão/autenticação
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -92,6 +94,26 @@ JAZZMIN_SETTINGS = {
     "order_with_respect_to": ["core.paciente", "core.conduta", "core.acesso",
                               "core.observacao", "core.producao", "core.hospital"],
 }
+# Cache compartilhado entre os workers (carimbo de versão das tarifas, fragmentos).
+# Em produção com mais de um servidor, troque por Redis/Memcached.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / ".cache",
+    }
+}
+
+# Orçamento de queries por view (nome da URL); acima disso o MetricasMiddleware
+# loga um warning. Métricas em /metricas/ (formato Prometheus, só staff).
+ORCAMENTO_QUERIES = {
+    "home": 6,
+    "pacientes_list": 8,
+    "producao_list": 8,
+    "producao_detalhe": 6,
+    "evolucao_paciente": 6,
+    "visita_hospital": 12,
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
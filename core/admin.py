@@ -1,14 +1,22 @@
-from django.contrib import admin
-from django.db.models import Sum, F
+from django.contrib import admin, messages
+from django.db.models import Sum, F, OuterRef, Subquery, DecimalField
 from decimal import Decimal
 from django.db.models.functions import Coalesce
 from django.db.models import Value
+from django.core.exceptions import ValidationError
 from .models import (
     Paciente, Setor, Convenio, Hospital, Observacao,
     Conduta, CondutaDescricao, Acesso, AcessoDescricao,
-    Producao, Procedimento, ItemProducao, ProcedimentoValor
+    Producao, Procedimento, ItemProducao, ProcedimentoValor, Fechamento, FechamentoItem,
+    PacienteArquivo, AcessoArquivo, ObservacaoArquivo, CondutaArquivo, ProducaoArquivo, ItemProducaoArquivo,
 )
+from . import arquivo
+from .reprecificacao import escopo_da_tarifa, reprecificar, simular
 # Register your models here.
+
+def _mes_fechado(producao):
+    return producao is not None and producao.data.replace(day=1) in Fechamento.meses_fechados()
+
 class ObservacaoInline(admin.TabularInline):
     model = Observacao
     extra = 0
@@ -30,12 +38,19 @@ class CondutaInline(admin.TabularInline):
 class AcessoInline(admin.TabularInline):
     model = Acesso
     extra = 0
-    fields = ['nome', 'criado_por','criado_em', 'data_implantacao', 'dias_acesso', ]
+    fields = ['nome', 'criado_por','criado_em', 'data_implantacao', 'get_dias', ]
     #add_fields = ('descricao',)
-    list_display = ('descricao', 'criado_por', 'criado_em', 'data_implantacao', 'dias_acesso',)
-    readonly_fields = ('criado_por','criado_em', 'dias_acesso')
+    list_display = ('descricao', 'criado_por', 'criado_em', 'data_implantacao', 'get_dias',)
+    readonly_fields = ('criado_por','criado_em', 'get_dias')
     ordering = ('-criado_em',)  
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).com_dias()
+
+    def get_dias(self, obj):
+        return getattr(obj, 'dias', None)
+    get_dias.short_description = 'Dias de Acesso'
+
 class ItemProducaoInline(admin.TabularInline):
     model = ItemProducao
     extra = 0
@@ -50,6 +65,16 @@ class ItemProducaoInline(admin.TabularInline):
         return f"R$ {total:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
     preview_total.short_description = "Total do item"
 
+    # obj é a Producao do formulário pai; mês fechado fica só leitura
+    def has_add_permission(self, request, obj=None):
+        return not _mes_fechado(obj) and super().has_add_permission(request, obj)
+
+    def has_change_permission(self, request, obj=None):
+        return not _mes_fechado(obj) and super().has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return not _mes_fechado(obj) and super().has_delete_permission(request, obj)
+
 
 class ProducaoInline(admin.TabularInline):
     model = Producao
@@ -71,26 +96,39 @@ class PacienteAdmin(admin.ModelAdmin):
     readonly_fields = ('criado_por',)
     ordering = ('hospital', 'setor', 'numero',)  
 
+    list_select_related = ('hospital', 'setor', 'convenio')
+
+    def get_queryset(self, request):
+        # dias de acesso e produção vêm anotados na mesma consulta da lista (sem query por linha)
+        ultimo_acesso = (Acesso.objects
+                         .filter(paciente=OuterRef('pk'))
+                         .order_by('-data_implantacao', '-pk'))
+        producao = (Producao.objects
+                    .filter(paciente=OuterRef('pk'))
+                    .values('paciente')
+                    .annotate(s=Sum('total_dia'))
+                    .values('s'))
+        decimal = DecimalField(max_digits=14, decimal_places=2)
+        return super().get_queryset(request).annotate(
+            _dias_acesso=Subquery(ultimo_acesso.com_dias().values('dias')[:1]),
+            _producao=Coalesce(Subquery(producao, output_field=decimal), Value(Decimal("0")), output_field=decimal),
+        )
+
     def get_dias_acesso(self, obj):
-        # Consulta relacionada para obter o campo 'dias_acesso' do modelo Acesso
-        acessos = Acesso.objects.filter(paciente=obj)
-        if acessos.exists():
-            return acessos.latest('data_implantacao').dias_acesso
-        return None
+        return obj._dias_acesso
 
     get_dias_acesso.short_description = 'Dias de Acesso'
+    get_dias_acesso.admin_order_field = '_dias_acesso'
 
     def get_producao(self, obj):
-        total = (Producao.objects
-                 .filter(paciente=obj)
-                 .aggregate(s=Coalesce(Sum('total_dia'), Value(Decimal("0"))))
-                 ['s'])
+        total = obj._producao
         # se você preferir mostrar “-” quando for zero, descomente abaixo:
         # if total == 0:
         #     return "-"
         return f"R$ {total:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
     get_producao.short_description = 'Produção'
+    get_producao.admin_order_field = '_producao'
     
     def get_fields(self, request, obj=None):
         # Se estiver criando um novo paciente, use os campos de criação
@@ -228,9 +266,18 @@ class CondutaAdmin(admin.ModelAdmin):
 
 class AcessoAdmin(admin.ModelAdmin):
     add_fields = ('nome', 'paciente', 'data_implantacao')
-    edit_fields = ('nome', 'paciente', 'data_implantacao','criado_por',)     
-    
-    readonly_fields = ('criado_por', 'dias_acesso')    
+    edit_fields = ('nome', 'paciente', 'data_implantacao', 'get_dias', 'criado_por',)     
+    list_display = ('nome', 'paciente', 'data_implantacao', 'get_dias')
+    list_select_related = ('nome', 'paciente', 'paciente__hospital')
+    readonly_fields = ('criado_por', 'get_dias')    
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).com_dias()
+
+    def get_dias(self, obj):
+        return getattr(obj, 'dias', None)
+    get_dias.short_description = 'Dias de Acesso'
+    get_dias.admin_order_field = 'dias'
 
     def get_fields(self, request, obj=None):
         # Se estiver criando um novo paciente, use os campos de criação
@@ -256,6 +303,7 @@ class ProducaoAdmin(admin.ModelAdmin):
     ordering = ('-data', '-id')
     date_hierarchy = 'data'
     autocomplete_fields = ['paciente']
+    actions = ['recomputar_total_dia']
 
     def paciente_hospital(self, obj):
         return getattr(getattr(obj.paciente, 'hospital', None), 'nome', '-')
@@ -270,12 +318,25 @@ class ProducaoAdmin(admin.ModelAdmin):
     def get_fields(self, request, obj=None):
         return self.add_fields if not obj else self.edit_fields
 
+    def has_change_permission(self, request, obj=None):
+        return not _mes_fechado(obj) and super().has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return not _mes_fechado(obj) and super().has_delete_permission(request, obj)
+
     def save_model(self, request, obj, form, change):
         if not change and getattr(obj, "criado_por_id", None) is None:
             obj.criado_por = request.user
         super().save_model(request, obj, form, change)
 
-    # ação opcional para recomputar totais se você editar itens via shell/import
+    def save_formset(self, request, form, formset, change):
+        if formset.model == ItemProducao:
+            instances = formset.save(commit=False)
+            form.instance.salvar_itens(instances, removidos=formset.deleted_objects)
+        else:
+            formset.save()
+
+    # ação para corrigir totais apontados por `manage.py verificar_totais`
     @admin.action(description="Recomputar total do dia")
     def recomputar_total_dia(self, request, queryset):
         for p in queryset:
@@ -297,6 +358,172 @@ class ProcedimentoValorAdmin(admin.ModelAdmin):
     search_fields = ('procedimento__nome', 'hospital__nome', 'convenio__nome')
     autocomplete_fields = ['procedimento', 'hospital', 'convenio']
     ordering = ('procedimento', 'hospital', '-vigencia_inicio')
+    actions = ['simular_reprecificacao', 'reprecificar_producao']
+
+    # reprecifica os itens já lançados nas vigências selecionadas (ver core.reprecificacao)
+    @admin.action(description="Simular reprecificação da produção (não grava)")
+    def simular_reprecificacao(self, request, queryset):
+        for tarifa in queryset.select_related('procedimento', 'hospital', 'convenio'):
+            grupos = simular(**escopo_da_tarifa(tarifa))
+            alterados = [g for g in grupos if g['delta'] and not g['bloqueado']]
+            bloqueado = sum((g['delta'] for g in grupos if g['bloqueado']), Decimal("0"))
+            msg = (
+                f"{tarifa}: {sum(g['itens'] for g in alterados)} item(ns) em {len(alterados)} dia(s)/convênio, "
+                f"diferença de R$ {sum((g['delta'] for g in alterados), Decimal('0')):,.2f}"
+            )
+            if bloqueado:
+                msg += f" (R$ {bloqueado:,.2f} em meses fechados, não seriam alterados)"
+            self.message_user(request, msg, messages.INFO)
+
+    @admin.action(description="Reprecificar produção pelas vigências selecionadas")
+    def reprecificar_producao(self, request, queryset):
+        for tarifa in queryset.select_related('procedimento', 'hospital', 'convenio'):
+            r = reprecificar(**escopo_da_tarifa(tarifa))
+            msg = (
+                f"{tarifa}: {r['itens']} item(ns) reprecificado(s) em {r['producoes']} produção(ões), "
+                f"diferença de R$ {r['delta']:,.2f}"
+            )
+            if r['bloqueados']:
+                msg += f" (R$ {r['bloqueados']:,.2f} em meses fechados ficaram de fora)"
+            self.message_user(request, msg, messages.SUCCESS)
+
+# ----------------------------
+# Fechamento mensal
+# ----------------------------
+class FechamentoItemInline(admin.TabularInline):
+    model = FechamentoItem
+    extra = 0
+    fields = ['hospital', 'convenio', 'procedimento', 'usuario', 'quantidade', 'total']
+    readonly_fields = fields
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('hospital', 'convenio', 'procedimento', 'usuario')
+
+
+@admin.register(Fechamento)
+class FechamentoAdmin(admin.ModelAdmin):
+    # fechar é pelo comando `manage.py fechar_mes`; excluir aqui reabre o mês
+    list_display = ('mes_fmt', 'fechado_em', 'fechado_por', 'total')
+    readonly_fields = ('mes', 'fechado_em', 'fechado_por')
+    inlines = [FechamentoItemInline]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('fechado_por').annotate(_total=Sum('itens__total'))
+
+    def mes_fmt(self, obj):
+        return f"{obj.mes:%m/%Y}"
+    mes_fmt.short_description = 'Mês'
+    mes_fmt.admin_order_field = 'mes'
+
+    def total(self, obj):
+        return f"R$ {obj._total or 0:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    total.short_description = 'Total'
+    total.admin_order_field = '_total'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        # mês com produção arquivada só reabre depois da restauração
+        if obj is not None:
+            try:
+                arquivo.verificar_reabertura(obj.mes)
+            except ValidationError:
+                return False
+        return super().has_delete_permission(request, obj)
+
+# ----------------------------
+# Arquivo (só leitura; `manage.py arquivar_pacientes` arquiva)
+# ----------------------------
+class SomenteLeitura:
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class AcessoArquivoInline(SomenteLeitura, admin.TabularInline):
+    model = AcessoArquivo
+    fields = ['nome', 'data_implantacao', 'dias_acesso', 'criado_por', 'criado_em']
+    readonly_fields = fields
+    ordering = ('-data_implantacao',)
+
+
+class ObservacaoArquivoInline(SomenteLeitura, admin.TabularInline):
+    model = ObservacaoArquivo
+    fields = ['descricao', 'criado_por', 'criado_em']
+    readonly_fields = fields
+    ordering = ('-criado_em',)
+
+
+class CondutaArquivoInline(SomenteLeitura, admin.TabularInline):
+    model = CondutaArquivo
+    fields = ['descricao', 'criado_por', 'criado_em']
+    readonly_fields = fields
+    ordering = ('-criado_em',)
+
+
+class ProducaoArquivoInline(SomenteLeitura, admin.TabularInline):
+    model = ProducaoArquivo
+    fields = ['data', 'total_dia', 'criado_por']
+    readonly_fields = fields
+    show_change_link = True
+
+
+class ItemProducaoArquivoInline(SomenteLeitura, admin.TabularInline):
+    model = ItemProducaoArquivo
+    fields = ['procedimento', 'quantidade', 'valor_unitario']
+    readonly_fields = fields
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('procedimento')
+
+
+@admin.register(PacienteArquivo)
+class PacienteArquivoAdmin(SomenteLeitura, admin.ModelAdmin):
+    inlines = [CondutaArquivoInline, AcessoArquivoInline, ObservacaoArquivoInline, ProducaoArquivoInline]
+    list_display = ('nome', 'hospital', 'registro', 'convenio', 'alta_em', 'arquivado_em')
+    list_filter = ('hospital', 'alta_em')
+    list_select_related = ('hospital', 'convenio')
+    search_fields = ('nome', 'numero', 'registro')
+    date_hierarchy = 'alta_em'
+    actions = ['restaurar']
+
+    @admin.action(description="Restaurar pacientes selecionados", permissions=['restaurar'])
+    def restaurar(self, request, queryset):
+        try:
+            r = arquivo.restaurar(list(queryset.values_list('pk', flat=True)))
+        except ValidationError as e:
+            self.message_user(request, e.messages[0], messages.ERROR)
+            return
+        self.message_user(
+            request,
+            f"{r.get('paciente', 0)} paciente(s) restaurado(s) com {r.get('producao', 0)} produção(ões).",
+            messages.SUCCESS,
+        )
+
+    def has_restaurar_permission(self, request):
+        return request.user.has_perm('core.add_paciente')
+
+
+@admin.register(ProducaoArquivo)
+class ProducaoArquivoAdmin(SomenteLeitura, admin.ModelAdmin):
+    inlines = [ItemProducaoArquivoInline]
+    list_display = ('paciente', 'data', 'total_dia')
+    list_select_related = ('paciente',)
+    search_fields = ('paciente__nome',)
+    date_hierarchy = 'data'
 
 
 admin.site.register(Paciente, PacienteAdmin)
@@ -0,0 +1,176 @@
+# core/arquivo.py
+"""
+Arquivamento de pacientes com alta antiga.
+
+`arquivar` move os pacientes com alta há mais de N meses, com acessos,
+observações, condutas, produções e itens, para as tabelas *Arquivo (mesmas
+colunas, mesmos ids), em transações de `lote` pacientes. `restaurar` faz o
+caminho inverso. Listas, busca, visita e painel passam a ler só os internados
+e as altas recentes.
+
+Por padrão só é arquivado quem tem toda a produção em meses fechados: o
+faturamento desses meses já está congelado em FechamentoItem. Um mês com
+produção arquivada não pode ser reaberto antes da restauração.
+
+As linhas passam de uma tabela para a outra com INSERT ... SELECT (nada é
+carregado em memória e criado_em fica como estava) e os deletes vão direto ao
+banco, sem os signals por linha: ProducaoDiaria (e com ela painel e
+fragmentos), cards e quadro da visita são acertados uma vez por lote.
+"""
+import calendar
+from datetime import date
+
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from . import visita
+from .evolucao import invalidar_cards
+from .models import (
+    Acesso, AcessoArquivo, Conduta, CondutaArquivo, Fechamento, ItemProducao, ItemProducaoArquivo,
+    Observacao, ObservacaoArquivo, Paciente, PacienteArquivo, Producao, ProducaoArquivo, ProducaoDiaria,
+)
+
+MESES = 12
+LOTE = 200
+
+# (tabela quente, tabela do arquivo, caminho até o paciente), dos pais para os filhos
+TABELAS = [
+    (Paciente, PacienteArquivo, "pk"),
+    (Acesso, AcessoArquivo, "paciente"),
+    (Observacao, ObservacaoArquivo, "paciente"),
+    (Conduta, CondutaArquivo, "paciente"),
+    (Producao, ProducaoArquivo, "paciente"),
+    (ItemProducao, ItemProducaoArquivo, "producao__paciente"),
+]
+
+
+def limite(meses=MESES, hoje=None):
+    """Mesmo dia `meses` meses antes de hoje (último dia do mês, se não existir)."""
+    hoje = hoje or timezone.localdate()
+    ano, mes = divmod(hoje.year * 12 + hoje.month - 1 - meses, 12)
+    return date(ano, mes + 1, min(hoje.day, calendar.monthrange(ano, mes + 1)[1]))
+
+
+def candidatos(meses=MESES):
+    return Paciente.objects.filter(alta=True, alta_em__lt=limite(meses))
+
+
+def _mover(pacientes, origem, destino):
+    """Copia as linhas dos pacientes de um lado para o outro e apaga na origem; devolve {modelo: linhas}."""
+    contagem = {}
+    qn = connection.ops.quote_name
+    for par in TABELAS:
+        de, para, caminho = par[origem], par[destino], par[2]
+        # as colunas da tabela quente; o arquivo só acrescenta arquivado_em
+        campos = [f.attname for f in par[0]._meta.concrete_fields]
+        extra = {}
+        if para is PacienteArquivo:
+            extra["arquivado_em"] = models.Value(timezone.now(), output_field=models.DateTimeField())
+        sql, params = (
+            de.objects.filter(**{f"{caminho}__in": pacientes}).order_by()
+            .values(*campos, **extra).query.sql_with_params()
+        )
+        colunas = ", ".join(qn(para._meta.get_field(c).column) for c in [*campos, *extra])
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {qn(para._meta.db_table)} ({colunas}) {sql}", params)
+            contagem[par[0]] = cursor.rowcount
+    # DELETE direto, sem collector nem signals: os acertos são feitos por lote em _acertar.
+    # Sem Fechamento.verificar de propósito: o arquivo leva justamente meses fechados
+    # (congelados em FechamentoItem) e verificar_reabertura impede reabri-los
+    for par in reversed(TABELAS):
+        de, caminho = par[origem], par[2]
+        sql, params = de.objects.filter(**{f"{caminho}__in": pacientes}).values("pk").query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {qn(de._meta.db_table)} WHERE {qn(de._meta.pk.column)} IN ({sql})", params,
+            )
+    return contagem
+
+
+def _chaves(producoes, pacientes):
+    """Chaves de ProducaoDiaria das produções (data, paciente) movidas."""
+    return {(data, *pacientes[paciente_id]) for data, paciente_id in producoes}
+
+
+def _acertar(pacientes, chaves):
+    # recalcular também invalida o painel e os fragmentos de producao_detalhe
+    ProducaoDiaria.recalcular(chaves)
+    visita.invalidar_todos()
+    for pk, (hospital_id, _) in pacientes.items():
+        invalidar_cards(pk, hospital_id)
+
+
+def _somar(resumo, contagem):
+    for model, n in contagem.items():
+        chave = model._meta.model_name
+        resumo[chave] = resumo.get(chave, 0) + n
+
+
+def arquivar(meses=MESES, lote=LOTE, meses_abertos=False):
+    """
+    Arquiva os pacientes com alta antes de limite(meses). Sem `meses_abertos`,
+    pula quem tem produção em mês não fechado. Devolve as linhas movidas por
+    tabela ({"paciente": n, "producao": n, ...}) e "ignorados".
+    """
+    resumo = {"ignorados": 0}
+    pks = list(candidatos(meses).order_by("pk").values_list("pk", flat=True))
+    for i in range(0, len(pks), lote):
+        with transaction.atomic():
+            # confere de novo com a linha travada: pode ter sido reinternado desde a lista
+            pacientes = {
+                pk: (hospital_id, convenio_id)
+                for pk, hospital_id, convenio_id in candidatos(meses).select_for_update()
+                .filter(pk__in=pks[i:i + lote]).values_list("pk", "hospital_id", "convenio_id")
+            }
+            producoes = list(Producao.objects.filter(paciente_id__in=pacientes).values_list("data", "paciente_id"))
+            if not meses_abertos:
+                fechados = Fechamento.meses_fechados()
+                abertos = {pk for data, pk in producoes if data.replace(day=1) not in fechados}
+                resumo["ignorados"] += len(abertos)
+                pacientes = {pk: chave for pk, chave in pacientes.items() if pk not in abertos}
+                producoes = [(data, pk) for data, pk in producoes if pk in pacientes]
+            if not pacientes:
+                continue
+            _somar(resumo, _mover(list(pacientes), origem=0, destino=1))
+            _acertar(pacientes, _chaves(producoes, pacientes))
+    return resumo
+
+
+def restaurar(pacientes, lote=LOTE):
+    """Devolve os pacientes arquivados (ids) às tabelas quentes; ValidationError se o registro foi recadastrado."""
+    pks = sorted(set(pacientes))
+    resumo = {}
+    for i in range(0, len(pks), lote):
+        with transaction.atomic():
+            arquivados = {
+                pk: (hospital_id, convenio_id, registro)
+                for pk, hospital_id, convenio_id, registro in PacienteArquivo.objects.select_for_update()
+                .filter(pk__in=pks[i:i + lote]).values_list("pk", "hospital_id", "convenio_id", "registro")
+            }
+            # o censo pode ter cadastrado de novo o mesmo registro no hospital enquanto estava arquivado
+            registros = {(h, r) for h, _, r in arquivados.values() if r}
+            conflito = sorted(
+                r for h, r in Paciente.objects.filter(registro__in=[r for _, r in registros])
+                .values_list("hospital_id", "registro")
+                if (h, r) in registros
+            )
+            if conflito:
+                raise ValidationError(f"Registro(s) já cadastrado(s) de novo no hospital: {', '.join(conflito)}")
+            producoes = list(
+                ProducaoArquivo.objects.filter(paciente_id__in=arquivados).values_list("data", "paciente_id")
+            )
+            _somar(resumo, _mover(list(arquivados), origem=1, destino=0))
+            pacientes = {pk: (h, c) for pk, (h, c, _) in arquivados.items()}
+            _acertar(pacientes, _chaves(producoes, pacientes))
+    return resumo
+
+
+def verificar_reabertura(mes):
+    """ValidationError se o mês (primeiro dia) tem produção arquivada: reabrir sem ela mudaria o faturamento."""
+    fim = date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+    n = ProducaoArquivo.objects.filter(data__gte=mes, data__lt=fim).values("paciente").distinct().count()
+    if n:
+        raise ValidationError(
+            f"O mês {mes:%m/%Y} tem produção de {n} paciente(s) arquivado(s); restaure-os antes de reabrir."
+        )
@@ -0,0 +1,165 @@
+# core/censo.py
+"""
+Importação do censo diário dos hospitais (CSV) para Paciente.
+
+Cada linha é casada com o paciente por (hospital, registro) e gravada com
+bulk_create(update_conflicts=True), em lotes. Hospital, setor e convênio vêm
+por nome e são resolvidos em mapas carregados uma vez. Pacientes com registro
+que não aparecem no censo do hospital recebem alta.
+
+bulk_create não passa por Paciente.save() nem pelos signals, então as colunas
+busca e alta_em são calculadas aqui e as trocas de convênio/nome são
+repassadas para ProducaoDiaria e para os fragmentos de produção no final.
+"""
+import csv
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from . import fragmentos, painel, visita
+from .models import Convenio, Hospital, Paciente, Producao, ProducaoDiaria, Setor, normalizar_busca
+
+OBRIGATORIAS = ("registro", "nome")
+# coluna opcional do CSV -> atributo de Paciente
+OPCIONAIS = {"setor": "setor_id", "convenio": "convenio_id", "numero": "numero", "idade": "idade", "diagnostico": "diagnostico"}
+LOTE = 1000
+
+
+def ler_csv(caminho):
+    """Lê o arquivo (vírgula, ponto e vírgula ou tab) e devolve as linhas como dicts de colunas minúsculas."""
+    with open(caminho, encoding="utf-8-sig", newline="") as f:
+        amostra = f.read(4096)
+        f.seek(0)
+        try:
+            dialeto = csv.Sniffer().sniff(amostra, delimiters=";,\t")
+        except csv.Error:
+            dialeto = csv.excel
+        leitor = csv.DictReader(f, dialect=dialeto)
+        leitor.fieldnames = [normalizar_busca(c).strip() for c in leitor.fieldnames or []]
+        return list(leitor)
+
+
+def _mapa(model):
+    return {normalizar_busca(nome).strip(): pk for pk, nome in model.objects.values_list("pk", "nome")}
+
+
+def _resolver_cadastros(linhas, model, coluna, rotulo, criar, usuario):
+    mapa = _mapa(model)
+    faltando = {
+        (l.get(coluna) or "").strip() for l in linhas
+        if (l.get(coluna) or "").strip() and normalizar_busca(l[coluna]).strip() not in mapa
+    }
+    if faltando and not criar:
+        raise ValidationError(f"{rotulo} não cadastrados: {', '.join(sorted(faltando))} (use --criar-cadastros)")
+    if faltando:
+        model.objects.bulk_create([model(nome=nome, criado_por=usuario) for nome in sorted(faltando)])
+        mapa = _mapa(model)
+    return mapa
+
+
+def importar(linhas, hospital=None, criar_cadastros=False, dar_alta=True, usuario=None, lote=LOTE):
+    """
+    Grava as linhas do censo. `hospital` fixa o hospital de todas as linhas
+    (senão vem da coluna hospital). Devolve {"criados", "atualizados", "altas"}.
+    """
+    colunas = set(linhas[0]) if linhas else set()
+    faltando = [c for c in OBRIGATORIAS if c not in colunas]
+    if not hospital and "hospital" not in colunas:
+        faltando.append("hospital")
+    if faltando:
+        raise ValidationError(f"Colunas obrigatórias ausentes: {', '.join(faltando)}")
+    presentes = [c for c in OPCIONAIS if c in colunas]
+
+    hospitais = {} if hospital else _mapa(Hospital)
+    setores = _resolver_cadastros(linhas, Setor, "setor", "Setores", criar_cadastros, usuario) if "setor" in colunas else {}
+    convenios = _resolver_cadastros(linhas, Convenio, "convenio", "Convênios", criar_cadastros, usuario) if "convenio" in colunas else {}
+
+    erros, censo = [], {}
+    for n, l in enumerate(linhas, start=2):
+        hospital_id = hospital.pk if hospital else hospitais.get(normalizar_busca(l.get("hospital")).strip())
+        registro = (l.get("registro") or "").strip()
+        nome = (l.get("nome") or "").strip()
+        if not hospital_id:
+            erros.append(f"linha {n}: hospital '{l.get('hospital')}' não cadastrado")
+            continue
+        if not registro or not nome:
+            erros.append(f"linha {n}: registro e nome são obrigatórios")
+            continue
+        idade = (l.get("idade") or "").strip()
+        if idade and not idade.isdigit():
+            erros.append(f"linha {n}: idade inválida '{idade}'")
+            continue
+        # a última ocorrência do registro no arquivo vale
+        censo[(hospital_id, registro)] = {
+            "nome": nome,
+            "setor_id": setores.get(normalizar_busca(l.get("setor")).strip()),
+            "convenio_id": convenios.get(normalizar_busca(l.get("convenio")).strip()),
+            "numero": (l.get("numero") or "").strip() or None,
+            "idade": int(idade) if idade else None,
+            "diagnostico": (l.get("diagnostico") or "").strip(),
+        }
+    if erros:
+        raise ValidationError(erros)
+
+    hospitais_censo = {h for h, _ in censo}
+    existentes = {
+        (h, reg): (pk, conv, nome, numero)
+        for pk, h, reg, conv, nome, numero in Paciente.objects
+        .filter(hospital_id__in=hospitais_censo, registro__isnull=False)
+        .values_list("pk", "hospital_id", "registro", "convenio_id", "nome", "numero")
+    }
+
+    pacientes, convenio_trocado, nome_trocado = [], {}, set()
+    for (hospital_id, registro), dados in censo.items():
+        atual = existentes.get((hospital_id, registro))
+        campos = {"nome": dados["nome"], **{OPCIONAIS[c]: dados[OPCIONAIS[c]] for c in presentes}}
+        numero = campos.get("numero", atual[3] if atual else None)
+        if atual:
+            pk, conv_antigo, nome_antigo, _ = atual
+            if "convenio" in presentes and campos["convenio_id"] != conv_antigo:
+                convenio_trocado[pk] = (hospital_id, conv_antigo, campos["convenio_id"])
+            if dados["nome"] != nome_antigo:
+                nome_trocado.add((pk, hospital_id))
+        pacientes.append(Paciente(
+            hospital_id=hospital_id, registro=registro, alta=False, criado_por=usuario,
+            busca=normalizar_busca(dados["nome"], numero, registro), **campos,
+        ))
+
+    with transaction.atomic():
+        for i in range(0, len(pacientes), lote):
+            Paciente.objects.bulk_create(
+                pacientes[i:i + lote],
+                update_conflicts=True,
+                unique_fields=["hospital", "registro"],
+                update_fields=["nome", "busca", "alta", "alta_em", *presentes],
+            )
+
+        altas = 0
+        if dar_alta:
+            for hospital_id in hospitais_censo:
+                altas += (
+                    Paciente.objects
+                    .filter(hospital_id=hospital_id, alta=False, registro__isnull=False)
+                    .exclude(registro__in=[reg for h, reg in censo if h == hospital_id])
+                    .update(alta=True, alta_em=timezone.localdate())
+                )
+
+        # o que os signals de Paciente fariam num save() comum
+        alterados = set(convenio_trocado) | {pk for pk, _ in nome_trocado}
+        datas = {}
+        for pk, data in Producao.objects.filter(paciente_id__in=alterados).values_list("paciente_id", "data"):
+            datas.setdefault(pk, set()).add(data)
+        chaves = []
+        for pk, (hospital_id, antigo, novo) in convenio_trocado.items():
+            for data in datas.get(pk, ()):
+                chaves += [(data, hospital_id, antigo), (data, hospital_id, novo)]
+        ProducaoDiaria.recalcular(chaves)
+        for pk, hospital_id in nome_trocado:
+            for data in datas.get(pk, ()):
+                fragmentos.invalidar(data, hospital_id)
+        painel.invalidar()
+        visita.invalidar_todos()
+
+    atualizados = sum(1 for chave in censo if chave in existentes)
+    return {"criados": len(censo) - atualizados, "atualizados": atualizados, "altas": altas}
@@ -0,0 +1,97 @@
+# core/evolucao.py
+"""
+Contexto dos cards da evolução do paciente (última observação, último acesso,
+última conduta e produção do dia).
+
+Os quatro cards saem de uma única consulta, com uma subconsulta correlacionada
+por card devolvendo JSON, e o resultado fica em cache por paciente/dia até que
+algum desses registros seja gravado (signals em core.signals).
+"""
+from decimal import Decimal
+
+from django.contrib.postgres.expressions import ArraySubquery
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import JSONField, OuterRef, Subquery
+from django.db.models.functions import JSONObject
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Acesso, Conduta, ItemProducao, Observacao, Paciente, Producao
+
+CARDS_TTL = 60 * 60 * 24
+
+
+def _chave(paciente_id, hoje):
+    return f"evolucao:cards:{paciente_id}:{hoje:%Y-%m-%d}"
+
+
+def _ultimo(qs, **campos):
+    return Subquery(qs.values(j=JSONObject(**campos))[:1], output_field=JSONField())
+
+
+def _linha(paciente_id, hoje):
+    obs = Observacao.objects.filter(paciente=OuterRef("pk")).order_by("-criado_em", "-pk")
+    acesso = Acesso.objects.com_dias().filter(paciente=OuterRef("pk")).order_by("-data_implantacao", "-pk")
+    conduta = Conduta.objects.filter(paciente=OuterRef("pk")).order_by("-criado_em", "-pk")
+    prod = Producao.objects.filter(paciente=OuterRef("pk"), data=hoje).order_by("-pk")
+    itens = (
+        ItemProducao.objects
+        .filter(producao=OuterRef("pk"))
+        .order_by("procedimento__nome")
+        .values(j=JSONObject(procedimento="procedimento__nome", quantidade="quantidade"))
+    )
+    return Paciente.objects.filter(pk=paciente_id).values(
+        last_obs=_ultimo(obs, descricao="descricao", criado_em="criado_em", criado_por="criado_por__username"),
+        last_acesso=_ultimo(acesso, nome="nome__descricao", data_implantacao="data_implantacao", dias="dias"),
+        last_conduta=_ultimo(conduta, descricao="descricao__descricao", criado_em="criado_em", criado_por="criado_por__username"),
+        prod_hoje=_ultimo(prod, total_dia="total_dia", itens=ArraySubquery(itens)),
+    )
+
+
+def _converter(linha):
+    # JSON devolve datas e decimais como texto/número; volta para os tipos que os templates esperam
+    obs, acesso, conduta, prod = (linha.get(k) for k in ("last_obs", "last_acesso", "last_conduta", "prod_hoje"))
+    for card in (obs, conduta):
+        if card:
+            card["criado_em"] = parse_datetime(card["criado_em"])
+    if acesso:
+        acesso["data_implantacao"] = parse_date(acesso["data_implantacao"])
+    if prod:
+        if prod["total_dia"] is not None:
+            prod["total_dia"] = Decimal(str(prod["total_dia"]))
+        prod["itens"] = prod["itens"] or []
+    return {"last_obs": obs, "last_acesso": acesso, "last_conduta": conduta, "prod_hoje": prod}
+
+
+def _consultar(paciente_id, hoje):
+    return _converter(_linha(paciente_id, hoje).first() or {})
+
+
+def cards_context(paciente):
+    hoje = timezone.localdate()
+    chave = _chave(paciente.pk, hoje)
+    cards = cache.get(chave)
+    if cards is None:
+        cards = _consultar(paciente.pk, hoje)
+        cache.set(chave, cards, CARDS_TTL)
+    return {"paciente": paciente, "hoje": hoje, **cards}
+
+
+async def acards(paciente_id):
+    """Versão async de cards_context para as views async (sem o paciente no contexto)."""
+    hoje = timezone.localdate()
+    chave = _chave(paciente_id, hoje)
+    cards = await cache.aget(chave)
+    if cards is None:
+        cards = _converter(await _linha(paciente_id, hoje).afirst() or {})
+        await cache.aset(chave, cards, CARDS_TTL)
+    return {"hoje": hoje, **cards}
+
+
+def invalidar_cards(paciente_id, hospital_id=None):
+    # depois do commit, para ninguém recolocar no cache o estado anterior
+    if paciente_id:
+        transaction.on_commit(lambda: cache.delete(_chave(paciente_id, timezone.localdate())))
+        from . import visita
+        visita.invalidar_paciente(paciente_id, hospital_id)
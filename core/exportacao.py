@@ -0,0 +1,94 @@
+# core/exportacao.py
+"""
+Exportação da produção item a item (faturamento) em CSV.
+
+Usado pela view producao_exportar (StreamingHttpResponse) e pelo comando
+exportar_producao. As linhas saem de QuerySet.iterator(chunk_size=...), que
+no PostgreSQL usa cursor no servidor: a memória não cresce com o período.
+
+Sob ASGI a view usa alinhas_csv, com o mesmo iterator lido em lotes: o StreamingHttpResponse
+do Django 4.2 consome um gerador síncrono com sync_to_async(list), o que
+montaria o arquivo inteiro em memória antes de enviar.
+"""
+import csv
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.db.models import DecimalField, ExpressionWrapper, F
+
+from .models import ItemProducao
+
+CABECALHO = [
+    "hospital", "convenio", "paciente", "registro", "data",
+    "procedimento", "codigo", "quantidade", "valor_unitario", "total",
+]
+CHUNK_SIZE = 2000
+
+
+def itens_exportacao(hospital=None, convenio=None, de=None, ate=None, procedimento=None):
+    qs = ItemProducao.objects.all()
+    if hospital:
+        qs = qs.filter(producao__paciente__hospital=hospital)
+    if convenio:
+        qs = qs.filter(producao__paciente__convenio=convenio)
+    if de:
+        qs = qs.filter(data__gte=de)
+    if ate:
+        qs = qs.filter(data__lte=ate)
+    if procedimento:
+        qs = qs.filter(procedimento=procedimento)
+    return (
+        qs.annotate(
+            total_item=ExpressionWrapper(
+                F("quantidade") * F("valor_unitario"),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            )
+        )
+        .order_by("data", "producao__paciente__hospital__nome", "producao__paciente__nome", "procedimento__nome", "pk")
+        .values_list(
+            "producao__paciente__hospital__nome", "producao__paciente__convenio__nome",
+            "producao__paciente__nome", "producao__paciente__registro", "data",
+            "procedimento__nome", "procedimento__codigo", "quantidade", "valor_unitario", "total_item",
+        )
+    )
+
+
+class _Eco:
+    """Buffer de uma linha só: csv.writer escreve e a string volta para o gerador."""
+    def write(self, valor):
+        return valor
+
+
+def _cabecalho(writer):
+    # BOM para o Excel abrir acentos corretamente
+    return "\ufeff" + writer.writerow(CABECALHO)
+
+
+def _linha(writer, linha):
+    return writer.writerow(["" if v is None else v for v in linha])
+
+
+def linhas_csv(qs, chunk_size=CHUNK_SIZE):
+    writer = csv.writer(_Eco(), delimiter=";")
+    yield _cabecalho(writer)
+    for linha in qs.iterator(chunk_size=chunk_size):
+        yield _linha(writer, linha)
+
+
+def _lote(linhas, chunk_size):
+    return list(islice(linhas, chunk_size))
+
+
+async def alinhas_csv(qs, chunk_size=CHUNK_SIZE):
+    """Versão async de linhas_csv (ASGI): um lote de chunk_size linhas por ida à thread do banco."""
+    writer = csv.writer(_Eco(), delimiter=";")
+    yield _cabecalho(writer)
+    # como o QuerySet.aiterator, que no Django 4.2 abre a consulta de values_list() ainda no
+    # contexto async (SynchronousOnlyOperation); o gerador só toca no banco dentro do sync_to_async
+    linhas = qs.iterator(chunk_size=chunk_size)
+    while True:
+        lote = await sync_to_async(_lote)(linhas, chunk_size)
+        for linha in lote:
+            yield _linha(writer, linha)
+        if len(lote) < chunk_size:
+            break
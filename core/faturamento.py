@@ -0,0 +1,128 @@
+# core/faturamento.py
+"""
+Planilhas mensais de faturamento: um arquivo XLSX por hospital, uma aba por
+convênio, itens agrupados por procedimento com subtotal.
+
+A montagem é pesada demais para um request, então roda pelo comando
+gerar_planilhas_faturamento, que distribui os hospitais num pool de processos.
+Cada processo abre a sua própria conexão com o banco.
+"""
+import calendar
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from decimal import Decimal
+from itertools import groupby
+
+import django
+from django.db import connections
+
+CABECALHO = ["Data", "Paciente", "Registro", "Procedimento", "Quantidade", "Valor unitário", "Total", "Valor tabela"]
+SEM_CONVENIO = "Sem convênio"
+
+
+def periodo(ano, mes):
+    return date(ano, mes, 1), date(ano, mes, calendar.monthrange(ano, mes)[1])
+
+
+def _nome_aba(nome, usados):
+    # Excel: até 31 caracteres, sem []:*?/\ e sem repetir
+    base = re.sub(r"[\[\]:*?/\\]", "-", nome)[:31] or SEM_CONVENIO
+    nome, n = base, 2
+    while nome.lower() in usados:
+        sufixo = f" ({n})"
+        nome, n = base[:31 - len(sufixo)] + sufixo, n + 1
+    usados.add(nome.lower())
+    return nome
+
+
+def _itens(hospital_id, inicio, fim):
+    from .models import ItemProducao
+
+    return list(
+        ItemProducao.objects
+        .filter(producao__paciente__hospital_id=hospital_id, data__range=(inicio, fim))
+        # nome de convênio pode repetir: o id desempata, senão o groupby de gerar_planilha
+        # intercalaria os dois e partiria cada um em várias abas
+        .order_by(
+            "producao__paciente__convenio__nome", "producao__paciente__convenio_id",
+            "procedimento__nome", "data", "producao__paciente__nome", "pk",
+        )
+        .values_list(
+            "producao__paciente__convenio_id", "producao__paciente__convenio__nome",
+            "procedimento_id", "procedimento__nome",
+            "data", "producao__paciente__nome", "producao__paciente__registro",
+            "quantidade", "valor_unitario",
+        )
+    )
+
+
+def gerar_planilha(hospital_id, ano, mes, destino):
+    """Gera a planilha de um hospital no mês e devolve (caminho, nº de itens)."""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font
+
+    from .models import Hospital, ProcedimentoValor
+
+    inicio, fim = periodo(ano, mes)
+    hospital = Hospital.objects.get(pk=hospital_id)
+    itens = _itens(hospital_id, inicio, fim)
+    # preço de tabela na data, para conferir contra o valor gravado no item
+    tabela = ProcedimentoValor.valores_em(
+        {(proc, hospital_id, conv, data) for conv, _, proc, _, data, *_ in itens}
+    )
+
+    negrito = Font(bold=True)
+    wb = Workbook()
+    wb.remove(wb.active)
+    usados = set()
+    for (conv_id, conv_nome), linhas_conv in groupby(itens, key=lambda i: (i[0], i[1])):
+        ws = wb.create_sheet(_nome_aba(conv_nome or SEM_CONVENIO, usados))
+        ws.append(CABECALHO)
+        for cel in ws[1]:
+            cel.font = negrito
+        total_conv = Decimal("0.00")
+        for (proc_id, proc_nome), linhas_proc in groupby(linhas_conv, key=lambda i: (i[2], i[3])):
+            qtd_proc, total_proc = 0, Decimal("0.00")
+            for _, _, _, _, data, paciente, registro, qtd, valor in linhas_proc:
+                total = qtd * valor
+                qtd_proc += qtd
+                total_proc += total
+                ws.append([data, paciente, registro, proc_nome, qtd, valor, total,
+                           tabela[(proc_id, hospital_id, conv_id, data)]])
+                ws.cell(ws.max_row, 1).number_format = "DD/MM/YYYY"
+            ws.append([None, None, None, f"Subtotal {proc_nome}", qtd_proc, None, total_proc])
+            for cel in ws[ws.max_row]:
+                cel.font = negrito
+            total_conv += total_proc
+        ws.append([None, None, None, "Total do convênio", None, None, total_conv])
+        for cel in ws[ws.max_row]:
+            cel.font = negrito
+        for col, largura in zip("ABCDEFGH", (12, 40, 14, 30, 12, 14, 14, 14)):
+            ws.column_dimensions[col].width = largura
+    if not wb.sheetnames:
+        wb.create_sheet("Sem produção").append(["Nenhum item de produção no período."])
+
+    os.makedirs(destino, exist_ok=True)
+    nome = re.sub(r"[^\w-]+", "_", hospital.nome).strip("_") or f"hospital{hospital_id}"
+    caminho = os.path.join(destino, f"faturamento_{ano}-{mes:02d}_{hospital_id}_{nome}.xlsx")
+    wb.save(caminho)
+    return caminho, len(itens)
+
+
+def _iniciar_processo():
+    # no spawn o filho chega sem Django configurado; no fork é no-op
+    django.setup()
+
+
+def gerar_planilhas(ano, mes, destino, hospitais, processos=None):
+    """Gera as planilhas em paralelo; devolve {hospital_id: (caminho, nº de itens)}."""
+    # conexões abertas não podem ser herdadas pelos filhos no fork
+    connections.close_all()
+    resultado = {}
+    with ProcessPoolExecutor(max_workers=processos, initializer=_iniciar_processo) as pool:
+        futuros = {pool.submit(gerar_planilha, h, ano, mes, destino): h for h in hospitais}
+        for futuro in as_completed(futuros):
+            resultado[futuros[futuro]] = futuro.result()
+    return resultado
@@ -0,0 +1,96 @@
+# core/fechamento.py
+"""
+Fechamento mensal do faturamento.
+
+Fechar um mês grava em FechamentoItem a quantidade e o total por hospital ×
+convênio × procedimento × usuário, e a partir daí a produção do mês fica
+bloqueada (Fechamento.verificar). O resumo mensal de um mês fechado lê só
+essa tabela; meses abertos continuam agregando ItemProducao na hora.
+"""
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+
+from .arquivo import verificar_reabertura
+from .faturamento import periodo
+from .models import Fechamento, FechamentoItem, ItemProducao
+
+
+def _agregar_itens(ano, mes, hospital=None, **chaves):
+    """Soma quantidade e total dos itens do mês agrupando pelas `chaves` (alias=caminho)."""
+    inicio, fim = periodo(ano, mes)
+    qs = ItemProducao.objects.filter(data__range=(inicio, fim))
+    if hospital:
+        qs = qs.filter(producao__paciente__hospital=hospital)
+    return (
+        qs.values(**{alias: models.F(caminho) for alias, caminho in chaves.items()})
+        .annotate(
+            qtd=models.Sum("quantidade"),
+            soma=models.Sum(models.F("quantidade") * models.F("valor_unitario")),
+        )
+        .order_by()
+    )
+
+
+def fechar(ano, mes, usuario=None):
+    """Congela os agregados do mês; ValidationError se ele já estiver fechado."""
+    inicio, _ = periodo(ano, mes)
+    try:
+        with transaction.atomic():
+            fechamento = Fechamento.objects.create(mes=inicio, fechado_por=usuario)
+            FechamentoItem.objects.bulk_create(
+                [
+                    FechamentoItem(
+                        fechamento=fechamento,
+                        hospital_id=l["hospital_ref"], convenio_id=l["convenio_ref"],
+                        procedimento_id=l["procedimento_ref"], usuario_id=l["usuario_ref"],
+                        quantidade=l["qtd"] or 0, total=l["soma"] or Decimal("0"),
+                    )
+                    for l in _agregar_itens(
+                        ano, mes,
+                        hospital_ref="producao__paciente__hospital", convenio_ref="producao__paciente__convenio",
+                        procedimento_ref="procedimento", usuario_ref="producao__criado_por",
+                    )
+                ],
+                batch_size=1000,
+            )
+    except IntegrityError:
+        raise ValidationError(f"O mês {inicio:%m/%Y} já está fechado.")
+    return fechamento
+
+
+def reabrir(ano, mes):
+    """
+    Apaga o fechamento do mês (e o snapshot); devolve False se não estava fechado.
+    ValidationError se o mês tem produção arquivada (core.arquivo).
+    """
+    inicio = periodo(ano, mes)[0]
+    verificar_reabertura(inicio)
+    apagados, _ = Fechamento.objects.filter(mes=inicio).delete()
+    return bool(apagados)
+
+
+def resumo_mensal(ano, mes, hospital=None):
+    """
+    Linhas (hospital, convenio, procedimento, usuario, quantidade, total) do mês
+    e o Fechamento, se houver. Mês fechado lê o snapshot, aberto agrega os itens.
+    """
+    inicio, _ = periodo(ano, mes)
+    fechamento = Fechamento.objects.filter(mes=inicio).first()
+    if fechamento:
+        qs = fechamento.itens.all()
+        if hospital:
+            qs = qs.filter(hospital=hospital)
+        linhas = qs.values_list(
+            "hospital__nome", "convenio__nome", "procedimento__nome", "usuario__username",
+            "quantidade", "total",
+        )
+    else:
+        linhas = _agregar_itens(
+            ano, mes, hospital,
+            hospital_nome="producao__paciente__hospital__nome", convenio_nome="producao__paciente__convenio__nome",
+            procedimento_nome="procedimento__nome", usuario_nome="producao__criado_por__username",
+        ).values_list("hospital_nome", "convenio_nome", "procedimento_nome", "usuario_nome", "qtd", "soma")
+    chave = lambda l: tuple(v or "" for v in l[:4])
+    return sorted(linhas, key=chave), fechamento
@@ -1,7 +1,7 @@
 # core/forms.py
 from django import forms
 from django.forms import inlineformset_factory
-from .models import Observacao, Acesso, Conduta, Producao, ItemProducao, CondutaDescricao, AcessoDescricao
+from .models import Observacao, Acesso, Conduta, Producao, ItemProducao, CondutaDescricao, AcessoDescricao, Hospital, Convenio, Procedimento, Setor
 from django.utils import timezone
 
 class ObservacaoForm(forms.ModelForm):
@@ -44,3 +44,71 @@ class ItemProducaoForm(forms.ModelForm):
 ItemProducaoFormSet = inlineformset_factory(
     Producao, ItemProducao, form=ItemProducaoForm, extra=1, can_delete=True
 )
+
+# Filtros da lista de produção
+class ProducaoFiltroForm(forms.Form):
+    de = forms.DateField(required=False, label="De",
+                         widget=forms.DateInput(attrs={"type":"date","class":"form-control"}))
+    ate = forms.DateField(required=False, label="Até",
+                          widget=forms.DateInput(attrs={"type":"date","class":"form-control"}))
+    hospital = forms.ModelChoiceField(queryset=Hospital.objects.order_by("nome"), required=False,
+                                      empty_label="Todos os hospitais",
+                                      widget=forms.Select(attrs={"class":"form-select"}))
+
+# Filtros da exportação de faturamento (mesmos da lista + convênio e procedimento)
+class ExportacaoFiltroForm(ProducaoFiltroForm):
+    convenio = forms.ModelChoiceField(queryset=Convenio.objects.order_by("nome"), required=False,
+                                      empty_label="Todos os convênios",
+                                      widget=forms.Select(attrs={"class":"form-select"}))
+    procedimento = forms.ModelChoiceField(queryset=Procedimento.objects.order_by("nome"), required=False,
+                                          empty_label="Todos os procedimentos",
+                                          widget=forms.Select(attrs={"class":"form-select"}))
+
+# Resumo mensal (fechamento): mês no formato do <input type="month">
+class ResumoMensalForm(forms.Form):
+    mes = forms.DateField(label="Mês", input_formats=["%Y-%m"],
+                          widget=forms.DateInput(format="%Y-%m", attrs={"type":"month","class":"form-control"}))
+    hospital = forms.ModelChoiceField(queryset=Hospital.objects.order_by("nome"), required=False,
+                                      empty_label="Todos os hospitais",
+                                      widget=forms.Select(attrs={"class":"form-select"}))
+
+# Grade de lançamento da visita: hospital, setor e data
+class GradeFiltroForm(forms.Form):
+    hospital = forms.ModelChoiceField(queryset=Hospital.objects.order_by("nome"),
+                                      widget=forms.Select(attrs={"class":"form-select"}))
+    setor = forms.ModelChoiceField(queryset=Setor.objects.order_by("nome"), required=False,
+                                   empty_label="Todos os setores",
+                                   widget=forms.Select(attrs={"class":"form-select"}))
+    data = forms.DateField(widget=forms.DateInput(attrs={"type":"date","class":"form-control"}))
+
+# Uma célula por paciente × procedimento ativo: checkbox nos booleanos, número nos inteiros
+class GradeProducaoForm(forms.Form):
+    def __init__(self, *args, pacientes, procedimentos, quantidades, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pacientes, self.procedimentos = pacientes, procedimentos
+        for pac in pacientes:
+            for proc in procedimentos:
+                atual = quantidades.get((pac.pk, proc.pk), 0)
+                if proc.tipo == Procedimento.TIPO_BOOLEANO:
+                    campo = forms.BooleanField(required=False, initial=bool(atual),
+                                               widget=forms.CheckboxInput(attrs={"class":"form-check-input"}))
+                else:
+                    campo = forms.IntegerField(required=False, min_value=0, initial=atual or None,
+                                               widget=forms.NumberInput(attrs={"class":"form-control form-control-sm","min":"0"}))
+                self.fields[self._nome(pac, proc)] = campo
+
+    @staticmethod
+    def _nome(pac, proc):
+        return f"q_{pac.pk}_{proc.pk}"
+
+    def linhas(self):
+        for pac in self.pacientes:
+            yield pac, [self[self._nome(pac, proc)] for proc in self.procedimentos]
+
+    def celulas(self):
+        """{(paciente_id, procedimento_id): quantidade} a partir de cleaned_data."""
+        return {
+            (pac.pk, proc.pk): int(self.cleaned_data[self._nome(pac, proc)] or 0)
+            for pac in self.pacientes
+            for proc in self.procedimentos
+        }
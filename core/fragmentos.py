@@ -0,0 +1,52 @@
+# core/fragmentos.py
+"""
+Versão do fragmento HTMX de produção por (data, hospital).
+
+Cada grupo tem um carimbo (timestamp da última alteração) no cache do Django.
+Ele entra na chave do HTML renderizado, no ETag e no Last-Modified de
+producao_detalhe; gravar uma Producao/ItemProducao do grupo troca o carimbo.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+VERSAO_TTL = 60 * 60 * 24 * 30
+
+
+def _chave_versao(data, hospital_id):
+    return f"producao:detalhe:versao:{data:%Y-%m-%d}:{hospital_id}"
+
+
+def versao(data, hospital_id):
+    chave = _chave_versao(data, hospital_id)
+    valor = cache.get(chave)
+    if valor is None:
+        cache.add(chave, timezone.now().timestamp(), VERSAO_TTL)
+        valor = cache.get(chave)
+    return valor
+
+
+async def aversao(data, hospital_id):
+    chave = _chave_versao(data, hospital_id)
+    valor = await cache.aget(chave)
+    if valor is None:
+        await cache.aadd(chave, timezone.now().timestamp(), VERSAO_TTL)
+        valor = await cache.aget(chave)
+    return valor
+
+
+# `carimbo` evita reler a versão quando a view já a tem em mãos
+def chave_html(data, hospital_id, carimbo=None):
+    return f"producao:detalhe:html:{data:%Y-%m-%d}:{hospital_id}:{carimbo or versao(data, hospital_id)}"
+
+
+def etag(data, hospital_id, carimbo=None):
+    return f'"{data:%Y%m%d}-{hospital_id}-{int((carimbo or versao(data, hospital_id)) * 1000)}"'
+
+
+def invalidar(data, hospital_id):
+    # HTML das versões antigas só expira pelo TTL; nunca mais é lido
+    if data and hospital_id:
+        transaction.on_commit(
+            lambda: cache.set(_chave_versao(data, hospital_id), timezone.now().timestamp(), VERSAO_TTL)
+        )
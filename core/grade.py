@@ -0,0 +1,161 @@
+# core/grade.py
+"""
+Grade de lançamento da visita: pacientes internados de um hospital/setor nas
+linhas, procedimentos ativos nas colunas, uma data.
+
+`salvar` grava a grade inteira numa transação com comandos em lote: cria as
+Producao que faltam, resolve todas as tarifas de uma vez, insere os itens novos,
+troca a quantidade dos já lançados (bulk_update restrito à partição da data),
+apaga as células zeradas e recalcula total_dia e ProducaoDiaria uma vez por
+produção/chave no final.
+"""
+from decimal import Decimal
+
+from django.db import connection, models, transaction
+from django.db.models.functions import Coalesce
+
+from . import fragmentos
+from .evolucao import invalidar_cards
+from .models import Fechamento, ItemProducao, Paciente, Procedimento, ProcedimentoValor, Producao, ProducaoDiaria
+
+LOTE = 1000
+
+
+def pacientes_da_grade(hospital_id, setor_id=None):
+    qs = Paciente.objects.filter(hospital_id=hospital_id, alta=False)
+    if setor_id:
+        qs = qs.filter(setor_id=setor_id)
+    return list(qs.select_related("setor").order_by("setor__nome", "numero", "nome"))
+
+
+def procedimentos_da_grade():
+    return list(Procedimento.objects.filter(ativo=True).order_by("nome"))
+
+
+def quantidades(pacientes, data):
+    """{(paciente_id, procedimento_id): quantidade} já lançadas na data."""
+    return {
+        (paciente_id, procedimento_id): quantidade
+        for paciente_id, procedimento_id, quantidade in ItemProducao.objects
+        .filter(data=data, producao__paciente__in=[p.pk for p in pacientes])
+        .values_list("producao__paciente_id", "procedimento_id", "quantidade")
+    }
+
+
+def salvar(pacientes, procedimentos, data, celulas, usuario=None, lote=LOTE):
+    """
+    Grava `celulas` ({(paciente_id, procedimento_id): quantidade}) para os pacientes
+    e procedimentos da grade na data. Célula com 0 apaga o item; itens de
+    procedimentos fora da grade (inativos) ficam como estão.
+    Devolve {"producoes": criadas, "itens": gravados, "removidos": apagados}.
+    """
+    Fechamento.verificar(data)
+    por_id = {p.pk: p for p in pacientes}
+    procs = {p.pk for p in procedimentos}
+    resumo = {"producoes": 0, "itens": 0, "removidos": 0}
+
+    with transaction.atomic():
+        # produções do dia travadas: total_dia anterior para o delta de ProducaoDiaria
+        producoes = {
+            p.paciente_id: p
+            for p in Producao.objects.select_for_update().filter(paciente_id__in=por_id, data=data)
+        }
+        faltando = [
+            Producao(paciente_id=pk, data=data, criado_por=usuario, total_dia=Decimal("0"))
+            for pk in por_id
+            if pk not in producoes and any(celulas.get((pk, proc), 0) for proc in procs)
+        ]
+        if faltando:
+            # ignore_conflicts: outra pessoa pode ter lançado o mesmo paciente/dia agora
+            Producao.objects.bulk_create(faltando, batch_size=lote, ignore_conflicts=True)
+            # as puladas no conflito não voltam com pk; as nossas têm o criado_em que o
+            # bulk_create preencheu nas instâncias, a da outra sessão tem o dela
+            nossas = {(p.paciente_id, p.criado_em) for p in faltando}
+            for p in Producao.objects.select_for_update().filter(
+                paciente_id__in=[p.paciente_id for p in faltando], data=data,
+            ):
+                producoes[p.paciente_id] = p
+                resumo["producoes"] += (p.paciente_id, p.criado_em) in nossas
+        anteriores = {p.pk: p.total_dia or Decimal("0") for p in producoes.values()}
+        paciente_de = {p.pk: p.paciente_id for p in producoes.values()}
+
+        existentes = {
+            (paciente_de[producao_id], proc): (pk, quantidade)
+            for pk, producao_id, proc, quantidade in ItemProducao.objects
+            .filter(data=data, producao__in=paciente_de, procedimento_id__in=procs)
+            .values_list("pk", "producao_id", "procedimento_id", "quantidade")
+        }
+        removidos = [
+            (pk, paciente_id) for (paciente_id, proc), (pk, _) in existentes.items()
+            if not celulas.get((paciente_id, proc), 0)
+        ]
+        novos, alterados = [], []
+        for (paciente_id, proc), quantidade in celulas.items():
+            if paciente_id not in por_id or proc not in procs or not quantidade:
+                continue
+            atual = existentes.get((paciente_id, proc))
+            if atual is None:
+                novos.append(ItemProducao(
+                    producao=producoes[paciente_id], procedimento_id=proc, quantidade=quantidade, data=data,
+                ))
+            elif atual[1] != quantidade:
+                # item já lançado: só a quantidade muda, o valor gravado fica
+                alterados.append(ItemProducao(
+                    pk=atual[0], producao=producoes[paciente_id], procedimento_id=proc, quantidade=quantidade, data=data,
+                ))
+
+        # todas as tarifas da grade de uma vez, contra a mesma versão da tabela
+        chaves = [
+            (it.procedimento_id, por_id[paciente_de[it.producao.pk]].hospital_id,
+             por_id[paciente_de[it.producao.pk]].convenio_id, data)
+            for it in novos
+        ]
+        valores = ProcedimentoValor.valores_em(chaves)
+        for it, chave in zip(novos, chaves):
+            it.valor_unitario = valores[chave]
+        # sem ON CONFLICT: no PostgreSQL o unique da tabela particionada inclui data
+        ItemProducao.objects.bulk_create(novos, batch_size=lote)
+        ItemProducao.objects.filter(data=data).bulk_update(alterados, ["quantidade"], batch_size=lote)
+        # DELETE direto, sem os signals por item: total_dia e ProducaoDiaria são refeitos abaixo
+        # de uma vez. Sem o pre_delete, a trava do mês fechado é conferida aqui, dentro da transação
+        if removidos:
+            Fechamento.verificar(data)
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            for i in range(0, len(removidos), lote):
+                pks = [pk for pk, _ in removidos[i:i + lote]]
+                # filtrar pela data restringe o DELETE à partição do mês
+                cursor.execute(
+                    f"DELETE FROM {qn(ItemProducao._meta.db_table)} WHERE {qn('data')} = %s "
+                    f"AND {qn('id')} IN ({', '.join(['%s'] * len(pks))})",
+                    [data, *pks],
+                )
+        gravados = novos + alterados
+        resumo["itens"], resumo["removidos"] = len(gravados), len(removidos)
+
+        tocados = {paciente_de[it.producao.pk] for it in gravados} | {paciente_id for _, paciente_id in removidos}
+        if not tocados:
+            return resumo
+        soma = (
+            ItemProducao.objects
+            .filter(producao=models.OuterRef("pk"))
+            .values("producao")
+            .annotate(s=models.Sum(models.F("quantidade") * models.F("valor_unitario")))
+            .values("s")
+        )
+        decimal = models.DecimalField(max_digits=12, decimal_places=2)
+        alteradas = Producao.objects.filter(pk__in=[producoes[pk].pk for pk in tocados])
+        alteradas.update(
+            total_dia=Coalesce(models.Subquery(soma, output_field=decimal), models.Value(Decimal("0")), output_field=decimal)
+        )
+        deltas = {}
+        for pk, paciente_id, total in alteradas.values_list("pk", "paciente_id", "total_dia"):
+            pac = por_id[paciente_id]
+            chave = (data, pac.hospital_id, pac.convenio_id)
+            deltas[chave] = deltas.get(chave, Decimal("0")) + (total or Decimal("0")) - anteriores[pk]
+        for chave, delta in deltas.items():
+            ProducaoDiaria.somar(chave, delta)
+            fragmentos.invalidar(chave[0], chave[1])
+        for paciente_id in tocados:
+            invalidar_cards(paciente_id, por_id[paciente_id].hospital_id)
+    return resumo
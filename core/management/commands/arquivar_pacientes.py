@@ -0,0 +1,47 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from core.arquivo import LOTE, MESES, arquivar, candidatos, limite, restaurar
+
+
+class Command(BaseCommand):
+    help = (
+        "Move os pacientes com alta há mais de --meses meses, com acessos, observações, condutas "
+        "e produção, para as tabelas de arquivo. Com --restaurar, devolve os pacientes informados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--meses", type=int, default=MESES, help=f"Alta há mais de N meses (padrão: {MESES})")
+        parser.add_argument("--lote", type=int, default=LOTE, help=f"Pacientes por transação (padrão: {LOTE})")
+        parser.add_argument("--meses-abertos", action="store_true",
+                            help="Arquiva também quem tem produção em mês não fechado")
+        parser.add_argument("--simular", action="store_true", help="Só conta os pacientes que seriam arquivados")
+        parser.add_argument("--restaurar", type=int, nargs="+", metavar="ID", help="ids dos pacientes arquivados a restaurar")
+
+    def handle(self, *args, **opts):
+        if opts["restaurar"]:
+            try:
+                r = restaurar(opts["restaurar"], lote=opts["lote"])
+            except ValidationError as e:
+                raise CommandError(e.messages[0])
+            self.stdout.write(self.style.SUCCESS(self._resumo("restaurado(s)", r)))
+            return
+
+        if opts["simular"]:
+            n = candidatos(opts["meses"]).count()
+            self.stdout.write(f"{n} paciente(s) com alta antes de {limite(opts['meses']):%d/%m/%Y}.")
+            return
+
+        r = arquivar(opts["meses"], lote=opts["lote"], meses_abertos=opts["meses_abertos"])
+        self.stdout.write(self.style.SUCCESS(self._resumo("arquivado(s)", r)))
+        if r["ignorados"]:
+            self.stdout.write(self.style.WARNING(
+                f"{r['ignorados']} paciente(s) com produção em mês não fechado ficaram (use --meses-abertos)."
+            ))
+
+    def _resumo(self, verbo, r):
+        return (
+            f"{r.get('paciente', 0)} paciente(s) {verbo}: {r.get('producao', 0)} produção(ões), "
+            f"{r.get('itemproducao', 0)} item(ns), {r.get('observacao', 0)} observação(ões), "
+            f"{r.get('conduta', 0)} conduta(s), {r.get('acesso', 0)} acesso(s)."
+        )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Acesso, DiasDesde
+
+
+class Command(BaseCommand):
+    help = "Regrava Acesso.dias_acesso dos pacientes internados (rodar de madrugada, ex.: cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lote", type=int, default=2000, help="Acessos por UPDATE (padrão: 2000)")
+
+    def handle(self, *args, **opts):
+        lote = opts["lote"]
+        pks = list(
+            Acesso.objects
+            .filter(paciente__alta=False)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        # UPDATE por lote com a expressão calculada no banco: nada é carregado em memória
+        dias = DiasDesde("data_implantacao")
+        atualizados = 0
+        for i in range(0, len(pks), lote):
+            atualizados += Acesso.objects.filter(pk__in=pks[i:i + lote]).update(dias_acesso=dias)
+        self.stdout.write(self.style.SUCCESS(f"{atualizados} acesso(s) atualizado(s)."))
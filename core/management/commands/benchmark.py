@@ -0,0 +1,186 @@
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import time
+from datetime import timedelta
+
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from core.middleware import _ContadorSQL
+from core.models import ItemProducao, Paciente, Procedimento, ProcedimentoValor, Producao, ProducaoDiaria
+from core.sintetico import gerar
+
+# cache em memória durante a medição: não mexe no cache em disco do app
+CACHE_BENCHMARK = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "benchmark"}}
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede as views/operações mais usadas (valor_em, producao_nova, producao_list, producao_detalhe, "
+        "pacientes_list, changelists do admin) em vários volumes de dados e grava o resultado em JSON. "
+        "Por padrão cria um banco de teste (como o manage.py test) e o preenche com core.sintetico."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tamanhos", default="500,2000,8000",
+                            help="Nº acumulado de pacientes em cada rodada (padrão: 500,2000,8000)")
+        parser.add_argument("--repeticoes", type=int, default=10, help="Medições por caso (padrão: 10)")
+        parser.add_argument("--anos", type=int, default=2, help="Anos de produção sintética (padrão: 2)")
+        parser.add_argument("--semente", type=int, default=42)
+        parser.add_argument("--saida", help="Arquivo JSON (padrão: benchmarks/benchmark_<data>.json)")
+        parser.add_argument("--banco-atual", action="store_true",
+                            help="Mede o banco configurado como está, sem criar banco de teste nem gerar dados")
+        parser.add_argument("--manter-banco", action="store_true", help="Reaproveita/mantém o banco de teste")
+
+    def handle(self, *args, **opts):
+        try:
+            tamanhos = [int(t) for t in opts["tamanhos"].split(",")] if not opts["banco_atual"] else [None]
+        except ValueError:
+            raise CommandError(f"--tamanhos inválido: {opts['tamanhos']}")
+        if tamanhos != sorted(tamanhos, key=lambda t: t or 0):
+            raise CommandError("--tamanhos precisa ser crescente (os pacientes são acumulados).")
+
+        saida = opts["saida"] or f"benchmarks/benchmark_{timezone.now():%Y%m%d_%H%M%S}.json"
+        resultado = {
+            "gerado_em": timezone.now().isoformat(),
+            "django": django.get_version(),
+            "python": platform.python_version(),
+            "banco": connection.vendor,
+            "repeticoes": opts["repeticoes"],
+            "rodadas": [],
+        }
+
+        setup_test_environment()
+        nome_original = None
+        if not opts["banco_atual"]:
+            nome_original = connection.settings_dict["NAME"]
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=opts["manter_banco"])
+        try:
+            with override_settings(CACHES=CACHE_BENCHMARK):
+                self.rnd = random.Random(opts["semente"])
+                # datas futuras ainda sem produção para os POSTs de producao_nova
+                self.dias = itertools.count(3650)
+                self.client = Client()
+                admin, _ = User.objects.get_or_create(username="benchmark", defaults={"is_staff": True, "is_superuser": True})
+                self.client.force_login(admin)
+                atual = Paciente.objects.filter(registro__startswith="SIN").count()
+                for tamanho in tamanhos:
+                    if tamanho is not None and tamanho > atual:
+                        self.stdout.write(f"Gerando {tamanho - atual} paciente(s)...")
+                        gerar(pacientes=tamanho - atual, anos=opts["anos"], semente=opts["semente"] + tamanho)
+                        atual = tamanho
+                    rodada = self._rodada(opts["repeticoes"])
+                    resultado["rodadas"].append(rodada)
+                    self._imprimir(rodada)
+        finally:
+            if nome_original is not None:
+                connection.creation.destroy_test_db(nome_original, verbosity=0, keepdb=opts["manter_banco"])
+            teardown_test_environment()
+
+        os.makedirs(os.path.dirname(saida) or ".", exist_ok=True)
+        with open(saida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Resultado em {saida}"))
+
+    # ---------- medição ----------
+
+    def _medir(self, repeticoes, funcao, preparar=None):
+        tempos, queries = [], []
+        funcao()  # aquecimento (tabela de tarifas, templates, conexões)
+        for i in range(repeticoes):
+            if preparar:
+                preparar()
+            contador = _ContadorSQL()
+            inicio = time.perf_counter()
+            with connection.execute_wrapper(contador):
+                funcao()
+            tempos.append((time.perf_counter() - inicio) * 1000)
+            queries.append(contador.queries)
+        tempos.sort()
+        return {
+            "min_ms": round(tempos[0], 3),
+            "mediana_ms": round(statistics.median(tempos), 3),
+            "media_ms": round(statistics.fmean(tempos), 3),
+            "p90_ms": round(tempos[int(0.9 * (len(tempos) - 1))], 3),
+            "max_ms": round(tempos[-1], 3),
+            "queries": max(queries),
+        }
+
+    def _get(self, url):
+        def funcao():
+            r = self.client.get(url)
+            if r.status_code != 200:
+                raise CommandError(f"GET {url} devolveu {r.status_code}")
+        return funcao
+
+    def _rodada(self, repeticoes):
+        rnd = self.rnd
+        rodada = {
+            "pacientes": Paciente.objects.count(),
+            "producoes": Producao.objects.count(),
+            "itens": ItemProducao.objects.count(),
+            "tarifas": ProcedimentoValor.objects.count(),
+            "casos": {},
+        }
+        casos = rodada["casos"]
+        if not rodada["producoes"]:
+            raise CommandError("Sem produção no banco; rode sem --banco-atual ou gere dados antes.")
+
+        # valor_em: 1000 consultas por medição, chaves reais de tarifa
+        chaves = list(ProcedimentoValor.objects.values_list("procedimento_id", "hospital_id", "convenio_id")[:500])
+        hoje = timezone.localdate()
+        amostra = [(*rnd.choice(chaves), hoje - timedelta(days=rnd.randrange(0, 730))) for _ in range(1000)]
+        casos["valor_em_1000"] = self._medir(repeticoes, lambda: [ProcedimentoValor.valor_em(*c) for c in amostra])
+
+        # producao_nova: formset com 2 itens, sempre num dia ainda sem produção
+        pacientes = list(Paciente.objects.filter(alta=False).values_list("pk", flat=True)[:200]) \
+            or list(Paciente.objects.values_list("pk", flat=True)[:200])
+        procs = list(Procedimento.objects.filter(tipo=Procedimento.TIPO_BOOLEANO).values_list("pk", flat=True)[:2])
+
+        def producao_nova():
+            paciente_id = rnd.choice(pacientes)
+            data = hoje + timedelta(days=next(self.dias))
+            dados = {
+                "data": data.isoformat(),
+                "itens-TOTAL_FORMS": str(len(procs)), "itens-INITIAL_FORMS": "0",
+                "itens-MIN_NUM_FORMS": "0", "itens-MAX_NUM_FORMS": "1000",
+            }
+            for i, proc in enumerate(procs):
+                dados[f"itens-{i}-procedimento"] = proc
+                dados[f"itens-{i}-quantidade"] = "1"
+            r = self.client.post(f"/pacientes/{paciente_id}/producao/nova/", dados)
+            if r.status_code != 200:
+                raise CommandError(f"producao_nova devolveu {r.status_code}")
+        casos["producao_nova"] = self._medir(repeticoes, producao_nova)
+
+        casos["producao_list"] = self._medir(repeticoes, self._get("/producao/"))
+        grupos = list(
+            ProducaoDiaria.objects.filter(hospital__isnull=False, data__lte=hoje)
+            .values_list("data", "hospital_id").order_by("-data")[:200]
+        )
+        data, hospital_id = rnd.choice(grupos)
+        detalhe = self._get(f"/producao/detalhe/{data:%Y-%m-%d}/{hospital_id}/")
+        casos["producao_detalhe_frio"] = self._medir(repeticoes, detalhe, preparar=cache.clear)
+        casos["producao_detalhe_cache"] = self._medir(repeticoes, detalhe)
+        casos["pacientes_list"] = self._medir(repeticoes, self._get("/pacientes/"))
+        casos["pacientes_list_busca"] = self._medir(repeticoes, self._get("/pacientes/?q=silva"))
+        for modelo in ("paciente", "producao", "acesso", "procedimentovalor"):
+            casos[f"admin_{modelo}_changelist"] = self._medir(repeticoes, self._get(f"/admin/core/{modelo}/"))
+        return rodada
+
+    def _imprimir(self, rodada):
+        self.stdout.write(
+            f"\n{rodada['pacientes']} pacientes, {rodada['producoes']} produções, {rodada['itens']} itens"
+        )
+        for nome, r in rodada["casos"].items():
+            self.stdout.write(f"  {nome:36} mediana {r['mediana_ms']:9.2f} ms  p90 {r['p90_ms']:9.2f} ms  {r['queries']:4d} queries")
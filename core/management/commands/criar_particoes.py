@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import particoes
+
+
+class Command(BaseCommand):
+    help = "Cria as partições mensais de produção e itens dos próximos meses (PostgreSQL; rodar todo mês, ex.: cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--meses", type=int, default=particoes.MESES_A_FRENTE,
+                            help=f"Meses à frente do atual (padrão: {particoes.MESES_A_FRENTE})")
+        parser.add_argument("--desde", help="Primeiro mês a conferir (YYYY-MM; padrão: mês atual)")
+
+    def handle(self, *args, **opts):
+        desde = None
+        if opts["desde"]:
+            try:
+                desde = datetime.strptime(opts["desde"], "%Y-%m").date()
+            except ValueError:
+                raise CommandError(f"Mês inválido: {opts['desde']} (use YYYY-MM)")
+        if not particoes.particionado():
+            raise CommandError("Produção não está particionada (só no PostgreSQL, após a migração 0019).")
+
+        criadas = particoes.criar(opts["meses"], desde)
+        for particao, movidas in criadas:
+            extra = f" ({movidas} linha(s) movida(s) da partição padrão)" if movidas else ""
+            self.stdout.write(f"{particao}{extra}")
+        self.stdout.write(self.style.SUCCESS(f"{len(criadas)} partição(ões) criada(s)."))
@@ -0,0 +1,44 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from core.exportacao import itens_exportacao, linhas_csv
+from core.models import Convenio, Hospital, Procedimento
+
+
+class Command(BaseCommand):
+    help = "Exporta a produção item a item (faturamento) em CSV, sem carregar o período em memória."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hospital", type=int, help="id do hospital")
+        parser.add_argument("--convenio", type=int, help="id do convênio")
+        parser.add_argument("--procedimento", type=int, help="id do procedimento")
+        parser.add_argument("--de", help="Data inicial (YYYY-MM-DD)")
+        parser.add_argument("--ate", help="Data final (YYYY-MM-DD)")
+        parser.add_argument("--saida", help="Arquivo de saída (padrão: stdout)")
+
+    def handle(self, *args, **opts):
+        filtros = {}
+        for campo, model in (("hospital", Hospital), ("convenio", Convenio), ("procedimento", Procedimento)):
+            if opts[campo]:
+                try:
+                    filtros[campo] = model.objects.get(pk=opts[campo])
+                except model.DoesNotExist:
+                    raise CommandError(f"{campo} {opts[campo]} não encontrado.")
+        for campo in ("de", "ate"):
+            if opts[campo]:
+                try:
+                    filtros[campo] = parse_date(opts[campo])
+                except ValueError:
+                    filtros[campo] = None
+                if not filtros[campo]:
+                    raise CommandError(f"Data inválida em --{campo}: {opts[campo]}")
+
+        saida = open(opts["saida"], "w", encoding="utf-8", newline="") if opts["saida"] else sys.stdout
+        try:
+            for linha in linhas_csv(itens_exportacao(**filtros)):
+                saida.write(linha)
+        finally:
+            if opts["saida"]:
+                saida.close()
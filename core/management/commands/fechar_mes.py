@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from core.fechamento import fechar, reabrir
+
+
+class Command(BaseCommand):
+    help = "Fecha o mês de faturamento (congela os agregados e bloqueia a produção do mês) ou reabre com --reabrir."
+
+    def add_arguments(self, parser):
+        parser.add_argument("mes", help="Mês de referência (YYYY-MM)")
+        parser.add_argument("--reabrir", action="store_true", help="Apaga o fechamento e libera a produção do mês")
+
+    def handle(self, *args, **opts):
+        try:
+            ref = datetime.strptime(opts["mes"], "%Y-%m")
+        except ValueError:
+            raise CommandError(f"Mês inválido: {opts['mes']} (use YYYY-MM)")
+
+        if opts["reabrir"]:
+            try:
+                reaberto = reabrir(ref.year, ref.month)
+            except ValidationError as e:
+                raise CommandError(e.messages[0])
+            if not reaberto:
+                raise CommandError(f"O mês {ref:%m/%Y} não está fechado.")
+            self.stdout.write(self.style.SUCCESS(f"Mês {ref:%m/%Y} reaberto."))
+            return
+
+        try:
+            fechamento = fechar(ref.year, ref.month)
+        except ValidationError as e:
+            raise CommandError(e.messages[0])
+        self.stdout.write(self.style.SUCCESS(f"Mês {ref:%m/%Y} fechado ({fechamento.itens.count()} linha(s) no snapshot)."))
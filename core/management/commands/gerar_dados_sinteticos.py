@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from core.sintetico import LOTE, gerar
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera dados sintéticos (hospitais, convênios, tarifas com vigências sobrepostas, pacientes "
+        "e anos de produção diária) para testes de desempenho. Use só em banco descartável."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hospitais", type=int, default=5)
+        parser.add_argument("--convenios", type=int, default=8)
+        parser.add_argument("--pacientes", type=int, default=2000, help="Pacientes a acrescentar (padrão: 2000)")
+        parser.add_argument("--anos", type=int, default=2, help="Anos de histórico de produção (padrão: 2)")
+        parser.add_argument("--usuarios", type=int, default=3)
+        parser.add_argument("--semente", type=int, help="Semente do gerador aleatório (resultado reprodutível)")
+        parser.add_argument("--lote", type=int, default=LOTE, help=f"Linhas por INSERT (padrão: {LOTE})")
+
+    def handle(self, *args, **opts):
+        r = gerar(
+            hospitais=opts["hospitais"], convenios=opts["convenios"], pacientes=opts["pacientes"],
+            anos=opts["anos"], usuarios=opts["usuarios"], semente=opts["semente"], lote=opts["lote"],
+            progresso=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{r['pacientes']} paciente(s), {r['producoes']} produção(ões), {r['itens']} item(ns), {r['acessos']} acesso(s) criados."
+        ))
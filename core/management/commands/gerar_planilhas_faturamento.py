@@ -0,0 +1,38 @@
+import importlib.util
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.faturamento import gerar_planilhas
+from core.models import Hospital
+
+
+class Command(BaseCommand):
+    help = "Gera as planilhas de faturamento do mês (XLSX, uma por hospital, uma aba por convênio)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("mes", help="Mês de referência (YYYY-MM)")
+        parser.add_argument("--destino", default="faturamento", help="Diretório de saída (padrão: ./faturamento)")
+        parser.add_argument("--hospital", type=int, action="append", help="id do hospital (pode repetir; padrão: todos)")
+        parser.add_argument("--processos", type=int, help="Tamanho do pool de processos (padrão: nº de CPUs)")
+
+    def handle(self, *args, **opts):
+        try:
+            ref = datetime.strptime(opts["mes"], "%Y-%m")
+        except ValueError:
+            raise CommandError(f"Mês inválido: {opts['mes']} (use YYYY-MM)")
+        if importlib.util.find_spec("openpyxl") is None:
+            raise CommandError("openpyxl não está instalado (pip install openpyxl).")
+
+        hospitais = Hospital.objects.order_by("pk")
+        if opts["hospital"]:
+            hospitais = hospitais.filter(pk__in=opts["hospital"])
+        ids = list(hospitais.values_list("pk", flat=True))
+        if not ids:
+            raise CommandError("Nenhum hospital encontrado.")
+
+        resultado = gerar_planilhas(ref.year, ref.month, opts["destino"], ids, opts["processos"])
+        for hospital_id in ids:
+            caminho, itens = resultado[hospital_id]
+            self.stdout.write(f"{caminho} ({itens} itens)")
+        self.stdout.write(self.style.SUCCESS(f"{len(ids)} planilha(s) gerada(s)."))
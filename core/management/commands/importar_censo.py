@@ -0,0 +1,52 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from core.censo import LOTE, importar, ler_csv
+from core.models import Hospital
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa o censo diário (CSV) para Paciente, casando por (hospital, registro). "
+        "Colunas: registro, nome, hospital (ou --hospital) e, opcionais, setor, convenio, numero, idade, diagnostico."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("arquivos", nargs="+", help="Arquivo(s) CSV do censo")
+        parser.add_argument("--hospital", type=int, help="id do hospital de todas as linhas (ignora a coluna hospital)")
+        parser.add_argument("--criar-cadastros", action="store_true", help="Cria setores e convênios que não existirem")
+        parser.add_argument("--sem-alta", action="store_true", help="Não dá alta a quem ficou fora do censo")
+        parser.add_argument("--usuario", help="username gravado em criado_por dos pacientes novos")
+        parser.add_argument("--lote", type=int, default=LOTE, help=f"Pacientes por INSERT (padrão: {LOTE})")
+
+    def handle(self, *args, **opts):
+        hospital = usuario = None
+        if opts["hospital"]:
+            hospital = Hospital.objects.filter(pk=opts["hospital"]).first()
+            if not hospital:
+                raise CommandError(f"hospital {opts['hospital']} não encontrado.")
+        if opts["usuario"]:
+            usuario = User.objects.filter(username=opts["usuario"]).first()
+            if not usuario:
+                raise CommandError(f"usuário {opts['usuario']} não encontrado.")
+
+        # um arquivo por vez: a alta vale para os hospitais presentes em cada censo
+        for caminho in opts["arquivos"]:
+            try:
+                linhas = ler_csv(caminho)
+            except OSError as e:
+                raise CommandError(f"{caminho}: {e}")
+            if not linhas:
+                self.stdout.write(self.style.WARNING(f"{caminho}: arquivo vazio, ignorado."))
+                continue
+            try:
+                r = importar(
+                    linhas, hospital=hospital, criar_cadastros=opts["criar_cadastros"],
+                    dar_alta=not opts["sem_alta"], usuario=usuario, lote=opts["lote"],
+                )
+            except ValidationError as e:
+                raise CommandError(f"{caminho}:\n" + "\n".join(e.messages))
+            self.stdout.write(self.style.SUCCESS(
+                f"{caminho}: {r['criados']} novo(s), {r['atualizados']} atualizado(s), {r['altas']} alta(s)."
+            ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.models import ProducaoDiaria
+
+
+class Command(BaseCommand):
+    help = "Refaz do zero o agregado ProducaoDiaria a partir de Producao.total_dia."
+
+    def handle(self, *args, **opts):
+        ProducaoDiaria.reconstruir()
+        self.stdout.write(self.style.SUCCESS(f"{ProducaoDiaria.objects.count()} linha(s) em ProducaoDiaria."))
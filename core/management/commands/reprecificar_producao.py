@@ -0,0 +1,61 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from core.models import ProcedimentoValor
+from core.reprecificacao import LOTE, escopo_da_tarifa, reprecificar, simular
+
+
+class Command(BaseCommand):
+    help = (
+        "Reprecifica os itens de produção pela tabela de tarifas vigente. "
+        "Sem --aplicar, só mostra a diferença em dinheiro (simulação)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tarifa", type=int, help="id de ProcedimentoValor: usa procedimento, hospital, convênio e vigência dela")
+        parser.add_argument("--procedimento", type=int, help="id do procedimento")
+        parser.add_argument("--hospital", type=int, help="id do hospital")
+        parser.add_argument("--convenio", type=int, help="id do convênio (padrão: todos)")
+        parser.add_argument("--de", help="Data inicial (YYYY-MM-DD)")
+        parser.add_argument("--ate", help="Data final (YYYY-MM-DD)")
+        parser.add_argument("--aplicar", action="store_true", help="Grava os novos valores")
+        parser.add_argument("--lote", type=int, default=LOTE, help=f"Grupos por UPDATE (padrão: {LOTE})")
+
+    def handle(self, *args, **opts):
+        if opts["tarifa"]:
+            tarifa = ProcedimentoValor.objects.filter(pk=opts["tarifa"]).first()
+            if not tarifa:
+                raise CommandError(f"tarifa {opts['tarifa']} não encontrada.")
+            escopo = escopo_da_tarifa(tarifa)
+        elif opts["procedimento"] and opts["hospital"]:
+            escopo = {"procedimento": opts["procedimento"], "hospital": opts["hospital"], "convenio": opts["convenio"]}
+            for campo in ("de", "ate"):
+                escopo[campo] = parse_date(opts[campo]) if opts[campo] else None
+                if opts[campo] and not escopo[campo]:
+                    raise CommandError(f"Data inválida em --{campo}: {opts[campo]}")
+        else:
+            raise CommandError("Informe --tarifa ou --procedimento e --hospital.")
+
+        if opts["aplicar"]:
+            r = reprecificar(**escopo, lote=opts["lote"])
+            self.stdout.write(self.style.SUCCESS(
+                f"{r['itens']} item(ns) reprecificado(s) em {r['producoes']} produção(ões); diferença R$ {r['delta']:.2f}."
+            ))
+            if r["bloqueados"]:
+                self.stdout.write(self.style.WARNING(f"R$ {r['bloqueados']:.2f} em meses fechados ficaram de fora."))
+            return
+
+        total = Decimal("0")
+        for g in simular(**escopo):
+            if not g["delta"]:
+                continue
+            marca = " [mês fechado]" if g["bloqueado"] else ""
+            self.stdout.write(
+                f"{g['data']} convênio {g['convenio_ref'] or '-'}: {g['itens']} item(ns), "
+                f"R$ {g['total_atual'] or 0:.2f} -> R$ {g['total_novo']:.2f} ({g['delta']:+.2f}){marca}"
+            )
+            if not g["bloqueado"]:
+                total += g["delta"]
+        self.stdout.write(self.style.SUCCESS(f"Diferença total (simulação): R$ {total:+.2f}. Rode com --aplicar para gravar."))
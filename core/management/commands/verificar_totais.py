@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from core.models import Producao
+
+
+class Command(BaseCommand):
+    help = "Confere Producao.total_dia contra a soma real dos itens e aponta (ou corrige) divergências."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--de", help="Data inicial (YYYY-MM-DD)")
+        parser.add_argument("--ate", help="Data final (YYYY-MM-DD)")
+        parser.add_argument("--corrigir", action="store_true", help="Regrava total_dia com a soma real")
+
+    def handle(self, *args, **opts):
+        qs = Producao.divergentes().select_related("paciente").order_by("data", "pk")
+        for campo, lookup in (("de", "data__gte"), ("ate", "data__lte")):
+            if opts[campo]:
+                try:
+                    data = parse_date(opts[campo])
+                except ValueError:
+                    data = None
+                if not data:
+                    raise CommandError(f"Data inválida em --{campo}: {opts[campo]}")
+                qs = qs.filter(**{lookup: data})
+
+        encontrados = 0
+        for p in qs.iterator(chunk_size=500):
+            encontrados += 1
+            self.stdout.write(
+                f"Produção #{p.pk} ({p.paciente.nome}, {p.data}): gravado {p.total_gravado} / real {p.total_real}"
+            )
+            if opts["corrigir"]:
+                p.recomputar_total(save=True)
+
+        if not encontrados:
+            self.stdout.write(self.style.SUCCESS("Nenhuma divergência encontrada."))
+        elif opts["corrigir"]:
+            self.stdout.write(self.style.SUCCESS(f"{encontrados} total(is) corrigido(s)."))
+        else:
+            raise CommandError(f"{encontrados} produção(ões) com total_dia divergente. Rode com --corrigir.")
@@ -0,0 +1,84 @@
+# core/metricas.py
+"""
+Métricas por view (nome da URL): latência, nº de queries e tempo de SQL.
+
+Os histogramas ficam em memória no processo, são preenchidos pelo
+MetricasMiddleware (core.middleware) e saem no formato texto do Prometheus
+em /metricas/ (só staff). Com vários workers cada processo tem os seus;
+o Prometheus soma as séries de cada alvo raspado.
+"""
+import threading
+from bisect import bisect_left
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_QUERIES = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+METRICAS = {
+    # nome: (help, buckets)
+    "nefropy_request_duration_seconds": ("Latência da requisição por view", BUCKETS_SEGUNDOS),
+    "nefropy_request_queries": ("Queries SQL por requisição por view", BUCKETS_QUERIES),
+    "nefropy_request_sql_seconds": ("Tempo em SQL por requisição por view", BUCKETS_SEGUNDOS),
+}
+ESTOURO = "nefropy_request_query_budget_exceeded_total"
+
+
+class Histograma:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.contagens = [0] * (len(buckets) + 1)  # o último é o +Inf
+        self.soma = 0
+        self.total = 0
+
+    def observar(self, valor):
+        self.contagens[bisect_left(self.buckets, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+
+class Registro:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histogramas = {}  # {(metrica, view): Histograma}
+        self._estouros = {}     # {view: n}
+
+    def observar(self, view, duracao, queries, tempo_sql, estourou=False):
+        with self._lock:
+            for metrica, valor in (
+                ("nefropy_request_duration_seconds", duracao),
+                ("nefropy_request_queries", queries),
+                ("nefropy_request_sql_seconds", tempo_sql),
+            ):
+                chave = (metrica, view)
+                if chave not in self._histogramas:
+                    self._histogramas[chave] = Histograma(METRICAS[metrica][1])
+                self._histogramas[chave].observar(valor)
+            if estourou:
+                self._estouros[view] = self._estouros.get(view, 0) + 1
+
+    def exportar(self):
+        """Texto no formato de exposição do Prometheus (version=0.0.4)."""
+        linhas = []
+        with self._lock:
+            for metrica, (ajuda, buckets) in METRICAS.items():
+                linhas += [f"# HELP {metrica} {ajuda}", f"# TYPE {metrica} histogram"]
+                for (nome, view), h in sorted(self._histogramas.items()):
+                    if nome != metrica:
+                        continue
+                    rotulo = _rotulo(view)
+                    acumulado = 0
+                    for limite, n in zip((*buckets, "+Inf"), h.contagens):
+                        acumulado += n
+                        linhas.append(f'{metrica}_bucket{{view="{rotulo}",le="{limite}"}} {acumulado}')
+                    linhas.append(f'{metrica}_sum{{view="{rotulo}"}} {h.soma}')
+                    linhas.append(f'{metrica}_count{{view="{rotulo}"}} {h.total}')
+            linhas += [f"# HELP {ESTOURO} Requisições acima do orçamento de queries", f"# TYPE {ESTOURO} counter"]
+            for view, n in sorted(self._estouros.items()):
+                linhas.append(f'{ESTOURO}{{view="{_rotulo(view)}"}} {n}')
+        return "\n".join(linhas) + "\n"
+
+
+def _rotulo(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registro = Registro()
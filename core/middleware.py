@@ -0,0 +1,101 @@
+# core/middleware.py
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .metricas import registro
+
+logger = logging.getLogger(__name__)
+
+# contador da requisição em andamento; o sync_to_async copia o contexto para a
+# thread, então as queries das views async (feitas em outra conexão) entram também
+_contador = ContextVar("contador_sql", default=None)
+
+
+class _ContadorSQL:
+    """Nº de queries da requisição e tempo gasto nelas."""
+    def __init__(self):
+        self.queries = 0
+        self.tempo = 0.0
+
+
+def _contar(execute, sql, params, many, context):
+    """execute_wrapper instalado em toda conexão; só mede se houver requisição no contexto."""
+    contador = _contador.get()
+    if contador is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        contador.queries += 1
+        contador.tempo += time.perf_counter() - inicio
+
+
+def _instalar(connection, **kwargs):
+    if _contar not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_contar)
+
+
+connection_created.connect(_instalar)
+
+
+class MetricasMiddleware:
+    """
+    Mede latência, nº de queries e tempo de SQL por view (nome da URL) e
+    registra em core.metricas. Se a view passar do orçamento de queries de
+    settings.ORCAMENTO_QUERIES, loga um warning.
+    Em respostas streaming só conta o que rodou até a resposta ser devolvida.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # sob ASGI a cadeia é async: sem isso o Django embrulharia as views async em threads
+        self.assincrono = iscoroutinefunction(get_response)
+        if self.assincrono:
+            markcoroutinefunction(self)
+        # conexões abertas antes do middleware carregar não passaram pelo connection_created
+        for conexao in connections.all(initialized_only=True):
+            _instalar(conexao)
+
+    def __call__(self, request):
+        if self.assincrono:
+            return self._medir_async(request)
+        contador = _ContadorSQL()
+        token = _contador.set(contador)
+        inicio = time.perf_counter()
+        try:
+            return self.get_response(request)
+        finally:
+            _contador.reset(token)
+            self._registrar(request, contador, inicio)
+
+    async def _medir_async(self, request):
+        contador = _ContadorSQL()
+        token = _contador.set(contador)
+        inicio = time.perf_counter()
+        try:
+            return await self.get_response(request)
+        finally:
+            _contador.reset(token)
+            self._registrar(request, contador, inicio)
+
+    def _registrar(self, request, contador, inicio):
+        duracao = time.perf_counter() - inicio
+        match = getattr(request, "resolver_match", None)
+        view = (match.view_name if match else None) or "<sem rota>"
+        orcamento = getattr(settings, "ORCAMENTO_QUERIES", {}).get(view)
+        estourou = orcamento is not None and contador.queries > orcamento
+        if estourou:
+            logger.warning(
+                "View %s fez %d queries (orçamento %d) em %.0f ms: %s",
+                view, contador.queries, orcamento, duracao * 1000, request.get_full_path(),
+            )
+        registro.observar(view, duracao, contador.queries, contador.tempo, estourou)
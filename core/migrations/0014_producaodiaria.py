@@ -0,0 +1,64 @@
+# Generated by Django 4.2 on 2026-10-18 10:12
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def popular(apps, schema_editor):
+    Producao = apps.get_model("core", "Producao")
+    ProducaoDiaria = apps.get_model("core", "ProducaoDiaria")
+    linhas = (
+        Producao.objects
+        .values("data", "paciente__hospital_id", "paciente__convenio_id")
+        .annotate(s=models.Sum("total_dia"))
+        .order_by()
+    )
+    ProducaoDiaria.objects.bulk_create(
+        [
+            ProducaoDiaria(data=l["data"], hospital_id=l["paciente__hospital_id"],
+                           convenio_id=l["paciente__convenio_id"], total=l["s"] or Decimal("0"))
+            for l in linhas
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_alter_producao_options_remove_procedimento_valor_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProducaoDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=14)),
+                ('convenio', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.convenio')),
+                ('hospital', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.hospital')),
+            ],
+            options={
+                'ordering': ['-data'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='producaodiaria',
+            constraint=models.UniqueConstraint(fields=('data', 'hospital', 'convenio'), name='producaodiaria_chave_unica'),
+        ),
+        migrations.AddConstraint(
+            model_name='producaodiaria',
+            constraint=models.UniqueConstraint(condition=models.Q(('convenio__isnull', True)), fields=('data', 'hospital'), name='producaodiaria_sem_convenio_unica'),
+        ),
+        migrations.AddConstraint(
+            model_name='producaodiaria',
+            constraint=models.UniqueConstraint(condition=models.Q(('hospital__isnull', True)), fields=('data', 'convenio'), name='producaodiaria_sem_hospital_unica'),
+        ),
+        migrations.AddConstraint(
+            model_name='producaodiaria',
+            constraint=models.UniqueConstraint(condition=models.Q(('convenio__isnull', True), ('hospital__isnull', True)), fields=('data',), name='producaodiaria_sem_chaves_unica'),
+        ),
+        migrations.RunPython(popular, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2 on 2026-10-18 10:40
+
+import unicodedata
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+def normalizar(*partes):
+    texto = unicodedata.normalize("NFKD", " ".join(str(p) for p in partes if p))
+    return "".join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+def popular_busca(apps, schema_editor):
+    Paciente = apps.get_model("core", "Paciente")
+    lote = []
+    for p in Paciente.objects.only("nome", "numero", "registro").iterator(chunk_size=2000):
+        p.busca = normalizar(p.nome, p.numero, p.registro)
+        lote.append(p)
+        if len(lote) >= 1000:
+            Paciente.objects.bulk_update(lote, ["busca"])
+            lote = []
+    if lote:
+        Paciente.objects.bulk_update(lote, ["busca"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_producaodiaria'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='paciente',
+            name='busca',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(popular_busca, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='paciente',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['busca'], name='paciente_busca_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ]
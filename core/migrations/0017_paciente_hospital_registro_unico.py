@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+def normalizar_registro(apps, schema_editor):
+    Paciente = apps.get_model("core", "Paciente")
+    Paciente.objects.filter(registro__regex=r"^\s*$").update(registro=None)
+    duplicados = list(
+        Paciente.objects
+        .filter(registro__isnull=False)
+        .values("hospital_id", "registro")
+        .annotate(n=models.Count("pk"))
+        .filter(n__gt=1)
+        .values_list("hospital_id", "registro")[:20]
+    )
+    if duplicados:
+        raise RuntimeError(
+            "Pacientes com o mesmo registro no mesmo hospital; corrija antes de migrar "
+            f"(hospital_id, registro): {duplicados}"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_fechamento'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalizar_registro, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='paciente',
+            constraint=models.UniqueConstraint(fields=('hospital', 'registro'), name='paciente_hospital_registro_unico'),
+        ),
+    ]
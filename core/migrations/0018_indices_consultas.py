@@ -0,0 +1,41 @@
+# Generated by Django 4.2 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_paciente_hospital_registro_unico'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='itemproducao',
+            name='core_itempr_produca_44b3d9_idx',
+        ),
+        migrations.AddIndex(
+            model_name='acesso',
+            index=models.Index(fields=['paciente', '-data_implantacao', '-id'], name='acesso_ultimo'),
+        ),
+        migrations.AddIndex(
+            model_name='conduta',
+            index=models.Index(fields=['paciente', '-criado_em', '-id'], name='conduta_ultima'),
+        ),
+        migrations.AddIndex(
+            model_name='observacao',
+            index=models.Index(fields=['paciente', '-criado_em', '-id'], name='observacao_ultima'),
+        ),
+        migrations.AddIndex(
+            model_name='paciente',
+            index=models.Index(condition=models.Q(('alta', False)), fields=['hospital', 'setor'], name='paciente_internados'),
+        ),
+        migrations.AddIndex(
+            model_name='procedimentovalor',
+            index=models.Index(fields=['procedimento', 'hospital', '-vigencia_inicio'], name='procvalor_vigencia'),
+        ),
+        migrations.AddIndex(
+            model_name='producao',
+            index=models.Index(fields=['data', 'paciente'], name='producao_data_paciente'),
+        ),
+    ]
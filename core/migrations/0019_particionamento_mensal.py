@@ -0,0 +1,127 @@
+# Generated by Django 4.2 on 2026-10-18 15:40
+
+import re
+from datetime import date
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# partições mensais abertas à frente na conversão; depois, manage.py criar_particoes
+MESES_A_FRENTE = 12
+
+
+def _meses(inicio, fim):
+    mes = inicio.replace(day=1)
+    while mes <= fim:
+        yield mes
+        mes = date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+def _proximo(mes):
+    return date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+def _com_data(definicao):
+    """PRIMARY KEY/UNIQUE (a, b) -> (a, b, data): em tabela particionada a chave entra em todo unique."""
+    colunas = re.search(r"\((.*)\)", definicao).group(1)
+    if "data" in [c.strip().strip('"') for c in colunas.split(",")]:
+        return definicao
+    return definicao.replace(f"({colunas})", f"({colunas}, data)", 1)
+
+
+def _particionar_tabela(cursor, tabela, meses):
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')",
+        [tabela],
+    )
+    restricoes = cursor.fetchall()
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+        [tabela],
+    )
+    indices = [(nome, definicao) for nome, definicao in cursor.fetchall() if nome not in {r[0] for r in restricoes}]
+
+    antiga = f"{tabela}_antiga"
+    cursor.execute(f'ALTER TABLE "{tabela}" RENAME TO "{antiga}"')
+    cursor.execute(
+        f'CREATE TABLE "{tabela}" (LIKE "{antiga}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE) '
+        f"PARTITION BY RANGE (data)"
+    )
+    for mes in meses:
+        cursor.execute(
+            f'CREATE TABLE "{tabela}_{mes:%Y_%m}" PARTITION OF "{tabela}" '
+            f"FOR VALUES FROM ('{mes.isoformat()}') TO ('{_proximo(mes).isoformat()}')"
+        )
+    # datas fora das partições mensais (lançamento muito antigo ou digitado errado)
+    cursor.execute(f'CREATE TABLE "{tabela}_padrao" PARTITION OF "{tabela}" DEFAULT')
+    cursor.execute(f'INSERT INTO "{tabela}" SELECT * FROM "{antiga}"')
+    # a sequência de identidade da tabela antiga vai junto com ela
+    cursor.execute(f'DROP TABLE "{antiga}"')
+    cursor.execute(f'CREATE SEQUENCE "{tabela}_id_seq" OWNED BY "{tabela}".id')
+    cursor.execute(f"""ALTER TABLE "{tabela}" ALTER COLUMN id SET DEFAULT nextval('"{tabela}_id_seq"')""")
+    cursor.execute(f"""SELECT setval('"{tabela}_id_seq"', COALESCE(MAX(id), 0) + 1, false) FROM "{tabela}\"""")
+
+    for nome, tipo, definicao in restricoes:
+        if tipo in ("p", "u"):
+            definicao = _com_data(definicao)
+        cursor.execute(f'ALTER TABLE "{tabela}" ADD CONSTRAINT "{nome}" {definicao}')
+    for _, definicao in indices:
+        # lidos antes do RENAME, já citam o nome da tabela nova; no pai valem para cada partição
+        cursor.execute(definicao)
+
+
+def particionar(apps, schema_editor):
+    """
+    Converte core_producao e core_itemproducao em tabelas particionadas por mês
+    (RANGE em data), copiando as linhas. Só no PostgreSQL (12+); reescreve as duas
+    tabelas numa transação, então rode em janela de manutenção.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    Producao = apps.get_model("core", "Producao")
+    ItemProducao = apps.get_model("core", "ItemProducao")
+    producao, item = Producao._meta.db_table, ItemProducao._meta.db_table
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT MIN(data) FROM "{producao}"')
+        hoje = date.today()
+        primeiro = cursor.fetchone()[0] or hoje
+        ultimo = date(hoje.year + (hoje.month - 1 + MESES_A_FRENTE) // 12, (hoje.month - 1 + MESES_A_FRENTE) % 12 + 1, 1)
+        meses = list(_meses(primeiro, ultimo))
+        for tabela in (item, producao):
+            _particionar_tabela(cursor, tabela, meses)
+        # a FK do item aponta para a chave (id, data) da produção; o ON DELETE fica com o Django
+        cursor.execute(
+            f'ALTER TABLE "{item}" ADD CONSTRAINT "{item}_producao_data_fk" '
+            f'FOREIGN KEY (producao_id, data) REFERENCES "{producao}" (id, data) DEFERRABLE INITIALLY DEFERRED'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemproducao',
+            name='data',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            "UPDATE core_itemproducao SET data = (SELECT data FROM core_producao WHERE core_producao.id = core_itemproducao.producao_id)",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name='itemproducao',
+            name='data',
+            field=models.DateField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='itemproducao',
+            name='producao',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='itens', to='core.producao'),
+        ),
+        migrations.RunPython(particionar),
+    ]
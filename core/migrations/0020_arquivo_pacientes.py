@@ -0,0 +1,122 @@
+# Generated by Django 4.2 on 2026-10-18 16:05
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def preencher_alta_em(apps, schema_editor):
+    """Altas anteriores: último dia com produção do paciente, senão a data do cadastro."""
+    Paciente = apps.get_model("core", "Paciente")
+    Producao = apps.get_model("core", "Producao")
+    ultima = (
+        Producao.objects.filter(paciente=models.OuterRef("pk"))
+        .order_by("-data").values("data")[:1]
+    )
+    Paciente.objects.filter(alta=True).update(
+        alta_em=Coalesce(models.Subquery(ultima), models.F("criado_em")),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0019_particionamento_mensal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PacienteArquivo',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('nome', models.CharField(max_length=400)),
+                ('numero', models.CharField(blank=True, max_length=400, null=True)),
+                ('idade', models.IntegerField(blank=True, null=True)),
+                ('registro', models.CharField(blank=True, null=True)),
+                ('diagnostico', models.TextField(blank=True, default='', max_length=400, null=True)),
+                ('alta', models.BooleanField(default=True)),
+                ('alta_em', models.DateField(blank=True, null=True)),
+                ('criado_em', models.DateField()),
+                ('busca', models.TextField(blank=True, default='')),
+                ('arquivado_em', models.DateTimeField(auto_now_add=True)),
+                ('convenio', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.convenio')),
+                ('criado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('hospital', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.hospital')),
+                ('setor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.setor')),
+            ],
+            options={
+                'verbose_name': 'paciente arquivado',
+                'verbose_name_plural': 'pacientes arquivados',
+                'ordering': ['-alta_em', 'nome'],
+            },
+        ),
+        migrations.AddField(
+            model_name='paciente',
+            name='alta_em',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='ProducaoArquivo',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('data', models.DateField()),
+                ('criado_em', models.DateTimeField()),
+                ('total_dia', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('criado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('paciente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='producoes', to='core.pacientearquivo')),
+            ],
+            options={
+                'ordering': ['-data'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ObservacaoArquivo',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('descricao', models.TextField(max_length=4000)),
+                ('criado_em', models.DateTimeField()),
+                ('criado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('paciente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.pacientearquivo')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ItemProducaoArquivo',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('quantidade', models.PositiveIntegerField(default=1)),
+                ('valor_unitario', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('data', models.DateField()),
+                ('procedimento', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.procedimento')),
+                ('producao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='itens', to='core.producaoarquivo')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CondutaArquivo',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('criado_em', models.DateTimeField()),
+                ('criado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('descricao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.condutadescricao')),
+                ('paciente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.pacientearquivo')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AcessoArquivo',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('data_implantacao', models.DateField()),
+                ('dias_acesso', models.IntegerField(blank=True, null=True)),
+                ('criado_em', models.DateField()),
+                ('criado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('nome', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.acessodescricao')),
+                ('paciente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.pacientearquivo')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='producaoarquivo',
+            index=models.Index(fields=['data'], name='producaoarquivo_data'),
+        ),
+        migrations.RunPython(preencher_alta_em, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,26 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user
 from django.core.validators import MinValueValidator
+from django.db.models.functions import Cast, Coalesce
 from django.utils import timezone
 from decimal import Decimal
+import unicodedata
+from django.contrib.postgres.indexes import GinIndex
 
 # Create your models here.
 
+def _pk(obj):
+    # aceita instância de model ou id já resolvido
+    return obj.pk if isinstance(obj, models.Model) else obj
+
+
+def normalizar_busca(*partes):
+    """Junta os textos, tira acentos e passa para minúsculas (coluna Paciente.busca e termos da busca)."""
+    texto = unicodedata.normalize("NFKD", " ".join(str(p) for p in partes if p))
+    return "".join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
 class Procedimento(models.Model):
     TIPO_BOOLEANO = "bool"
     TIPO_INTEIRO = "int"
@@ -64,11 +78,26 @@ class Paciente(models.Model):
     registro = models.CharField(blank=True, null=True)
     diagnostico = models.TextField(max_length=400, default='', blank=True, null=True)
     alta = models.BooleanField(default=False)
+    # dia em que recebeu alta (prazo do arquivamento, core.arquivo); vazio enquanto internado
+    alta_em = models.DateField(null=True, blank=True, editable=False)
     convenio = models.ForeignKey(Convenio, on_delete=models.SET_NULL, null=True,blank=True)
     hospital = models.ForeignKey(Hospital, on_delete=models.SET_NULL, null=True,blank=True)
     
     criado_em = models.DateField(auto_now_add=True)
     criado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True,blank=True)
+    # nome + número + registro normalizados (sem acento, minúsculas), indexado por trigramas
+    busca = models.TextField(default='', blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["busca"], opclasses=["gin_trgm_ops"], name="paciente_busca_trgm"),
+            # internados por hospital/setor (visita, grade, painel, alta do censo)
+            models.Index(fields=["hospital", "setor"], condition=models.Q(alta=False), name="paciente_internados"),
+        ]
+        # chave do censo (importar_censo); registro vazio é gravado como NULL e não conflita
+        constraints = [
+            models.UniqueConstraint(fields=["hospital", "registro"], name="paciente_hospital_registro_unico"),
+        ]
 
     #convenio = models.CharField(blank=True, null=True)
     #conduta = models.CharField(max_length=400, default='')
@@ -79,12 +108,53 @@ class Paciente(models.Model):
     def __str__(self):
         return '(' + self.hospital.nome +')'+self.nome
 
+    def save(self, *args, **kwargs):
+        self.registro = (self.registro or "").strip() or None
+        self.busca = normalizar_busca(self.nome, self.numero, self.registro)
+        if not self.alta:
+            self.alta_em = None
+        elif not self.alta_em:
+            self.alta_em = timezone.localdate()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"nome", "numero", "registro"} & set(update_fields):
+            kwargs["update_fields"] = update_fields = {*update_fields, "busca"}
+        if update_fields is not None and "alta" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "alta_em"}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # hospital/convênio como estavam no banco, para mover a produção em ProducaoDiaria
+        if {"hospital_id", "convenio_id"} <= set(field_names):
+            instance._salvo = (instance.hospital_id, instance.convenio_id)
+        if "nome" in field_names:
+            instance._nome_salvo = instance.nome
+        return instance
+
 class AcessoDescricao(models.Model):
     descricao = models.CharField(max_length=20, blank=False, null=False)
 
     def __str__(self):
         return self.descricao
 
+class DiasDesde(models.Func):
+    """Dias corridos entre a data da coluna e hoje, calculados no banco (date - date é inteiro no PostgreSQL)."""
+    arg_joiner = " - "
+    template = "(%(expressions)s)"
+    output_field = models.IntegerField()
+
+    def __init__(self, expression, hoje=None, **extra):
+        hoje = hoje or timezone.localdate()
+        super().__init__(Cast(models.Value(hoje), models.DateField()), expression, **extra)
+
+
+class AcessoQuerySet(models.QuerySet):
+    def com_dias(self):
+        """Anota `dias`: dias desde a implantação na data de hoje (dias_acesso gravado envelhece)."""
+        return self.annotate(dias=DiasDesde("data_implantacao"))
+
+
 class Acesso(models.Model):
     nome = models.ForeignKey(AcessoDescricao,on_delete=models.SET_NULL, blank=False, null=True)
     data_implantacao = models.DateField()
@@ -93,14 +163,20 @@ class Acesso(models.Model):
     criado_em = models.DateField(auto_now_add=True)
     criado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True,blank=True)
 
+    objects = AcessoQuerySet.as_manager()
+
+    class Meta:
+        # último acesso do paciente (cards da evolução, quadro da visita, cateteres do painel)
+        indexes = [models.Index(fields=["paciente", "-data_implantacao", "-id"], name="acesso_ultimo")]
     
     def __str__(self):
         return self.nome.descricao
 
     def save(self, *args, **kwargs):
         # Calcula a diferença em dias entre a data de implantação e a data de hoje
+        # (só o valor gravado; para exibir use Acesso.objects.com_dias())
         if self.data_implantacao:
-            hoje = timezone.now().date()
+            hoje = timezone.localdate()
             diferenca = hoje - self.data_implantacao
             self.dias_acesso = diferenca.days
         super(Acesso, self).save(*args, **kwargs)
@@ -112,6 +188,9 @@ class Observacao(models.Model):
     criado_em = models.DateTimeField(auto_now_add=True)
     criado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True,blank=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["paciente", "-criado_em", "-id"], name="observacao_ultima")]
+
     def __str__(self):
         return self.descricao
 
@@ -127,6 +206,9 @@ class Conduta(models.Model):
     criado_em = models.DateTimeField(auto_now_add=True)
     criado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True,blank=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["paciente", "-criado_em", "-id"], name="conduta_ultima")]
+
     def __str__(self):
         return self.descricao.descricao
 
@@ -141,6 +223,9 @@ class ProcedimentoValor(models.Model):
 
     class Meta:
         unique_together = ("procedimento", "hospital", "convenio", "vigencia_inicio")
+        # vigências de um procedimento/hospital da mais recente para trás (changelist do admin,
+        # busca da tarifa vigente numa data); o unique acima tem o convênio no meio
+        indexes = [models.Index(fields=["procedimento", "hospital", "-vigencia_inicio"], name="procvalor_vigencia")]
 
     def __str__(self):
         conv = self.convenio.nome if self.convenio else "Todos convênios"
@@ -153,17 +238,22 @@ class ProcedimentoValor(models.Model):
         Recupera o preço vigente na data.
         Regra: (vigencia_inicio <= data) & (vigencia_fim is null or data <= vigencia_fim)
         Se não houver tarifa específica do convênio, tenta 'convenio=None'.
+        Lido do cache em processo (core.tarifas), sem consulta ao banco.
         """
-        qs = cls.objects.filter(
-            procedimento=procedimento, hospital=hospital,
-            vigencia_inicio__lte=data
-        ).filter(models.Q(vigencia_fim__isnull=True) | models.Q(vigencia_fim__gte=data))
-        if convenio:
-            pv = qs.filter(convenio=convenio).order_by("-vigencia_inicio").first()
-            if pv:
-                return pv.valor
-        pv_generic = qs.filter(convenio__isnull=True).order_by("-vigencia_inicio").first()
-        return pv_generic.valor if pv_generic else Decimal("0.00")
+        from .tarifas import tabela
+        return tabela.valor_em(_pk(procedimento), _pk(hospital), _pk(convenio), data)
+
+    @classmethod
+    def valores_em(cls, chaves):
+        """
+        Versão em lote de valor_em: recebe tuplas (procedimento, hospital, convenio, data),
+        com instâncias ou ids, e resolve todas contra a mesma versão da tabela.
+        Devolve {(procedimento_id, hospital_id, convenio_id, data): valor}, mesma regra de valor_em.
+        """
+        from .tarifas import tabela
+        return tabela.valores_em(
+            {(_pk(proc), _pk(hosp), _pk(conv), data) for proc, hosp, conv, data in chaves}
+        )
     
 # class Procedimento(models.Model):
 #     nome = models.CharField(max_length=100, blank=False, null=False)
@@ -181,36 +271,161 @@ class Producao(models.Model):
 
     class Meta:
         unique_together = ("paciente", "data")  # 1 registro agregado por dia/paciente (opcional)
+        # o unique acima começa por paciente; filtros por data (detalhe do dia, exportação, fechamento)
+        indexes = [models.Index(fields=["data", "paciente"], name="producao_data_paciente")]
         ordering = ["-data", "-id"]
 
     def __str__(self):
         return f"Produção {self.paciente} em {self.data}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if {"data", "paciente_id"} <= set(field_names):
+            instance._salvo = (instance.data, instance.paciente_id)
+        return instance
+
+    def _datas_afetadas(self):
+        salvo = getattr(self, "_salvo", None)
+        return (self.data, salvo[0] if salvo else None)
+
+    def clean(self):
+        from django.core.exceptions import ValidationError
+        try:
+            Fechamento.verificar(*self._datas_afetadas())
+        except ValidationError as e:
+            raise ValidationError({"data": e.messages})
+
+    def save(self, *args, **kwargs):
+        # só total_dia é acerto de consistência (recomputar_total), não altera o faturado
+        if set(kwargs.get("update_fields") or ()) != {"total_dia"}:
+            Fechamento.verificar(*self._datas_afetadas())
+        salvo = getattr(self, "_salvo", None)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # ItemProducao.data acompanha a data da produção (chave das partições mensais)
+            if salvo and salvo[0] != self.data:
+                ItemProducao.objects.filter(producao=self).update(data=self.data)
+
+    def chave_diaria(self):
+        """Chave (data, hospital_id, convenio_id) desta produção em ProducaoDiaria."""
+        return (self.data, self.paciente.hospital_id, self.paciente.convenio_id)
+
     def recomputar_total(self, save=True):
         total = self.itens.aggregate(s=models.Sum(models.F("quantidade") * models.F("valor_unitario")))["s"] or Decimal("0")
         self.total_dia = total
         if save:
-            self.save(update_fields=["total_dia"])
+            with transaction.atomic():
+                anterior = (
+                    Producao.objects.select_for_update()
+                    .filter(pk=self.pk).values_list("total_dia", flat=True).first()
+                )
+                self.save(update_fields=["total_dia"])
+                ProducaoDiaria.somar(self.chave_diaria(), total - (anterior or Decimal("0")))
         return total
 
+    @classmethod
+    def aplicar_delta(cls, pk, delta, chave=None):
+        """
+        Soma `delta` ao total_dia direto no banco (UPDATE com F()), sem reler os itens,
+        e repassa a mesma diferença para ProducaoDiaria.
+        Atômico mesmo com duas pessoas lançando no mesmo dia.
+        Chamado a cada item gravado/removido, mesmo com delta zero, para trocar a
+        versão do fragmento de producao_detalhe do grupo (data, hospital).
+        """
+        from . import fragmentos
+
+        if chave is None:
+            chave = (
+                cls.objects.filter(pk=pk)
+                .values_list("data", "paciente__hospital_id", "paciente__convenio_id")
+                .first()
+            )
+            if chave is None:
+                return
+        if delta:
+            # a data restringe o UPDATE à partição do mês
+            cls.objects.filter(pk=pk, data=chave[0]).update(
+                total_dia=Coalesce(models.F("total_dia"), models.Value(Decimal("0"))) + delta
+            )
+            ProducaoDiaria.somar(chave, delta)
+        fragmentos.invalidar(chave[0], chave[1])
+
+    @classmethod
+    def divergentes(cls):
+        """Produções cujo total_dia gravado difere da soma real dos itens (anotada em `total_real`)."""
+        soma = (
+            ItemProducao.objects
+            .filter(producao=models.OuterRef("pk"))
+            .values("producao")
+            .annotate(s=models.Sum(models.F("quantidade") * models.F("valor_unitario")))
+            .values("s")
+        )
+        decimal = models.DecimalField(max_digits=12, decimal_places=2)
+        return (
+            cls.objects
+            .annotate(
+                total_real=Coalesce(models.Subquery(soma, output_field=decimal), models.Value(Decimal("0")), output_field=decimal),
+                total_gravado=Coalesce("total_dia", models.Value(Decimal("0")), output_field=decimal),
+            )
+            .exclude(total_gravado=models.F("total_real"))
+        )
+
+    def salvar_itens(self, itens, removidos=()):
+        """
+        Grava os itens de um formset de uma vez (bulk_create/bulk_update) numa transação,
+        apaga os removidos e aplica um único delta em total_dia no final.
+        """
+        for item in itens:
+            item.producao = self
+            item.data = self.data
+        novos = [item for item in itens if item.pk is None]
+        alterados = [item for item in itens if item.pk is not None]
+        removidos = [item.pk for item in removidos if item.pk is not None]
+        Fechamento.verificar(self.data)
+        with transaction.atomic():
+            ItemProducao.aplicar_valores_vigentes(itens)
+            # totais antigos travados, para o delta não perder uma edição concorrente
+            antigos = dict(
+                ItemProducao.objects
+                .select_for_update()
+                .filter(pk__in=[item.pk for item in alterados])
+                .values_list("pk", models.F("quantidade") * models.F("valor_unitario"))
+            ) if alterados else {}
+            ItemProducao.objects.bulk_create(novos)
+            # filtrar pela data restringe o UPDATE à partição do mês
+            ItemProducao.objects.filter(data=self.data).bulk_update(alterados, ["procedimento", "quantidade", "valor_unitario"])
+            delta = sum((item.total for item in novos), Decimal("0"))
+            delta += sum((item.total - (antigos.get(item.pk) or Decimal("0")) for item in alterados), Decimal("0"))
+            Producao.aplicar_delta(self.pk, delta, chave=self.chave_diaria())
+            # o post_delete de cada item desconta o próprio total
+            if removidos:
+                ItemProducao.objects.filter(pk__in=removidos).delete()
+        # bulk_create/bulk_update não disparam signals
+        from .evolucao import invalidar_cards
+        invalidar_cards(self.paciente_id)
+
 
 class ItemProducao(models.Model):
-    producao = models.ForeignKey(Producao, on_delete=models.CASCADE, related_name="itens")
+    # no PostgreSQL a FK é composta (producao_id, data) -> producao (id, data), criada na
+    # migração 0019: tabelas particionadas não aceitam unique só em id
+    producao = models.ForeignKey(Producao, on_delete=models.CASCADE, related_name="itens", db_constraint=False)
     procedimento = models.ForeignKey(Procedimento, on_delete=models.PROTECT)
     quantidade = models.PositiveIntegerField(default=1, validators=[MinValueValidator(0)])
     # Snapshot do valor unitário vigente na data da produção
     valor_unitario = models.DecimalField(max_digits=12, decimal_places=2, validators=[MinValueValidator(Decimal("0"))])
+    # cópia de producao.data (preenchida no save): chave das partições mensais (core.particoes)
+    data = models.DateField(editable=False)
 
     class Meta:
         unique_together = ("producao", "procedimento")  # evita duplicar o mesmo procedimento no mesmo dia
-        indexes = [models.Index(fields=["producao", "procedimento"])]
 
     def __str__(self):
         return f"{self.procedimento} x{self.quantidade} @ {self.valor_unitario}"
 
     @property
     def total(self):
-        return (self.valor_unitario or Decimal("0")) * self.quantidade
+        return (self.valor_unitario or Decimal("0")) * (self.quantidade or 0)
 
     def clean(self):
         from django.core.exceptions import ValidationError
@@ -220,17 +435,291 @@ class ItemProducao(models.Model):
         if self.procedimento.tipo == Procedimento.TIPO_BOOLEANO and self.quantidade not in (0, 1):
             raise ValidationError({"quantidade": "Para procedimentos booleanos, a quantidade deve ser 0 ou 1."})
 
+    @classmethod
+    def aplicar_valores_vigentes(cls, itens):
+        """
+        Preenche valor_unitario dos itens que ainda não têm valor, resolvendo
+        todas as tarifas de uma vez (formsets, importações).
+        """
+        pendentes = [it for it in itens if it.valor_unitario in (None, Decimal("0"))]
+        if not pendentes:
+            return
+        chaves = [it._chave_tarifa() for it in pendentes]
+        valores = ProcedimentoValor.valores_em(chaves)
+        for it, chave in zip(pendentes, chaves):
+            it.valor_unitario = valores[chave]
+
+    def _chave_tarifa(self):
+        pac = self.producao.paciente
+        return (self.procedimento_id, pac.hospital_id, pac.convenio_id, self.producao.data)
+
     def save(self, *args, **kwargs):
+        Fechamento.verificar(self.producao.data)
+        self.data = self.producao.data
         # se não foi definido explicitamente, pega o valor vigente na data da produção
         if self.valor_unitario in (None, Decimal("0")):
-            data = self.producao.data
-            pac = self.producao.paciente
+            proc, hosp, conv, data = self._chave_tarifa()
             self.valor_unitario = ProcedimentoValor.valor_em(
-                procedimento=self.procedimento,
-                hospital=pac.hospital,
-                convenio=pac.convenio,
+                procedimento=proc,
+                hospital=hosp,
+                convenio=conv,
                 data=data
             )
-        super().save(*args, **kwargs)
-        # atualiza o agregado do dia
-        self.producao.recomputar_total(save=True)
\ No newline at end of file
+        with transaction.atomic():
+            # total anterior relido com a linha travada, como em salvar_itens: se duas sessões
+            # editam o item, a segunda espera e calcula o delta sobre o total da primeira
+            salvo = None
+            if self.pk is not None:
+                salvo = (
+                    ItemProducao.objects
+                    .select_for_update()
+                    .filter(pk=self.pk)
+                    .values_list("producao_id", models.F("quantidade") * models.F("valor_unitario"))
+                    .first()
+                )
+            super().save(*args, **kwargs)
+            # atualiza o agregado do dia só com a diferença deste item
+            if salvo and salvo[0] != self.producao_id:
+                Producao.aplicar_delta(salvo[0], -(salvo[1] or Decimal("0")))
+                salvo = None
+            antigo = (salvo[1] or Decimal("0")) if salvo else Decimal("0")
+            Producao.aplicar_delta(self.producao_id, self.total - antigo)
+
+
+class ProducaoDiaria(models.Model):
+    """
+    Soma de Producao.total_dia por (data, hospital, convênio) do paciente.
+    Mantida incrementalmente pelos deltas de total_dia e pelos signals de
+    Producao/Paciente; `manage.py reconstruir_producao_diaria` refaz do zero.
+    """
+    data = models.DateField()
+    hospital = models.ForeignKey(Hospital, on_delete=models.CASCADE, null=True, blank=True)
+    convenio = models.ForeignKey(Convenio, on_delete=models.CASCADE, null=True, blank=True)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0"))
+
+    class Meta:
+        ordering = ["-data"]
+        # NULL não conflita em UNIQUE comum; uma restrição parcial por combinação de nulos
+        constraints = [
+            models.UniqueConstraint(fields=["data", "hospital", "convenio"], name="producaodiaria_chave_unica"),
+            models.UniqueConstraint(
+                fields=["data", "hospital"], condition=models.Q(convenio__isnull=True),
+                name="producaodiaria_sem_convenio_unica",
+            ),
+            models.UniqueConstraint(
+                fields=["data", "convenio"], condition=models.Q(hospital__isnull=True),
+                name="producaodiaria_sem_hospital_unica",
+            ),
+            models.UniqueConstraint(
+                fields=["data"], condition=models.Q(hospital__isnull=True, convenio__isnull=True),
+                name="producaodiaria_sem_chaves_unica",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.hospital or '—'} / {self.convenio or '—'} em {self.data}: {self.total}"
+
+    @classmethod
+    def _filtro(cls, chave):
+        data, hospital_id, convenio_id = chave
+        return cls.objects.filter(data=data, hospital_id=hospital_id, convenio_id=convenio_id)
+
+    @classmethod
+    def somar(cls, chave, delta):
+        if not delta:
+            return
+        from . import painel
+        painel.invalidar()
+        if cls._filtro(chave).update(total=models.F("total") + delta):
+            return
+        data, hospital_id, convenio_id = chave
+        try:
+            with transaction.atomic():
+                cls.objects.create(data=data, hospital_id=hospital_id, convenio_id=convenio_id, total=delta)
+        except IntegrityError:
+            # outra transação criou a linha entre o UPDATE e o INSERT
+            cls._filtro(chave).update(total=models.F("total") + delta)
+
+    @classmethod
+    def recalcular(cls, chaves):
+        """Refaz as chaves dadas a partir de Producao (troca de data, paciente transferido, exclusões)."""
+        from . import fragmentos, painel
+
+        painel.invalidar()
+
+        for chave in set(chaves):
+            data, hospital_id, convenio_id = chave
+            fragmentos.invalidar(data, hospital_id)
+            agg = Producao.objects.filter(
+                data=data, paciente__hospital_id=hospital_id, paciente__convenio_id=convenio_id,
+            ).aggregate(s=models.Sum("total_dia"), n=models.Count("pk"))
+            if not agg["n"]:
+                cls._filtro(chave).delete()
+                continue
+            total = agg["s"] or Decimal("0")
+            if not cls._filtro(chave).update(total=total):
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(data=data, hospital_id=hospital_id, convenio_id=convenio_id, total=total)
+                except IntegrityError:
+                    cls._filtro(chave).update(total=total)
+
+    @classmethod
+    def reconstruir(cls):
+        from . import painel
+
+        painel.invalidar()
+        linhas = (
+            Producao.objects
+            .values("data", "paciente__hospital_id", "paciente__convenio_id")
+            .annotate(s=models.Sum("total_dia"))
+            .order_by()
+        )
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(
+                [
+                    cls(data=l["data"], hospital_id=l["paciente__hospital_id"],
+                        convenio_id=l["paciente__convenio_id"], total=l["s"] or Decimal("0"))
+                    for l in linhas.iterator(chunk_size=2000)
+                ],
+                batch_size=1000,
+            )
+
+
+class Fechamento(models.Model):
+    """
+    Mês fechado para faturamento. Os agregados do mês ficam congelados em
+    FechamentoItem e a produção com data no mês não pode mais ser alterada
+    (ver Fechamento.verificar); para corrigir, reabre-se o mês.
+    """
+    mes = models.DateField(unique=True, help_text="Primeiro dia do mês")
+    fechado_em = models.DateTimeField(auto_now_add=True)
+    fechado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+
+    CHAVE_MESES = "fechamento:meses"
+
+    class Meta:
+        ordering = ["-mes"]
+
+    def __str__(self):
+        return f"Fechamento {self.mes:%m/%Y}"
+
+    @classmethod
+    def meses_fechados(cls):
+        # lido a cada produção gravada; fica no cache até fechar/reabrir um mês
+        from django.core.cache import cache
+        return cache.get_or_set(cls.CHAVE_MESES, lambda: frozenset(cls.objects.values_list("mes", flat=True)), None)
+
+    @classmethod
+    def invalidar_meses(cls):
+        from django.core.cache import cache
+        transaction.on_commit(lambda: cache.delete(cls.CHAVE_MESES))
+
+    @classmethod
+    def verificar(cls, *datas):
+        """Levanta ValidationError se alguma das datas cair num mês fechado."""
+        from django.core.exceptions import ValidationError
+        fechados = cls.meses_fechados()
+        for data in datas:
+            if data and data.replace(day=1) in fechados:
+                raise ValidationError(f"O mês {data:%m/%Y} está fechado para faturamento e não pode ser alterado.")
+
+
+class FechamentoItem(models.Model):
+    """Quantidade e total do mês por hospital × convênio × procedimento × usuário que lançou."""
+    fechamento = models.ForeignKey(Fechamento, on_delete=models.CASCADE, related_name="itens")
+    hospital = models.ForeignKey(Hospital, on_delete=models.SET_NULL, null=True, blank=True)
+    convenio = models.ForeignKey(Convenio, on_delete=models.SET_NULL, null=True, blank=True)
+    procedimento = models.ForeignKey(Procedimento, on_delete=models.PROTECT)
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    quantidade = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0"))
+
+    class Meta:
+        indexes = [models.Index(fields=["fechamento", "hospital"])]
+
+    def __str__(self):
+        return f"{self.fechamento}: {self.procedimento} x{self.quantidade} = {self.total}"
+
+
+# ----------------------------
+# Arquivo (core.arquivo)
+# ----------------------------
+# Pacientes com alta antiga saem das tabelas quentes para estas, com as mesmas
+# colunas e os mesmos ids; `manage.py arquivar_pacientes` move, o admin restaura.
+
+class PacienteArquivo(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    nome = models.CharField(max_length=400)
+    setor = models.ForeignKey(Setor, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    numero = models.CharField(max_length=400, blank=True, null=True)
+    idade = models.IntegerField(blank=True, null=True)
+    registro = models.CharField(blank=True, null=True)
+    diagnostico = models.TextField(max_length=400, default='', blank=True, null=True)
+    alta = models.BooleanField(default=True)
+    alta_em = models.DateField(null=True, blank=True)
+    convenio = models.ForeignKey(Convenio, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    hospital = models.ForeignKey(Hospital, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    criado_em = models.DateField()
+    criado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    busca = models.TextField(default='', blank=True)
+    arquivado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "paciente arquivado"
+        verbose_name_plural = "pacientes arquivados"
+        ordering = ["-alta_em", "nome"]
+
+    def __str__(self):
+        return self.nome
+
+
+class AcessoArquivo(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    nome = models.ForeignKey(AcessoDescricao, on_delete=models.SET_NULL, null=True, related_name="+")
+    data_implantacao = models.DateField()
+    paciente = models.ForeignKey(PacienteArquivo, on_delete=models.CASCADE, null=True, blank=True)
+    dias_acesso = models.IntegerField(blank=True, null=True)
+    criado_em = models.DateField()
+    criado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+
+
+class ObservacaoArquivo(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    descricao = models.TextField(max_length=4000)
+    paciente = models.ForeignKey(PacienteArquivo, on_delete=models.CASCADE, null=True, blank=True)
+    criado_em = models.DateTimeField()
+    criado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+
+
+class CondutaArquivo(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    descricao = models.ForeignKey(CondutaDescricao, on_delete=models.CASCADE, related_name="+")
+    paciente = models.ForeignKey(PacienteArquivo, on_delete=models.CASCADE, null=True, blank=True)
+    criado_em = models.DateTimeField()
+    criado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+
+
+class ProducaoArquivo(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    paciente = models.ForeignKey(PacienteArquivo, on_delete=models.CASCADE, related_name="producoes")
+    data = models.DateField()
+    criado_em = models.DateTimeField()
+    criado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    total_dia = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+
+    class Meta:
+        ordering = ["-data"]
+        # reabrir um mês com produção arquivada (core.arquivo.verificar_reabertura)
+        indexes = [models.Index(fields=["data"], name="producaoarquivo_data")]
+
+
+class ItemProducaoArquivo(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    producao = models.ForeignKey(ProducaoArquivo, on_delete=models.CASCADE, related_name="itens")
+    # PROTECT como no item quente: a restauração precisa do procedimento
+    procedimento = models.ForeignKey(Procedimento, on_delete=models.PROTECT, related_name="+")
+    quantidade = models.PositiveIntegerField(default=1)
+    valor_unitario = models.DecimalField(max_digits=12, decimal_places=2)
+    data = models.DateField()
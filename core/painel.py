@@ -0,0 +1,96 @@
+# core/painel.py
+"""
+Indicadores da página inicial: pacientes internados por hospital, produção do
+mês atual e do anterior (de ProducaoDiaria) e acessos/cateteres em uso.
+
+O resumo é montado em três consultas agregadas e fica no cache; os signals de
+Paciente, Hospital e Acesso e as gravações em ProducaoDiaria apagam a entrada,
+e o TTL curto cobre o que passa por fora (cargas em lote, virada do mês).
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum, Value, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
+
+from .models import Acesso, Hospital, ProducaoDiaria
+
+CHAVE = "painel:home"
+PAINEL_TTL = 60 * 5
+
+
+def _meses(hoje):
+    atual = hoje.replace(day=1)
+    anterior = (atual - timedelta(days=1)).replace(day=1)
+    return anterior, atual
+
+
+def _montar(hoje):
+    anterior, atual = _meses(hoje)
+    decimal = DecimalField(max_digits=14, decimal_places=2)
+    soma = lambda filtro: Coalesce(Sum("total", filter=filtro), Value(Decimal("0")), output_field=decimal)
+
+    hospitais = list(
+        Hospital.objects
+        .annotate(ativos=Count("paciente", filter=Q(paciente__alta=False)))
+        .order_by("nome")
+        .values("pk", "nome", "ativos")
+    )
+    producao = {
+        p["hospital_id"]: p
+        for p in ProducaoDiaria.objects
+        .filter(data__gte=anterior, data__lte=hoje)
+        .values("hospital_id")
+        .annotate(mes_atual=soma(Q(data__gte=atual)), mes_anterior=soma(Q(data__lt=atual)))
+        .order_by()
+    }
+    for h in hospitais:
+        p = producao.get(h["pk"], {})
+        h["mes_atual"] = p.get("mes_atual", Decimal("0"))
+        h["mes_anterior"] = p.get("mes_anterior", Decimal("0"))
+    # só o acesso em uso de cada paciente (o último, como nos cards), na ordem do índice acesso_ultimo
+    ultimos = (
+        Acesso.objects
+        .filter(paciente__alta=False)
+        .annotate(ordem=Window(
+            RowNumber(), partition_by=[F("paciente_id")], order_by=[F("data_implantacao").desc(), F("pk").desc()],
+        ))
+        .filter(ordem=1)
+    )
+    cateteres = list(
+        Acesso.objects
+        .filter(pk__in=ultimos.values("pk"))
+        .values("nome__descricao")
+        .annotate(n=Count("pk"))
+        .order_by("-n", "nome__descricao")
+    )
+    return {
+        "hospitais": hospitais,
+        "total_hospitais": len(hospitais),
+        "total_ativos": sum(h["ativos"] for h in hospitais),
+        "mes_atual": atual,
+        "mes_anterior": anterior,
+        # inclui produção sem hospital (pacientes sem hospital ou hospital apagado)
+        "producao_mes_atual": sum((p["mes_atual"] for p in producao.values()), Decimal("0")),
+        "producao_mes_anterior": sum((p["mes_anterior"] for p in producao.values()), Decimal("0")),
+        "cateteres": cateteres,
+        "total_cateteres": sum(c["n"] for c in cateteres),
+        "atualizado_em": timezone.now(),
+    }
+
+
+def resumo():
+    hoje = timezone.localdate()
+    chave = f"{CHAVE}:{hoje:%Y-%m-%d}"
+    dados = cache.get(chave)
+    if dados is None:
+        dados = _montar(hoje)
+        cache.set(chave, dados, PAINEL_TTL)
+    return dados
+
+
+def invalidar():
+    transaction.on_commit(lambda: cache.delete(f"{CHAVE}:{timezone.localdate():%Y-%m-%d}"))
@@ -0,0 +1,152 @@
+# core/particoes.py
+"""
+Partições mensais de Producao e ItemProducao (PostgreSQL).
+
+A migração 0019 transforma core_producao e core_itemproducao em tabelas
+particionadas por RANGE na coluna data, uma partição por mês
+(<tabela>_AAAA_MM), mais <tabela>_padrao para datas sem partição. O Django
+continua vendo só a tabela pai; filtros por data (detalhe do dia, exportação,
+fechamento, faturamento) só leem as partições do período.
+
+Manutenção por mês, sem varrer o histórico:
+    VACUUM (ANALYZE) core_itemproducao_2026_10;
+    REINDEX TABLE core_itemproducao_2026_10;
+    pg_dump -t 'core_*producao_2026_10' ...
+
+`criar` abre as partições dos próximos meses (manage.py criar_particoes, via
+cron mensal). Linhas que caíram na partição padrão por falta da partição do mês
+são movidas para ela na criação, com a FK dos itens removida e recriada (e
+validada) na mesma transação.
+"""
+from datetime import date
+
+from django.db import connection, transaction
+
+from .models import ItemProducao, Producao
+
+MESES_A_FRENTE = 12
+
+
+def tabelas():
+    # produção antes dos itens: a FK (producao_id, data) dos itens aponta para ela
+    return [Producao._meta.db_table, ItemProducao._meta.db_table]
+
+
+def particionado():
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM pg_partitioned_table WHERE partrelid = ANY(%s::regclass[])",
+            [tabelas()],
+        )
+        return cursor.fetchone()[0] == len(tabelas())
+
+
+def nome(tabela, mes):
+    return f"{tabela}_{mes:%Y_%m}"
+
+
+def proximo(mes):
+    return date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+def meses(de, ate):
+    """Primeiro dia de cada mês de `de` até `ate`, inclusive."""
+    mes = de.replace(day=1)
+    while mes <= ate:
+        yield mes
+        mes = proximo(mes)
+
+
+def existentes(tabela):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [tabela],
+        )
+        return {linha[0] for linha in cursor.fetchall()}
+
+
+def _na_padrao(cursor, tabela, mes):
+    cursor.execute(
+        f'SELECT EXISTS (SELECT 1 FROM "{tabela}_padrao" WHERE data >= %s AND data < %s)', [mes, proximo(mes)],
+    )
+    return cursor.fetchone()[0]
+
+
+def _checar_adiadas(cursor):
+    # checagens de FK adiadas pendentes na transação impedem o ALTER TABLE: roda agora
+    # (como o check_constraints do Django; as FKs do Django já são todas DEFERRED)
+    cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+    cursor.execute("SET CONSTRAINTS ALL DEFERRED")
+
+
+def _soltar_fk(cursor):
+    """Remove a FK composta (producao_id, data) dos itens e devolve (nome, definição) para recriá-la."""
+    item, producao = ItemProducao._meta.db_table, Producao._meta.db_table
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND confrelid = %s::regclass AND contype = 'f' AND conparentid = 0",
+        [item, producao],
+    )
+    fks = cursor.fetchall()
+    _checar_adiadas(cursor)
+    for conname, _ in fks:
+        cursor.execute(f'ALTER TABLE "{item}" DROP CONSTRAINT "{conname}"')
+    return fks
+
+
+def _criar_mes(cursor, tabela, mes):
+    particao, fim = nome(tabela, mes), proximo(mes)
+    # DDL não aceita parâmetros: os limites são datas geradas aqui
+    limites = f"FROM ('{mes.isoformat()}') TO ('{fim.isoformat()}')"
+    if not _na_padrao(cursor, tabela, mes):
+        cursor.execute(f'CREATE TABLE "{particao}" PARTITION OF "{tabela}" FOR VALUES {limites}')
+        return 0
+    # o PostgreSQL não cria a partição se a padrão já tem linhas do intervalo:
+    # tira as linhas da padrão, cria a partição e devolve as linhas pelo pai
+    cursor.execute(f'CREATE TEMP TABLE movidas (LIKE "{tabela}") ON COMMIT DROP')
+    cursor.execute(
+        f'WITH d AS (DELETE FROM "{tabela}_padrao" WHERE data >= %s AND data < %s RETURNING *) '
+        f"INSERT INTO movidas SELECT * FROM d",
+        [mes, fim],
+    )
+    movidas = cursor.rowcount
+    cursor.execute(f'CREATE TABLE "{particao}" PARTITION OF "{tabela}" FOR VALUES {limites}')
+    cursor.execute(f'INSERT INTO "{tabela}" SELECT * FROM movidas')
+    cursor.execute("DROP TABLE movidas")
+    return movidas
+
+
+def criar(meses_a_frente=MESES_A_FRENTE, desde=None):
+    """
+    Cria as partições que faltam de `desde` (padrão: mês atual) até
+    `meses_a_frente` meses depois. Devolve [(partição, linhas movidas da padrão)].
+    """
+    hoje = date.today()
+    inicio = (desde or hoje).replace(day=1)
+    ate = hoje.replace(day=1)
+    for _ in range(meses_a_frente):
+        ate = proximo(ate)
+    ja = {tabela: existentes(tabela) for tabela in tabelas()}
+    pendentes = [
+        (mes, [t for t in tabelas() if nome(t, mes) not in ja[t]])
+        for mes in meses(inicio, ate)
+    ]
+    pendentes = [(mes, faltando) for mes, faltando in pendentes if faltando]
+    criadas = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        # linhas a mover da padrão: a FK dos itens sai antes e volta validada no fim,
+        # senão o DELETE na produção padrão viola a FK mesmo com os itens indo junto
+        mover = any(_na_padrao(cursor, tabela, mes) for mes, faltando in pendentes for tabela in faltando)
+        fks = _soltar_fk(cursor) if mover else []
+        for mes, faltando in pendentes:
+            for tabela in faltando:
+                criadas.append((nome(tabela, mes), _criar_mes(cursor, tabela, mes)))
+        if fks:
+            _checar_adiadas(cursor)
+        for conname, definicao in fks:
+            cursor.execute(f'ALTER TABLE "{ItemProducao._meta.db_table}" ADD CONSTRAINT "{conname}" {definicao}')
+    return criadas
@@ -0,0 +1,162 @@
+# core/reprecificacao.py
+"""
+Reprecificação retroativa de ItemProducao quando uma tarifa (ProcedimentoValor)
+é publicada ou corrigida com vigência no passado.
+
+O preço novo de cada grupo (procedimento, hospital, convênio, data) sai da
+mesma regra de ItemProducao.save (core.tarifas), e os itens são atualizados
+em UPDATE ... FROM (VALUES ...) por lote de grupos, sem carregar item nenhum.
+Depois total_dia das produções tocadas é recalculado no banco e ProducaoDiaria
+refeita para as chaves afetadas. Meses fechados (Fechamento) ficam de fora, e
+são conferidos de novo no banco dentro da transação que grava.
+"""
+from decimal import Decimal
+
+from django.db import connection, models, transaction
+from django.db.models.functions import Coalesce
+
+from .evolucao import invalidar_cards
+from .models import Fechamento, ItemProducao, Paciente, Producao, ProducaoDiaria, ProcedimentoValor, _pk
+
+LOTE = 500
+
+_SQL = """
+WITH v (procedimento_id, hospital_id, convenio_id, data, valor) AS (VALUES {valores})
+UPDATE {item} AS i SET valor_unitario = v.valor
+FROM v, {producao} AS p, {paciente} AS pa, {item} AS o
+WHERE o.id = i.id
+  AND o.data = i.data
+  AND p.id = i.producao_id
+  AND pa.id = p.paciente_id
+  AND i.procedimento_id = v.procedimento_id
+  AND pa.hospital_id = v.hospital_id
+  AND pa.convenio_id IS NOT DISTINCT FROM v.convenio_id
+  AND p.data = v.data
+  AND i.data = v.data
+  AND i.valor_unitario <> v.valor
+RETURNING i.producao_id, i.quantidade * (v.valor - o.valor_unitario)
+"""
+_LINHA = "(%s::bigint, %s::bigint, %s::bigint, %s::date, %s::numeric)"
+
+
+def escopo_da_tarifa(tarifa):
+    """Filtros de reprecificar/simular cobertos por uma linha de ProcedimentoValor."""
+    return {
+        "procedimento": tarifa.procedimento_id,
+        "hospital": tarifa.hospital_id,
+        "convenio": tarifa.convenio_id,
+        "de": tarifa.vigencia_inicio,
+        "ate": tarifa.vigencia_fim,
+    }
+
+
+def simular(procedimento, hospital, convenio=None, de=None, ate=None):
+    """
+    Uma linha por grupo (procedimento, hospital, convênio, data) com itens no escopo:
+    itens, quantidade, total atual, valor novo, total novo, delta e se o mês está fechado.
+    Tarifa genérica (convenio=None) alcança todos os convênios; a regra de preço decide cada um.
+    """
+    qs = ItemProducao.objects.filter(procedimento_id=_pk(procedimento), producao__paciente__hospital_id=_pk(hospital))
+    if convenio:
+        qs = qs.filter(producao__paciente__convenio_id=_pk(convenio))
+    if de:
+        qs = qs.filter(data__gte=de)
+    if ate:
+        qs = qs.filter(data__lte=ate)
+    grupos = list(
+        qs.values(
+            "data",
+            procedimento_ref=models.F("procedimento_id"),
+            hospital_ref=models.F("producao__paciente__hospital_id"),
+            convenio_ref=models.F("producao__paciente__convenio_id"),
+        )
+        .annotate(
+            itens=models.Count("pk"),
+            qtd=models.Sum("quantidade"),
+            total_atual=models.Sum(models.F("quantidade") * models.F("valor_unitario")),
+        )
+        .order_by("data", "convenio_ref")
+    )
+    chave = lambda g: (g["procedimento_ref"], g["hospital_ref"], g["convenio_ref"], g["data"])
+    precos = ProcedimentoValor.valores_em([chave(g) for g in grupos])
+    fechados = Fechamento.meses_fechados()
+    for g in grupos:
+        g["valor_novo"] = precos[chave(g)]
+        g["total_novo"] = (g["qtd"] or 0) * g["valor_novo"]
+        g["delta"] = g["total_novo"] - (g["total_atual"] or Decimal("0"))
+        g["bloqueado"] = g["data"].replace(day=1) in fechados
+    return grupos
+
+
+def reprecificar(procedimento, hospital, convenio=None, de=None, ate=None, lote=LOTE):
+    """
+    Aplica os preços de simular(); devolve {"itens", "producoes", "delta", "bloqueados"}.
+    "delta" soma a diferença das linhas efetivamente atualizadas; "bloqueados", a
+    diferença simulada dos grupos em mês fechado, que não são gravados.
+    """
+    grupos = simular(procedimento, hospital, convenio, de, ate)
+    resumo = {"itens": 0, "producoes": 0, "delta": Decimal("0"), "bloqueados": Decimal("0")}
+    if not grupos:
+        return resumo
+
+    tabelas = {
+        "item": ItemProducao._meta.db_table,
+        "producao": Producao._meta.db_table,
+        "paciente": Paciente._meta.db_table,
+    }
+    producoes = set()
+    with transaction.atomic():
+        # simular() leu os meses fechados do cache antes da transação; um fechar()
+        # pode ter entrado no meio, então os meses são relidos no banco aqui
+        fechados = set(
+            Fechamento.objects
+            .filter(mes__in={g["data"].replace(day=1) for g in grupos})
+            .values_list("mes", flat=True)
+        )
+        aplicar = []
+        for g in grupos:
+            g["bloqueado"] = g["data"].replace(day=1) in fechados
+            if g["bloqueado"]:
+                resumo["bloqueados"] += g["delta"]
+            else:
+                aplicar.append(g)
+        if not aplicar:
+            return resumo
+
+        with connection.cursor() as cursor:
+            for i in range(0, len(aplicar), lote):
+                parte = aplicar[i:i + lote]
+                params = []
+                for g in parte:
+                    params += [g["procedimento_ref"], g["hospital_ref"], g["convenio_ref"], g["data"], g["valor_novo"]]
+                cursor.execute(_SQL.format(valores=", ".join([_LINHA] * len(parte)), **tabelas), params)
+                for producao_id, delta in cursor.fetchall():
+                    resumo["itens"] += 1
+                    resumo["delta"] += delta
+                    producoes.add(producao_id)
+
+        soma = (
+            ItemProducao.objects
+            .filter(producao=models.OuterRef("pk"))
+            .values("producao")
+            .annotate(s=models.Sum(models.F("quantidade") * models.F("valor_unitario")))
+            .values("s")
+        )
+        decimal = models.DecimalField(max_digits=12, decimal_places=2)
+        producoes = sorted(producoes)
+        pacientes, chaves = set(), set()
+        for i in range(0, len(producoes), lote):
+            parte = Producao.objects.filter(pk__in=producoes[i:i + lote])
+            parte.update(total_dia=Coalesce(models.Subquery(soma, output_field=decimal), models.Value(Decimal("0")), output_field=decimal))
+            for paciente_id, data, hospital_id, convenio_id in parte.values_list(
+                "paciente_id", "data", "paciente__hospital_id", "paciente__convenio_id"
+            ):
+                pacientes.add(paciente_id)
+                chaves.add((data, hospital_id, convenio_id))
+
+        # recalcular também troca a versão dos fragmentos de producao_detalhe
+        ProducaoDiaria.recalcular(chaves)
+        for paciente_id in pacientes:
+            invalidar_cards(paciente_id)
+    resumo["producoes"] = len(producoes)
+    return resumo
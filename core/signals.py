@@ -0,0 +1,166 @@
+# core/signals.py
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from . import arquivo, fragmentos, painel, visita
+from .evolucao import invalidar_cards
+from .models import (
+    Acesso, Conduta, Convenio, Fechamento, Hospital, ItemProducao, Observacao, Paciente,
+    Producao, ProducaoDiaria, ProcedimentoValor,
+)
+from .tarifas import tabela
+
+
+@receiver([post_save, post_delete], sender=ProcedimentoValor)
+def invalidar_tarifas(sender, **kwargs):
+    # só depois do commit, senão outro worker pode recarregar a tabela antiga com a versão nova
+    transaction.on_commit(tabela.invalidar)
+
+
+@receiver(post_delete, sender=Convenio)
+def invalidar_tarifas_convenio(sender, **kwargs):
+    # o SET_NULL em ProcedimentoValor.convenio é um UPDATE em lote, sem signals
+    transaction.on_commit(tabela.invalidar)
+
+
+@receiver(post_delete, sender=ItemProducao)
+def descontar_item_removido(sender, instance, origin=None, **kwargs):
+    # vale para delete() do item, inline do admin e QuerySet.delete();
+    # se quem está sendo apagada é a própria Producao, não há total para manter
+    if isinstance(origin, Producao) or (isinstance(origin, QuerySet) and origin.model is Producao):
+        return
+    # lido com a linha travada no pre_delete; None se outra sessão já tinha apagado o item
+    apagado = getattr(instance, "_apagado", None)
+    if apagado:
+        producao_id, total, _ = apagado
+        Producao.aplicar_delta(producao_id, -(total or 0))
+
+
+# ---------- ProducaoDiaria ----------
+
+def _chave_diaria(data, paciente_id):
+    # lida do banco: o paciente em cache na instância pode ter sido transferido depois
+    hospital_id, convenio_id = (
+        Paciente.objects.values_list("hospital_id", "convenio_id").get(pk=paciente_id)
+    )
+    return (data, hospital_id, convenio_id)
+
+
+@receiver(post_save, sender=Producao)
+def mover_producao_diaria(sender, instance, created, **kwargs):
+    salvo = getattr(instance, "_salvo", None)
+    instance._salvo = (instance.data, instance.paciente_id)
+    if created:
+        chave = _chave_diaria(*instance._salvo)
+        if instance.total_dia:
+            ProducaoDiaria.somar(chave, instance.total_dia)
+        fragmentos.invalidar(chave[0], chave[1])
+        return
+    if salvo and salvo != instance._salvo:
+        ProducaoDiaria.recalcular([_chave_diaria(*salvo), _chave_diaria(*instance._salvo)])
+
+
+@receiver(post_delete, sender=Producao)
+def descontar_producao_diaria(sender, instance, **kwargs):
+    ProducaoDiaria.recalcular([_chave_diaria(instance.data, instance.paciente_id)])
+
+
+@receiver(post_save, sender=Paciente)
+def transferir_producao_diaria(sender, instance, created, **kwargs):
+    salvo = getattr(instance, "_salvo", None)
+    instance._salvo = (instance.hospital_id, instance.convenio_id)
+    if created or not salvo or salvo == instance._salvo:
+        return
+    datas = set(Producao.objects.filter(paciente=instance).values_list("data", flat=True))
+    ProducaoDiaria.recalcular(
+        [(d, *salvo) for d in datas] + [(d, *instance._salvo) for d in datas]
+    )
+
+
+@receiver(post_delete, sender=Hospital)
+@receiver(post_delete, sender=Convenio)
+def reconstruir_producao_diaria(sender, **kwargs):
+    # o SET_NULL em Paciente não dispara signals; raro o bastante para refazer tudo
+    transaction.on_commit(ProducaoDiaria.reconstruir)
+
+
+# ---------- cache dos cards da evolução ----------
+
+@receiver([post_save, post_delete], sender=Observacao)
+@receiver([post_save, post_delete], sender=Acesso)
+@receiver([post_save, post_delete], sender=Conduta)
+@receiver([post_save, post_delete], sender=Producao)
+def invalidar_cards_paciente(sender, instance, **kwargs):
+    invalidar_cards(instance.paciente_id)
+
+
+@receiver([post_save, post_delete], sender=ItemProducao)
+def invalidar_cards_item(sender, instance, **kwargs):
+    if ItemProducao.producao.is_cached(instance):
+        paciente_id = instance.producao.paciente_id
+    else:
+        paciente_id = Producao.objects.filter(pk=instance.producao_id).values_list("paciente_id", flat=True).first()
+    invalidar_cards(paciente_id)
+
+
+@receiver(post_save, sender=Paciente)
+def renomear_paciente_fragmentos(sender, instance, created, **kwargs):
+    # o nome aparece no fragmento de producao_detalhe de cada dia com produção
+    nome_salvo = getattr(instance, "_nome_salvo", None)
+    instance._nome_salvo = instance.nome
+    if created or nome_salvo is None or nome_salvo == instance.nome:
+        return
+    for data in Producao.objects.filter(paciente=instance).values_list("data", flat=True):
+        fragmentos.invalidar(data, instance.hospital_id)
+
+
+# ---------- meses fechados ----------
+
+@receiver([post_save, post_delete], sender=Fechamento)
+def invalidar_meses_fechados(sender, **kwargs):
+    Fechamento.invalidar_meses()
+
+
+@receiver(pre_delete, sender=Fechamento)
+def bloquear_reabertura_arquivada(sender, instance, **kwargs):
+    arquivo.verificar_reabertura(instance.mes)
+
+
+@receiver(pre_delete, sender=Producao)
+def bloquear_exclusao_producao(sender, instance, **kwargs):
+    Fechamento.verificar(instance.data)
+
+
+@receiver(pre_delete, sender=ItemProducao)
+def bloquear_exclusao_item(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Producao) or (isinstance(origin, QuerySet) and origin.model is Producao):
+        return
+    # trava a linha (o delete do Django já roda numa transação): num delete concorrente do mesmo
+    # item a segunda sessão espera, não acha a linha e o post_delete não desconta de novo
+    instance._apagado = (
+        ItemProducao.objects.select_for_update()
+        .filter(pk=instance.pk)
+        .values_list("producao_id", F("quantidade") * F("valor_unitario"), "data")
+        .first()
+    )
+    if instance._apagado:
+        Fechamento.verificar(instance._apagado[2])
+
+
+# ---------- painel da página inicial ----------
+
+@receiver([post_save, post_delete], sender=Paciente)
+@receiver([post_save, post_delete], sender=Hospital)
+@receiver([post_save, post_delete], sender=Acesso)
+def invalidar_painel(sender, **kwargs):
+    painel.invalidar()
+
+
+# ---------- quadro da visita ----------
+
+@receiver([post_save, post_delete], sender=Paciente)
+def invalidar_visita(sender, **kwargs):
+    # alta, transferência e troca de setor mudam quem aparece em qual quadro
+    visita.invalidar_todos()
@@ -0,0 +1,176 @@
+# core/sintetico.py
+"""
+Gerador de dados sintéticos para medir desempenho (comandos gerar_dados_sinteticos
+e benchmark). Rode só em banco de teste/descartável.
+
+Grava tudo com bulk_create, sem passar pelos save()/signals, e deixa os
+derivados coerentes como o app faria: valor_unitario pela regra de tarifas,
+total_dia somado dos itens, Paciente.busca e ProducaoDiaria reconstruída.
+"""
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    Acesso, AcessoDescricao, Conduta, CondutaDescricao, Convenio, Hospital, ItemProducao,
+    Observacao, Paciente, Procedimento, ProcedimentoValor, Producao, ProducaoDiaria, Setor,
+    normalizar_busca,
+)
+from . import visita
+from .tarifas import tabela
+
+PROCEDIMENTOS = [
+    ("Hemodiálise", Procedimento.TIPO_BOOLEANO), ("HDF contínua", Procedimento.TIPO_BOOLEANO),
+    ("Parecer", Procedimento.TIPO_BOOLEANO), ("Implante de cateter", Procedimento.TIPO_BOOLEANO),
+    ("Diálise peritoneal", Procedimento.TIPO_BOOLEANO), ("Sessão extra", Procedimento.TIPO_INTEIRO),
+]
+NOMES = ["Ana", "João", "Maria", "José", "Antônio", "Francisca", "Carlos", "Luíza", "Paulo", "Conceição",
+         "Pedro", "Márcia", "Lucas", "Sebastião", "Raimunda", "Fábio", "Aparecida", "Tiago", "Helena", "Caio"]
+SOBRENOMES = ["Silva", "Santos", "Oliveira", "Souza", "Lima", "Pereira", "Ferreira", "Costa", "Rodrigues",
+              "Almeida", "Nascimento", "Araújo", "Gonçalves", "Ribeiro", "Cavalcanti", "Barbosa"]
+ACESSOS = ["CDL", "Permcath", "FAV", "Shilley"]
+CONDUTAS = ["Manter HD", "Suspender HD", "Ajustar UF", "Solicitar exames", "Alta nefro"]
+LOTE = 5000
+
+
+def _cadastros(model, prefixo, n, **extra):
+    existentes = list(model.objects.filter(nome__startswith=prefixo).order_by("pk"))
+    novos = [model(nome=f"{prefixo}{i:02d}", **extra) for i in range(len(existentes) + 1, n + 1)]
+    return existentes + model.objects.bulk_create(novos)
+
+
+def _descricoes(model, nomes):
+    return [model.objects.get_or_create(descricao=nome)[0] for nome in nomes]
+
+
+def gerar(hospitais=5, convenios=8, pacientes=2000, anos=2, usuarios=3, semente=None, lote=LOTE, progresso=None):
+    """
+    Acrescenta `pacientes` pacientes com internações espalhadas pelos últimos `anos`,
+    uma Producao por dia internado com 1 a 3 itens. Hospitais, convênios, usuários e
+    tarifas sintéticos são reaproveitados entre execuções. Devolve as contagens criadas.
+    """
+    rnd = random.Random(semente)
+    log = progresso or (lambda msg: None)
+    hoje = timezone.localdate()
+    inicio = hoje - timedelta(days=365 * anos)
+
+    with transaction.atomic():
+        hosp = _cadastros(Hospital, "Hospital S", hospitais)
+        conv = _cadastros(Convenio, "Convênio S", convenios)
+        setores = _cadastros(Setor, "Setor S", 6)
+        procs = [Procedimento.objects.get_or_create(nome=nome, defaults={"tipo": tipo})[0] for nome, tipo in PROCEDIMENTOS]
+        users = [
+            User.objects.get_or_create(username=f"sintetico{i}", defaults={"first_name": f"Sintético {i}"})[0]
+            for i in range(1, usuarios + 1)
+        ]
+        acessos = _descricoes(AcessoDescricao, ACESSOS)
+        condutas = _descricoes(CondutaDescricao, CONDUTAS)
+
+        # tarifas: genérica por ano com reajustes no meio do ano (vigências sobrepostas)
+        # e tabela própria para metade dos convênios
+        if not ProcedimentoValor.objects.filter(hospital__in=hosp).exists():
+            tarifas = []
+            for h in hosp:
+                for p in procs:
+                    base = Decimal(rnd.randrange(80, 900))
+                    for ano in range(inicio.year, hoje.year + 1):
+                        tarifas.append(ProcedimentoValor(
+                            procedimento=p, hospital=h, valor=base, vigencia_inicio=inicio.replace(year=ano, month=1, day=1),
+                        ))
+                        tarifas.append(ProcedimentoValor(
+                            procedimento=p, hospital=h, valor=(base * Decimal("1.05")).quantize(Decimal("0.01")),
+                            vigencia_inicio=inicio.replace(year=ano, month=7, day=1),
+                            vigencia_fim=inicio.replace(year=ano, month=9, day=30),
+                        ))
+                        base = (base * Decimal("1.08")).quantize(Decimal("0.01"))
+                    for c in conv[::2]:
+                        tarifas.append(ProcedimentoValor(
+                            procedimento=p, hospital=h, convenio=c, valor=(base * Decimal("1.2")).quantize(Decimal("0.01")),
+                            vigencia_inicio=inicio + timedelta(days=rnd.randrange(0, 365)),
+                        ))
+            ProcedimentoValor.objects.bulk_create(tarifas, batch_size=lote)
+            log(f"{len(tarifas)} tarifas")
+    # bulk_create não dispara o signal que troca a versão da tabela
+    tabela.invalidar()
+
+    contagem = {"pacientes": 0, "producoes": 0, "itens": 0, "acessos": 0}
+    ultimo = Paciente.objects.filter(registro__startswith="SIN").count()
+    # ~30 dias de internação por paciente: lote/10 pacientes dão alguns lotes de itens por transação
+    por_transacao = max(1, lote // 10)
+    for desde in range(0, pacientes, por_transacao):
+        with transaction.atomic():
+            novos, internacoes = [], []
+            for n in range(desde, min(desde + por_transacao, pacientes)):
+                nome = f"{rnd.choice(NOMES)} {rnd.choice(SOBRENOMES)} {rnd.choice(SOBRENOMES)}"
+                registro = f"SIN{ultimo + n + 1:07d}"
+                numero = str(rnd.randrange(1, 400))
+                dias = rnd.choice([3, 5, 7, 10, 15, 20, 30, 45, 60, 90])
+                entrada = inicio + timedelta(days=rnd.randrange(0, max(1, (hoje - inicio).days)))
+                saida = min(entrada + timedelta(days=dias), hoje)
+                novos.append(Paciente(
+                    nome=nome, registro=registro, numero=numero, idade=rnd.randrange(18, 95),
+                    hospital=rnd.choice(hosp), convenio=rnd.choice(conv + [None]), setor=rnd.choice(setores),
+                    alta=saida < hoje, alta_em=saida if saida < hoje else None, criado_por=rnd.choice(users),
+                    busca=normalizar_busca(nome, numero, registro),
+                ))
+                internacoes.append((entrada, saida))
+            novos = Paciente.objects.bulk_create(novos, batch_size=lote)
+            contagem["pacientes"] += len(novos)
+
+            producoes, itens_por_producao = [], []
+            acessos_novos, obs, cond = [], [], []
+            for pac, (entrada, saida) in zip(novos, internacoes):
+                if rnd.random() < 0.4:
+                    acessos_novos.append(Acesso(
+                        nome=rnd.choice(acessos), paciente=pac, data_implantacao=entrada,
+                        dias_acesso=(hoje - entrada).days, criado_por=pac.criado_por,
+                    ))
+                obs += [Observacao(paciente=pac, descricao="Evolução estável.", criado_por=pac.criado_por)
+                        for _ in range(rnd.randrange(0, 3))]
+                cond += [Conduta(paciente=pac, descricao=rnd.choice(condutas), criado_por=pac.criado_por)
+                         for _ in range(rnd.randrange(0, 2))]
+                dia = entrada
+                while dia <= saida:
+                    producoes.append(Producao(paciente=pac, data=dia, criado_por=rnd.choice(users)))
+                    itens_por_producao.append([
+                        ItemProducao(
+                            procedimento=p,
+                            quantidade=rnd.randrange(1, 4) if p.tipo == Procedimento.TIPO_INTEIRO else 1,
+                        )
+                        for p in rnd.sample(procs, rnd.randrange(1, 4))
+                    ])
+                    dia += timedelta(days=1)
+
+            # preço pela regra de tarifas e total_dia já somado antes de gravar
+            chaves = {}
+            for prod, itens in zip(producoes, itens_por_producao):
+                for it in itens:
+                    chaves[id(it)] = (it.procedimento_id, prod.paciente.hospital_id, prod.paciente.convenio_id, prod.data)
+            precos = ProcedimentoValor.valores_em(chaves.values())
+            for prod, itens in zip(producoes, itens_por_producao):
+                for it in itens:
+                    it.valor_unitario = precos[chaves[id(it)]]
+                prod.total_dia = sum((it.total for it in itens), Decimal("0"))
+
+            producoes = Producao.objects.bulk_create(producoes, batch_size=lote)
+            itens = []
+            for prod, lista in zip(producoes, itens_por_producao):
+                for it in lista:
+                    it.producao, it.data = prod, prod.data
+                    itens.append(it)
+            ItemProducao.objects.bulk_create(itens, batch_size=lote)
+            Acesso.objects.bulk_create(acessos_novos, batch_size=lote)
+            Observacao.objects.bulk_create(obs, batch_size=lote)
+            Conduta.objects.bulk_create(cond, batch_size=lote)
+            contagem["producoes"] += len(producoes)
+            contagem["itens"] += len(itens)
+            contagem["acessos"] += len(acessos_novos)
+        log(f"{contagem['pacientes']}/{pacientes} pacientes, {contagem['producoes']} produções, {contagem['itens']} itens")
+
+    ProducaoDiaria.reconstruir()
+    visita.invalidar_todos()
+    return contagem
@@ -0,0 +1,105 @@
+# core/tarifas.py
+"""
+Cache em processo da tabela de tarifas (ProcedimentoValor).
+
+A tabela muda poucas vezes por mês e é lida a cada item de produção salvo,
+então cada processo guarda uma cópia, agrupada por (procedimento, hospital,
+convenio), com as vigências ordenadas pelo início. O preço de uma data sai
+por busca binária, sem consulta ao banco.
+
+A consistência entre workers é feita por um carimbo de versão no cache do
+Django (settings.CACHES precisa ser compartilhado entre os processos): os
+signals de ProcedimentoValor trocam o carimbo e cada processo recarrega a
+tabela quando percebe que o seu ficou velho.
+"""
+import threading
+import uuid
+from bisect import bisect_right
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.cache import cache
+
+CHAVE_VERSAO = "tarifas:versao"
+
+
+class TabelaTarifas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versao = None
+        # {(procedimento_id, hospital_id, convenio_id): (inicios, [(inicio, fim, valor), ...])}
+        self._entradas = None
+
+    def _versao_atual(self):
+        versao = cache.get(CHAVE_VERSAO)
+        if versao is None:
+            cache.add(CHAVE_VERSAO, uuid.uuid4().hex, None)
+            versao = cache.get(CHAVE_VERSAO)
+        return versao
+
+    def _carregar(self):
+        from .models import ProcedimentoValor
+
+        linhas = (
+            ProcedimentoValor.objects
+            .order_by("vigencia_inicio")
+            .values_list("procedimento_id", "hospital_id", "convenio_id", "vigencia_inicio", "vigencia_fim", "valor")
+        )
+        agrupado = defaultdict(list)
+        for proc, hosp, conv, inicio, fim, valor in linhas:
+            agrupado[(proc, hosp, conv)].append((inicio, fim, valor))
+        return {
+            chave: ([v[0] for v in vigencias], vigencias)
+            for chave, vigencias in agrupado.items()
+        }
+
+    def entradas(self):
+        """Tabela do processo, recarregada se o carimbo de versão mudou."""
+        versao = self._versao_atual()
+        entradas = self._entradas
+        if entradas is None or versao != self._versao:
+            with self._lock:
+                if self._entradas is None or versao != self._versao:
+                    self._entradas = self._carregar()
+                    self._versao = versao
+                entradas = self._entradas
+        return entradas
+
+    def invalidar(self):
+        cache.set(CHAVE_VERSAO, uuid.uuid4().hex, None)
+        with self._lock:
+            self._entradas = None
+            self._versao = None
+
+    @staticmethod
+    def _vigente(entradas, chave, data):
+        entrada = entradas.get(chave)
+        if entrada is None:
+            return None
+        inicios, vigencias = entrada
+        # última vigência iniciada até a data; volta enquanto a vigência já tiver terminado
+        i = bisect_right(inicios, data)
+        while i > 0:
+            i -= 1
+            _, fim, valor = vigencias[i]
+            if fim is None or data <= fim:
+                return valor
+        return None
+
+    def valor_em(self, procedimento_id, hospital_id, convenio_id, data, entradas=None):
+        """Tarifa do convênio, senão a genérica (convenio=None), senão zero."""
+        if entradas is None:
+            entradas = self.entradas()
+        valor = None
+        if convenio_id:
+            valor = self._vigente(entradas, (procedimento_id, hospital_id, convenio_id), data)
+        if valor is None:
+            valor = self._vigente(entradas, (procedimento_id, hospital_id, None), data)
+        return valor if valor is not None else Decimal("0.00")
+
+    def valores_em(self, chaves):
+        entradas = self.entradas()
+        return {chave: self.valor_em(*chave, entradas=entradas) for chave in chaves}
+
+
+tabela = TabelaTarifas()
@@ -1,3 +1,1180 @@
-from django.test import TestCase
+import csv
+import json
+import re
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F, QuerySet, Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import arquivo, censo, evolucao, exportacao, faturamento, grade, painel, particoes, visita
+from .exportacao import itens_exportacao, linhas_csv
+from .fechamento import fechar, reabrir
+from .metricas import registro
+from .models import (
+    Acesso, AcessoDescricao, Conduta, Convenio, Fechamento, FechamentoItem, Hospital, ItemProducao, Observacao,
+    Paciente, PacienteArquivo, Procedimento, ProcedimentoValor, Producao, ProducaoArquivo, ProducaoDiaria,
+    normalizar_busca,
+)
+from .reprecificacao import reprecificar, simular
+from .sintetico import gerar
+from .tarifas import tabela
+
+
+def _nos(plano):
+    yield plano
+    for filho in plano.get("Plans", ()):
+        yield from _nos(filho)
+
+
+def _tabela(relacao):
+    """Partição (<tabela>_AAAA_MM, <tabela>_padrao) -> tabela pai."""
+    return re.sub(r"_(\d{4}_\d{2}|padrao)$", "", relacao or "")
+
+
+@skipUnless(connection.vendor == "postgresql", "EXPLAIN dos índices é do PostgreSQL")
+class IndicesConsultasTests(TestCase):
+    """
+    Roda EXPLAIN nas consultas das views sobre uma massa sintética e falha se
+    alguma das tabelas quentes for lida por Seq Scan.
+
+    Com enable_seqscan = off o planejador só escolhe Seq Scan quando nenhum
+    índice serve para a consulta, então o resultado não depende do tamanho da
+    massa nem das estatísticas do momento.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        if particoes.particionado():
+            # a base de teste é migrada vazia: só os meses de hoje em diante têm partição
+            particoes.criar(desde=timezone.localdate() - timedelta(days=400))
+        gerar(hospitais=2, convenios=3, pacientes=300, anos=1, usuarios=1, semente=23)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        cls.hoje = timezone.localdate()
+        cls.hospital = Hospital.objects.filter(paciente__alta=False).order_by("pk").first()
+        cls.paciente = Paciente.objects.filter(hospital=cls.hospital, alta=False).order_by("pk").first()
+
+    def _plano(self, sql, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute("SET enable_seqscan = off")
+            try:
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+                plano = cursor.fetchone()[0]
+            finally:
+                cursor.execute("RESET enable_seqscan")
+        if isinstance(plano, str):
+            plano = json.loads(plano)
+        return list(_nos(plano[0]["Plan"]))
+
+    def _seq_scans(self, sql, params=None):
+        return {n.get("Relation Name") for n in self._plano(sql, params) if n["Node Type"] == "Seq Scan"}
+
+    def assertSemSeqScan(self, qs_ou_sql, *modelos):
+        sql, params = (qs_ou_sql, None) if isinstance(qs_ou_sql, str) else qs_ou_sql.query.sql_with_params()
+        tabelas = {m._meta.db_table for m in modelos}
+        # em tabela particionada o plano cita as partições
+        self.assertFalse({r for r in self._seq_scans(sql, params) if _tabela(r) in tabelas}, sql)
+
+    def _capturar(self, funcao, *args):
+        with CaptureQueriesContext(connection) as cq:
+            funcao(*args)
+        return [q["sql"] for q in cq.captured_queries if q["sql"].lstrip().upper().startswith("SELECT")]
+
+    def test_producao_detalhe(self):
+        qs = Producao.objects.filter(data=self.hoje - timedelta(days=3), paciente__hospital=self.hospital)
+        self.assertSemSeqScan(qs, Producao)
+
+    def test_cards_da_evolucao(self):
+        self.assertSemSeqScan(
+            evolucao._linha(self.paciente.pk, self.hoje),
+            Observacao, Acesso, Conduta, Producao, ItemProducao,
+        )
+
+    def test_quadro_da_visita(self):
+        for sql in self._capturar(visita._consultar, self.hospital.pk, None, self.hoje):
+            with self.subTest(sql=sql[:80]):
+                self.assertSemSeqScan(sql, Paciente, Observacao, Acesso, Conduta, Producao, ItemProducao)
+
+    def test_pacientes_internados(self):
+        for sql in self._capturar(grade.pacientes_da_grade, self.hospital.pk):
+            self.assertSemSeqScan(sql, Paciente)
+
+    def test_exportacao_por_periodo(self):
+        qs = itens_exportacao(de=self.hoje - timedelta(days=7), ate=self.hoje)
+        self.assertSemSeqScan(qs, Producao, ItemProducao)
+
+    def test_vigencias_da_tarifa(self):
+        proc = Procedimento.objects.order_by("pk").first()
+        qs = ProcedimentoValor.objects.filter(
+            procedimento=proc, hospital=self.hospital, vigencia_inicio__lte=self.hoje,
+        ).order_by("-vigencia_inicio")
+        self.assertSemSeqScan(qs, ProcedimentoValor)
+        # ordenação da changelist do admin
+        self.assertSemSeqScan(ProcedimentoValor.objects.order_by("procedimento", "hospital", "-vigencia_inicio"), ProcedimentoValor)
+
+    def test_exportacao_do_mes_le_so_a_particao_do_mes(self):
+        if not particoes.particionado():
+            self.skipTest("sem partições mensais")
+        mes = (self.hoje.replace(day=1) - timedelta(days=1)).replace(day=1)
+        qs = itens_exportacao(de=mes, ate=particoes.proximo(mes) - timedelta(days=1))
+        sql, params = qs.query.sql_with_params()
+        lidas = {n["Relation Name"] for n in self._plano(sql, params) if "Relation Name" in n}
+        self.assertEqual(
+            {r for r in lidas if _tabela(r) == ItemProducao._meta.db_table},
+            {particoes.nome(ItemProducao._meta.db_table, mes)},
+        )
+
+
+@skipUnless(connection.vendor == "postgresql", "partições mensais são do PostgreSQL")
+class ParticoesTests(TestCase):
+    def test_criar_move_linhas_da_particao_padrao(self):
+        # base de teste: partições de hoje até 12 meses à frente; 14 meses cai na padrão
+        mes = timezone.localdate().replace(day=1)
+        for _ in range(14):
+            mes = particoes.proximo(mes)
+        hospital = Hospital.objects.create(nome="H1")
+        paciente = Paciente.objects.create(nome="P", hospital=hospital)
+        proc = Procedimento.objects.create(nome="HD")
+        producao = Producao.objects.create(paciente=paciente, data=mes.replace(day=10))
+        ItemProducao.objects.create(producao=producao, procedimento=proc, valor_unitario=Decimal("5"))
+
+        criadas = dict(particoes.criar(meses_a_frente=15))
+        self.assertEqual(criadas[particoes.nome(Producao._meta.db_table, mes)], 1)
+        self.assertEqual(criadas[particoes.nome(ItemProducao._meta.db_table, mes)], 1)
+        with connection.cursor() as cursor:
+            for model in (Producao, ItemProducao):
+                cursor.execute(f"SELECT tableoid::regclass::text FROM {model._meta.db_table}")
+                self.assertEqual(cursor.fetchall(), [(particoes.nome(model._meta.db_table, mes),)])
+        # FK composta recriada e válida
+        connection.check_constraints()
+        self.assertEqual(producao.itens.count(), 1)
+
+
+class TarifasTests(TestCase):
+    def setUp(self):
+        tabela.invalidar()
+        self.hospital = Hospital.objects.create(nome="H1")
+        self.convenio = Convenio.objects.create(nome="C1")
+        self.proc = Procedimento.objects.create(nome="HD")
+
+    def _valor(self, valor, inicio, fim=None, convenio=None):
+        return ProcedimentoValor.objects.create(
+            procedimento=self.proc, hospital=self.hospital, convenio=convenio,
+            vigencia_inicio=inicio, vigencia_fim=fim, valor=Decimal(valor),
+        )
+
+    def _em(self, data, convenio=None):
+        return ProcedimentoValor.valor_em(self.proc, self.hospital, convenio, data)
+
+    def test_vigencias_sobrepostas_e_sem_fim(self):
+        self._valor("10", date(2026, 1, 1))
+        self._valor("20", date(2026, 3, 1), date(2026, 3, 31))
+        self.assertEqual(self._em(date(2026, 2, 15)), Decimal("10"))
+        # a mais recente iniciada vale enquanto está vigente; depois volta a sem fim
+        self.assertEqual(self._em(date(2026, 3, 31)), Decimal("20"))
+        self.assertEqual(self._em(date(2026, 4, 1)), Decimal("10"))
+
+    def test_convenio_sem_tarifa_propria_usa_a_generica(self):
+        self._valor("10", date(2026, 1, 1))
+        self._valor("15", date(2026, 3, 1), convenio=self.convenio)
+        outro = Convenio.objects.create(nome="C2")
+        self.assertEqual(self._em(date(2026, 2, 1), self.convenio), Decimal("10"))
+        self.assertEqual(self._em(date(2026, 3, 1), self.convenio), Decimal("15"))
+        self.assertEqual(self._em(date(2026, 3, 1), outro), Decimal("10"))
+        self.assertEqual(self._em(date(2026, 3, 1)), Decimal("10"))
+
+    def test_data_antes_da_primeira_vigencia(self):
+        self._valor("10", date(2026, 1, 1))
+        self.assertEqual(self._em(date(2025, 12, 31)), Decimal("0.00"))
+        self.assertEqual(
+            ProcedimentoValor.valores_em([(self.proc, self.hospital, None, date(2025, 12, 31))]),
+            {(self.proc.pk, self.hospital.pk, None, date(2025, 12, 31)): Decimal("0.00")},
+        )
+
+    def test_gravar_e_apagar_tarifa_invalida_a_tabela(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            pv = self._valor("10", date(2026, 1, 1))
+        self.assertEqual(self._em(date(2026, 2, 1)), Decimal("10"))
+        with self.assertNumQueries(0):
+            self.assertEqual(self._em(date(2026, 2, 2)), Decimal("10"))
+        pv.valor = Decimal("30")
+        with self.captureOnCommitCallbacks(execute=True):
+            pv.save()
+        self.assertEqual(self._em(date(2026, 2, 1)), Decimal("30"))
+        with self.captureOnCommitCallbacks(execute=True):
+            pv.delete()
+        self.assertEqual(self._em(date(2026, 2, 1)), Decimal("0.00"))
+
+
+class SalvarItensTests(TestCase):
+    def setUp(self):
+        hospital = Hospital.objects.create(nome="H1")
+        self.paciente = Paciente.objects.create(nome="P", hospital=hospital)
+        self.procs = [Procedimento.objects.create(nome=f"P{i}", tipo=Procedimento.TIPO_INTEIRO) for i in range(6)]
+        self.hoje = timezone.localdate()
+
+    def _itens(self, n):
+        return [
+            ItemProducao(procedimento=proc, quantidade=2, valor_unitario=Decimal("10"))
+            for proc in self.procs[:n]
+        ]
+
+    def test_novos_alterados_e_removidos_num_delta(self):
+        producao = Producao.objects.create(paciente=self.paciente, data=self.hoje)
+        producao.salvar_itens(self._itens(3))
+        a, b, c = producao.itens.order_by("pk")
+        a.quantidade = 5
+        novo = ItemProducao(procedimento=self.procs[3], quantidade=1, valor_unitario=Decimal("7"))
+        producao.salvar_itens([a, novo], removidos=[b])
+        producao.refresh_from_db()
+        # a 5x10 + c 2x10 + novo 1x7
+        self.assertEqual(producao.total_dia, Decimal("77"))
+        self.assertFalse(Producao.divergentes().exists())
+        self.assertEqual(ProducaoDiaria.objects.get(data=self.hoje).total, Decimal("77"))
+
+    def test_consultas_nao_crescem_com_os_itens(self):
+        contagens = []
+        # a primeira carrega a tabela de tarifas e os meses fechados no cache
+        for n in (1, 2, 6):
+            paciente = Paciente.objects.create(nome=f"P{n}", hospital=self.paciente.hospital)
+            producao = Producao.objects.create(paciente=paciente, data=self.hoje)
+            with CaptureQueriesContext(connection) as cq:
+                producao.salvar_itens(self._itens(n))
+            contagens.append(len(cq))
+        self.assertEqual(contagens[1], contagens[2])
+
+
+@skipUnless(connection.vendor == "postgresql", "DiasDesde usa date - date do PostgreSQL")
+class DiasAcessoTests(TestCase):
+    def test_com_dias_igual_ao_valor_gravado_no_save(self):
+        paciente = Paciente.objects.create(nome="P", hospital=Hospital.objects.create(nome="H1"))
+        nome = AcessoDescricao.objects.create(descricao="CDL")
+        hoje = timezone.localdate()
+        for dias in (0, 1, 45, 400):
+            with self.subTest(dias=dias):
+                acesso = Acesso.objects.create(paciente=paciente, nome=nome, data_implantacao=hoje - timedelta(days=dias))
+                # dias_acesso é o que o template mostrava, gravado no save()
+                self.assertEqual(acesso.dias_acesso, dias)
+                self.assertEqual(Acesso.objects.com_dias().get(pk=acesso.pk).dias, dias)
+
+    def test_valor_gravado_envelhece_e_o_comando_acerta(self):
+        paciente = Paciente.objects.create(nome="P", hospital=Hospital.objects.create(nome="H1"))
+        acesso = Acesso.objects.create(
+            paciente=paciente, nome=AcessoDescricao.objects.create(descricao="CDL"),
+            data_implantacao=timezone.localdate() - timedelta(days=10),
+        )
+        # gravado há 7 dias
+        Acesso.objects.filter(pk=acesso.pk).update(dias_acesso=3)
+        self.assertEqual(Acesso.objects.com_dias().get(pk=acesso.pk).dias, 10)
+        call_command("atualizar_dias_acesso", stdout=StringIO())
+        acesso.refresh_from_db()
+        self.assertEqual(acesso.dias_acesso, 10)
+
+
+class ProducaoListTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user("medico", password="x"))
+        # dois hospitais com o mesmo nome: empate em data e nome, desempata pelo id
+        hospitais = [Hospital.objects.create(nome=n) for n in ("B", "A", "B")]
+        self.hoje = timezone.localdate()
+        for dias in (0, 1):
+            for h in hospitais:
+                ProducaoDiaria.objects.create(data=self.hoje - timedelta(days=dias), hospital=h, total=Decimal("10"))
+        self.ordem = [
+            (self.hoje - timedelta(days=dias), h.pk)
+            for dias in (0, 1) for h in sorted(hospitais, key=lambda h: (h.nome, h.pk))
+        ]
+
+    def _linhas(self, resposta):
+        return [(l["data"], l["hospital_id"]) for l in resposta.context["agregados"]]
+
+    def test_cursor_percorre_empates_ate_a_ultima_pagina(self):
+        vistas, paginas = [], 0
+        with mock.patch("core.views.PRODUCAO_POR_PAGINA", 2):
+            resposta = self.client.get("/producao/")
+            while True:
+                paginas += 1
+                vistas += self._linhas(resposta)
+                if not resposta.context["proximo"]:
+                    break
+                resposta = self.client.get(f"/producao/?{resposta.context['proximo']}")
+                self.assertTemplateUsed(resposta, "producao/_linhas.html")
+        self.assertEqual(vistas, self.ordem)
+        self.assertEqual(paginas, 3)
+
+    def test_pagina_exata_nao_tem_proxima(self):
+        with mock.patch("core.views.PRODUCAO_POR_PAGINA", 3):
+            resposta = self.client.get("/producao/")
+            resposta = self.client.get(f"/producao/?{resposta.context['proximo']}")
+        self.assertEqual(self._linhas(resposta), self.ordem[3:])
+        self.assertIsNone(resposta.context["proximo"])
+
+    def test_cursor_invalido_mostra_a_primeira_pagina(self):
+        for apos in ("xx", "2026-02-30:1", f"{self.hoje:%Y-%m-%d}:abc", ":"):
+            with self.subTest(apos=apos):
+                resposta = self.client.get("/producao/", {"apos": apos})
+                self.assertEqual(resposta.status_code, 200)
+                self.assertTemplateUsed(resposta, "producao/list.html")
+                self.assertEqual(self._linhas(resposta), self.ordem)
+
+
+@skipUnless(connection.vendor == "postgresql", "os dias de acesso usam DiasDesde")
+class PacienteAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", password="x"))
+        self.hospital = Hospital.objects.create(nome="H1")
+        self.nome = AcessoDescricao.objects.create(descricao="CDL")
+        self.proc = Procedimento.objects.create(nome="HD")
+        self.hoje = timezone.localdate()
+
+    def _criar(self, n):
+        for i in range(n):
+            paciente = Paciente.objects.create(nome=f"P{i}", hospital=self.hospital)
+            Acesso.objects.create(paciente=paciente, nome=self.nome, data_implantacao=self.hoje)
+            producao = Producao.objects.create(paciente=paciente, data=self.hoje)
+            ItemProducao.objects.create(producao=producao, procedimento=self.proc, valor_unitario=Decimal("10"))
+
+    def _changelist(self, n):
+        self._criar(n)
+        # sessão, usuário, hospitais do filtro, duas contagens, a lista anotada e os
+        # content types do admin: nenhuma consulta por linha
+        with self.assertNumQueries(8):
+            resposta = self.client.get("/admin/core/paciente/")
+        self.assertEqual(len(resposta.context["cl"].result_list), n)
+        self.assertEqual({p._dias_acesso for p in resposta.context["cl"].result_list}, {0})
+
+    def test_changelist_com_n_pacientes(self):
+        self._changelist(5)
+
+    def test_changelist_com_2n_pacientes(self):
+        self._changelist(10)
+
+
+@skipUnless(connection.vendor == "postgresql", "os cards da evolução usam ArraySubquery")
+class CardsEvolucaoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hoje = timezone.localdate()
+        self.paciente = Paciente.objects.create(nome="P", hospital=Hospital.objects.create(nome="H1"))
+        cdl, fav = AcessoDescricao.objects.create(descricao="CDL"), AcessoDescricao.objects.create(descricao="FAV")
+        Acesso.objects.create(paciente=self.paciente, nome=cdl, data_implantacao=self.hoje - timedelta(days=30))
+        Acesso.objects.create(paciente=self.paciente, nome=fav, data_implantacao=self.hoje - timedelta(days=3))
+        self.hd, self.dp = (Procedimento.objects.create(nome=n, tipo=Procedimento.TIPO_INTEIRO) for n in ("HD", "DP"))
+        self.producao = Producao.objects.create(paciente=self.paciente, data=self.hoje)
+        ItemProducao.objects.create(producao=self.producao, procedimento=self.hd, quantidade=2, valor_unitario=Decimal("10"))
+        ontem = Producao.objects.create(paciente=self.paciente, data=self.hoje - timedelta(days=1))
+        ItemProducao.objects.create(producao=ontem, procedimento=self.dp, valor_unitario=Decimal("99"))
+
+    def test_ultimo_acesso_e_itens_de_hoje(self):
+        cards = evolucao.cards_context(self.paciente)
+        self.assertEqual(cards["last_acesso"]["nome"], "FAV")
+        self.assertEqual(cards["last_acesso"]["dias"], 3)
+        self.assertEqual(cards["last_acesso"]["data_implantacao"], self.hoje - timedelta(days=3))
+        self.assertEqual(cards["prod_hoje"]["total_dia"], Decimal("20"))
+        self.assertEqual(cards["prod_hoje"]["itens"], [{"procedimento": "HD", "quantidade": 2}])
+        self.assertIsNone(cards["last_obs"])
+        self.client.force_login(User.objects.create_user("medico", password="x"))
+        resposta = self.client.get(f"/pacientes/{self.paciente.pk}/evolucao/")
+        self.assertContains(resposta, "<strong>FAV</strong>", html=True)
+        self.assertContains(resposta, "3 dia(s)")
+
+    def test_item_gravado_invalida_o_cache(self):
+        evolucao.cards_context(self.paciente)
+        with self.assertNumQueries(0):
+            evolucao.cards_context(self.paciente)
+        with self.captureOnCommitCallbacks(execute=True):
+            ItemProducao.objects.create(producao=self.producao, procedimento=self.dp, valor_unitario=Decimal("5"))
+        cards = evolucao.cards_context(self.paciente)
+        self.assertEqual(cards["prod_hoje"]["total_dia"], Decimal("25"))
+        self.assertEqual(
+            cards["prod_hoje"]["itens"],
+            [{"procedimento": "DP", "quantidade": 1}, {"procedimento": "HD", "quantidade": 2}],
+        )
+
+
+class DetalheProducaoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user("medico", password="x"))
+        self.hoje = timezone.localdate()
+        hospital = Hospital.objects.create(nome="H1")
+        self.producao = Producao.objects.create(
+            paciente=Paciente.objects.create(nome="P", hospital=hospital), data=self.hoje,
+        )
+        ItemProducao.objects.create(
+            producao=self.producao, procedimento=Procedimento.objects.create(nome="HD"), valor_unitario=Decimal("10"),
+        )
+        self.url = f"/producao/detalhe/{self.hoje:%Y-%m-%d}/{hospital.pk}/"
+
+    def test_repetida_com_if_none_match_devolve_304(self):
+        primeira = self.client.get(self.url)
+        self.assertEqual(primeira.status_code, 200)
+        self.assertIn("Last-Modified", primeira.headers)
+        segunda = self.client.get(self.url, HTTP_IF_NONE_MATCH=primeira["ETag"])
+        self.assertEqual(segunda.status_code, 304)
+        self.assertEqual(segunda["ETag"], primeira["ETag"])
+
+    def test_item_gravado_troca_a_versao(self):
+        primeira = self.client.get(self.url)
+        self.assertNotContains(primeira, "DP")
+        with self.captureOnCommitCallbacks(execute=True):
+            ItemProducao.objects.create(
+                producao=self.producao, procedimento=Procedimento.objects.create(nome="DP"), valor_unitario=Decimal("5"),
+            )
+        segunda = self.client.get(self.url, HTTP_IF_NONE_MATCH=primeira["ETag"])
+        self.assertEqual(segunda.status_code, 200)
+        self.assertNotEqual(segunda["ETag"], primeira["ETag"])
+        self.assertContains(segunda, "DP")
+        self.assertContains(segunda, "HD")
+
+
+class ExportacaoTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user("medico", password="x")
+        self.hoje = timezone.localdate()
+        hospital = Hospital.objects.create(nome="H1")
+        convenio = Convenio.objects.create(nome="SUS")
+        proc = Procedimento.objects.create(nome="HD", codigo="0305", tipo=Procedimento.TIPO_INTEIRO)
+        for i in range(5):
+            paciente = Paciente.objects.create(nome=f"P{i}", hospital=hospital, convenio=convenio, registro=f"R{i}")
+            producao = Producao.objects.create(paciente=paciente, data=self.hoje)
+            ItemProducao.objects.create(producao=producao, procedimento=proc, quantidade=i + 1, valor_unitario=Decimal("10"))
+        self.esperado = [["\ufeffhospital", *exportacao.CABECALHO[1:]]] + [
+            ["H1", "SUS", f"P{i}", f"R{i}", f"{self.hoje}", "HD", "0305", f"{i + 1}", Decimal("10"), Decimal((i + 1) * 10)]
+            for i in range(5)
+        ]
+
+    def _ler(self, texto):
+        linhas = list(csv.reader(StringIO(texto), delimiter=";"))
+        # decimais: o texto muda com o banco (10 ou 10.00)
+        return linhas[:1] + [[*l[:8], Decimal(l[8]), Decimal(l[9])] for l in linhas[1:]]
+
+    def test_linhas_saem_em_lotes(self):
+        qs = itens_exportacao(de=self.hoje, ate=self.hoje)
+        with mock.patch.object(QuerySet, "iterator", autospec=True, side_effect=QuerySet.iterator) as iterator:
+            linhas = linhas_csv(qs, chunk_size=2)
+            # gerador: nada é lido do banco antes de pedir as linhas
+            with self.assertNumQueries(0):
+                cabecalho = next(linhas)
+            self.assertEqual(self._ler(cabecalho + "".join(linhas)), self.esperado)
+        iterator.assert_called_once_with(qs, chunk_size=2)
+
+    async def test_linhas_async_saem_em_lotes(self):
+        qs = itens_exportacao(de=self.hoje, ate=self.hoje)
+        with mock.patch.object(exportacao, "_lote", side_effect=exportacao._lote) as lote:
+            texto = "".join([linha async for linha in exportacao.alinhas_csv(qs, chunk_size=2)])
+        self.assertEqual(self._ler(texto), self.esperado)
+        # 2 + 2 + 1 linhas
+        self.assertEqual([c.args[1] for c in lote.call_args_list], [2, 2, 2])
+
+    def test_view_wsgi_transmite_o_csv(self):
+        self.client.force_login(self.usuario)
+        resposta = self.client.get("/producao/exportar.csv")
+        self.assertTrue(resposta.streaming)
+        self.assertFalse(resposta.is_async)
+        self.assertEqual(self._ler(b"".join(resposta.streaming_content).decode()), self.esperado)
+
+    async def test_view_asgi_transmite_com_iterador_async(self):
+        await sync_to_async(self.async_client.force_login)(self.usuario)
+        resposta = await self.async_client.get("/producao/exportar.csv")
+        # iterador síncrono seria lido inteiro com sync_to_async(list) antes do primeiro byte
+        self.assertTrue(resposta.is_async)
+        conteudo = b"".join([parte async for parte in resposta.streaming_content])
+        self.assertEqual(self._ler(conteudo.decode()), self.esperado)
+
+    def test_comando_recusa_data_inexistente(self):
+        with self.assertRaisesMessage(CommandError, "Data inválida em --de"):
+            call_command("exportar_producao", de="2026-02-30")
+
+
+class FaturamentoTests(TestCase):
+    def test_planilha_com_nomes_repetidos_fecha_os_totais(self):
+        from openpyxl import load_workbook
+
+        hoje = timezone.localdate()
+        hospital = Hospital.objects.create(nome="H1")
+        # dois convênios com o mesmo nome
+        c1, c2 = Convenio.objects.create(nome="SUS"), Convenio.objects.create(nome="SUS")
+        dp, hd, tx = (Procedimento.objects.create(nome=n) for n in ("DP", "HD", "TX"))
+        itens = [(c1, dp, 2, "10"), (c2, dp, 1, "5"), (c1, hd, 1, "7"), (c2, hd, 3, "1"), (c1, tx, 1, "4")]
+        for i, (conv, proc, qtd, valor) in enumerate(itens):
+            paciente = Paciente.objects.create(nome=f"P{i}", hospital=hospital, convenio=conv)
+            producao = Producao.objects.create(paciente=paciente, data=hoje)
+            ItemProducao.objects.create(producao=producao, procedimento=proc, quantidade=qtd, valor_unitario=Decimal(valor))
+
+        with tempfile.TemporaryDirectory() as destino:
+            caminho, n = faturamento.gerar_planilha(hospital.pk, hoje.year, hoje.month, destino)
+            wb = load_workbook(caminho)
+        self.assertEqual(n, 5)
+        self.assertEqual(wb.sheetnames, ["SUS", "SUS (2)"])
+
+        def subtotais(ws):
+            return [
+                (linha[3], Decimal(str(linha[6])))
+                for linha in ws.iter_rows(min_row=2, values_only=True) if str(linha[3]).startswith(("Subtotal", "Total"))
+            ]
+        # c1: DP 2x10, HD 1x7, TX 1x4; c2: DP 1x5, HD 3x1
+        self.assertEqual(subtotais(wb["SUS"]), [
+            ("Subtotal DP", Decimal("20")), ("Subtotal HD", Decimal("7")), ("Subtotal TX", Decimal("4")),
+            ("Total do convênio", Decimal("31")),
+        ])
+        self.assertEqual(subtotais(wb["SUS (2)"]), [
+            ("Subtotal DP", Decimal("5")), ("Subtotal HD", Decimal("3")), ("Total do convênio", Decimal("8")),
+        ])
+
+
+class FechamentoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hoje = timezone.localdate()
+        self.usuario = User.objects.create_user("medico", password="x")
+        self.proc = Procedimento.objects.create(nome="HD", tipo=Procedimento.TIPO_INTEIRO)
+        self.outro = Procedimento.objects.create(nome="DP", tipo=Procedimento.TIPO_INTEIRO)
+        convenios = [None, Convenio.objects.create(nome="C1")]
+        self.producoes = []
+        for i, hospital in enumerate(Hospital.objects.create(nome=n) for n in ("H1", "H2")):
+            for j, convenio in enumerate(convenios):
+                paciente = Paciente.objects.create(nome=f"P{i}{j}", hospital=hospital, convenio=convenio)
+                producao = Producao.objects.create(paciente=paciente, data=self.hoje, criado_por=self.usuario)
+                ItemProducao.objects.create(
+                    producao=producao, procedimento=self.proc, quantidade=i + j + 1, valor_unitario=Decimal("10"),
+                )
+                self.producoes.append(producao)
+        self.item = ItemProducao.objects.filter(producao=self.producoes[0]).get()
+
+    def _fechar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return fechar(self.hoje.year, self.hoje.month, self.usuario)
+
+    def assertBloqueado(self, operacao):
+        # o delete do Django roda numa transação própria; o erro não pode estragar a do teste
+        with self.assertRaisesMessage(ValidationError, "está fechado"), transaction.atomic():
+            operacao()
+
+    def test_mes_fechado_bloqueia_producao_e_itens(self):
+        self._fechar()
+        producao = Producao.objects.get(pk=self.producoes[0].pk)
+        item = ItemProducao.objects.get(pk=self.item.pk)
+        item.quantidade = 9
+        novo = ItemProducao(producao=producao, procedimento=self.outro, valor_unitario=Decimal("1"))
+        self.assertBloqueado(item.save)
+        self.assertBloqueado(novo.save)
+        self.assertBloqueado(lambda: producao.salvar_itens([novo]))
+        self.assertBloqueado(ItemProducao.objects.get(pk=self.item.pk).delete)
+        self.assertBloqueado(ItemProducao.objects.filter(producao=producao).delete)
+        self.assertBloqueado(producao.delete)
+        novo_paciente = Paciente.objects.create(nome="Novo", hospital=producao.paciente.hospital)
+        self.assertBloqueado(lambda: Producao.objects.create(paciente=novo_paciente, data=self.hoje))
+        producao.data = particoes.proximo(self.hoje)
+        self.assertBloqueado(producao.save)
+        self.assertEqual(ItemProducao.objects.count(), 4)
+        self.assertFalse(Producao.divergentes().exists())
+        # o mês seguinte continua aberto
+        seguinte = Producao.objects.create(paciente=self.producoes[1].paciente, data=particoes.proximo(self.hoje))
+        ItemProducao.objects.create(producao=seguinte, procedimento=self.proc, valor_unitario=Decimal("1"))
+
+    def test_snapshot_bate_com_producao_diaria(self):
+        fechamento = self._fechar()
+        inicio, fim = self.hoje.replace(day=1), particoes.proximo(self.hoje) - timedelta(days=1)
+        diaria = {
+            (l["hospital"], l["convenio"]): l["s"]
+            for l in ProducaoDiaria.objects.filter(data__range=(inicio, fim))
+            .values("hospital", "convenio").annotate(s=Sum("total")).order_by()
+        }
+        snapshot = {
+            (l["hospital"], l["convenio"]): l["s"]
+            for l in fechamento.itens.values("hospital", "convenio").annotate(s=Sum("total")).order_by()
+        }
+        self.assertEqual(len(snapshot), 4)
+        self.assertEqual(snapshot, diaria)
+        self.assertEqual(
+            set(fechamento.itens.values_list("procedimento", "usuario", "quantidade")),
+            {(self.proc.pk, self.usuario.pk, q) for q in (1, 2, 3)},
+        )
+        with self.assertRaisesMessage(ValidationError, "já está fechado"):
+            fechar(self.hoje.year, self.hoje.month)
+
+    def test_reabrir_desbloqueia(self):
+        self._fechar()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(reabrir(self.hoje.year, self.hoje.month))
+        self.assertFalse(FechamentoItem.objects.exists())
+        item = ItemProducao.objects.get(pk=self.item.pk)
+        item.quantidade = 9
+        item.save()
+        ItemProducao.objects.get(pk=self.item.pk).delete()
+        self.assertFalse(Producao.divergentes().exists())
+        self.assertFalse(reabrir(self.hoje.year, self.hoje.month))
+
+
+class CensoTests(TestCase):
+    def setUp(self):
+        self.hoje = timezone.localdate()
+        self.h1, self.h2 = Hospital.objects.create(nome="H1"), Hospital.objects.create(nome="H2")
+        self.c1, self.c2 = Convenio.objects.create(nome="C1"), Convenio.objects.create(nome="C2")
+        self.jose = Paciente.objects.create(nome="Jose", hospital=self.h1, registro="R1", convenio=self.c1, numero="12")
+        self.maria = Paciente.objects.create(nome="Maria", hospital=self.h1, registro="R2")
+        # mesmo registro em outro hospital e paciente sem registro
+        self.outro = Paciente.objects.create(nome="Outro", hospital=self.h2, registro="R1")
+        self.sem_registro = Paciente.objects.create(nome="Sem registro", hospital=self.h1)
+        producao = Producao.objects.create(paciente=self.jose, data=self.hoje)
+        ItemProducao.objects.create(
+            producao=producao, procedimento=Procedimento.objects.create(nome="HD"), valor_unitario=Decimal("10"),
+        )
+
+    def _linha(self, registro, nome, hospital="H1", **extra):
+        return {"hospital": hospital, "registro": registro, "nome": nome, **extra}
+
+    def test_casa_por_hospital_e_registro(self):
+        resumo = censo.importar([self._linha("R1", "Jose"), self._linha("R3", "Novo", hospital="h1")], dar_alta=False)
+        self.assertEqual(resumo, {"criados": 1, "atualizados": 1, "altas": 0})
+        self.assertEqual(Paciente.objects.filter(registro="R1").count(), 2)
+        self.assertEqual(Paciente.objects.get(hospital=self.h1, registro="R3").nome, "Novo")
+        self.outro.refresh_from_db()
+        self.assertEqual(self.outro.nome, "Outro")
+
+    def test_alta_de_quem_saiu_do_censo(self):
+        self.assertEqual(censo.importar([self._linha("R1", "Jose")], dar_alta=False)["altas"], 0)
+        self.assertFalse(Paciente.objects.get(pk=self.maria.pk).alta)
+        self.assertEqual(censo.importar([self._linha("R1", "Jose")])["altas"], 1)
+        maria = Paciente.objects.get(pk=self.maria.pk)
+        self.assertEqual((maria.alta, maria.alta_em), (True, self.hoje))
+        # sem registro o censo não casa; outro hospital não estava no arquivo
+        self.assertFalse(Paciente.objects.get(pk=self.sem_registro.pk).alta)
+        self.assertFalse(Paciente.objects.get(pk=self.outro.pk).alta)
+        # reinternado: volta a ativo
+        censo.importar([self._linha("R1", "Jose"), self._linha("R2", "Maria")])
+        maria.refresh_from_db()
+        self.assertEqual((maria.alta, maria.alta_em), (False, None))
+
+    def test_busca_recalculada_com_o_nome(self):
+        censo.importar([self._linha("R1", "José da Silva")], dar_alta=False)
+        jose = Paciente.objects.get(pk=self.jose.pk)
+        self.assertEqual(jose.busca, normalizar_busca("José da Silva", "12", "R1"))
+        self.assertIn("jose da silva", jose.busca)
+
+    def test_troca_de_convenio_move_producao_diaria(self):
+        censo.importar([self._linha("R1", "Jose", convenio="c2")], dar_alta=False)
+        self.assertEqual(Paciente.objects.get(pk=self.jose.pk).convenio, self.c2)
+        diaria = set(ProducaoDiaria.objects.values_list("hospital", "convenio", "total"))
+        self.assertEqual(diaria, {(self.h1.pk, self.c2.pk, Decimal("10"))})
+        ProducaoDiaria.reconstruir()
+        self.assertEqual(set(ProducaoDiaria.objects.values_list("hospital", "convenio", "total")), diaria)
+
+    def test_cadastros_desconhecidos(self):
+        with self.assertRaisesMessage(ValidationError, "linha 3: hospital 'H9' não cadastrado"):
+            censo.importar([self._linha("R1", "Jose"), self._linha("R9", "X", hospital="H9")])
+        with self.assertRaisesMessage(ValidationError, "Convênios não cadastrados: C9"):
+            censo.importar([self._linha("R1", "Jose", convenio="C9")])
+        self.assertFalse(Convenio.objects.filter(nome="C9").exists())
+        self.assertEqual(Paciente.objects.get(pk=self.jose.pk).convenio, self.c1)
+        censo.importar([self._linha("R1", "Jose", convenio="C9")], criar_cadastros=True, dar_alta=False)
+        self.assertEqual(Paciente.objects.get(pk=self.jose.pk).convenio.nome, "C9")
+
+
+@skipUnless(connection.vendor == "postgresql", "UPDATE ... FROM (VALUES ...) com casts do PostgreSQL")
+class ReprecificacaoTests(TestCase):
+    def setUp(self):
+        tabela.invalidar()
+        cache.clear()
+        self.hoje = timezone.localdate()
+        self.mes_passado = self.hoje.replace(day=1) - timedelta(days=1)
+        self.hospital = Hospital.objects.create(nome="H1")
+        self.c1, self.c2 = Convenio.objects.create(nome="C1"), Convenio.objects.create(nome="C2")
+        self.proc = Procedimento.objects.create(nome="HD")
+        self.itens = {}
+        for nome, convenio in (("A", self.c1), ("B", self.c2), ("C", None)):
+            paciente = Paciente.objects.create(nome=nome, hospital=self.hospital, convenio=convenio)
+            for data in (self.mes_passado, self.hoje):
+                producao = Producao.objects.create(paciente=paciente, data=data)
+                self.itens[nome, data] = ItemProducao.objects.create(
+                    producao=producao, procedimento=self.proc, quantidade=2, valor_unitario=Decimal("10"),
+                )
+        inicio = self.mes_passado.replace(day=1)
+        ProcedimentoValor.objects.create(procedimento=self.proc, hospital=self.hospital, valor=Decimal("20"), vigencia_inicio=inicio)
+        ProcedimentoValor.objects.create(
+            procedimento=self.proc, hospital=self.hospital, convenio=self.c1, valor=Decimal("30"), vigencia_inicio=inicio,
+        )
+
+    def _valor(self, nome, data):
+        return ItemProducao.objects.get(pk=self.itens[nome, data].pk).valor_unitario
+
+    def _reprecificar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return reprecificar(self.proc, self.hospital)
+
+    def test_tarifa_do_convenio_e_generica(self):
+        resumo = self._reprecificar()
+        self.assertEqual((resumo["itens"], resumo["producoes"]), (6, 6))
+        for data in (self.mes_passado, self.hoje):
+            self.assertEqual(self._valor("A", data), Decimal("30"))
+            self.assertEqual(self._valor("B", data), Decimal("20"))
+            self.assertEqual(self._valor("C", data), Decimal("20"))
+        self.assertFalse(Producao.divergentes().exists())
+        diaria = set(ProducaoDiaria.objects.values_list("data", "convenio", "total"))
+        ProducaoDiaria.reconstruir()
+        self.assertEqual(set(ProducaoDiaria.objects.values_list("data", "convenio", "total")), diaria)
+        # nada mais a mudar
+        self.assertEqual(self._reprecificar()["itens"], 0)
+
+    def test_simulacao_e_aplicacao_dao_o_mesmo_delta(self):
+        simulado = sum((g["delta"] for g in simular(self.proc, self.hospital)), Decimal("0"))
+        antes = ItemProducao.objects.aggregate(s=Sum(F("quantidade") * F("valor_unitario")))["s"]
+        resumo = self._reprecificar()
+        depois = ItemProducao.objects.aggregate(s=Sum(F("quantidade") * F("valor_unitario")))["s"]
+        self.assertEqual(simulado, Decimal("160"))
+        self.assertEqual(resumo["delta"], simulado)
+        self.assertEqual(depois - antes, simulado)
+
+    def test_delta_vem_das_linhas_atualizadas(self):
+        item = self.itens["A", self.hoje]
+
+        def simular_e_editar(*args):
+            grupos = simular(*args)
+            # outra sessão já gravou o preço novo entre a simulação e o UPDATE
+            ItemProducao.objects.filter(pk=item.pk).update(valor_unitario=Decimal("30"))
+            return grupos
+
+        with mock.patch("core.reprecificacao.simular", side_effect=simular_e_editar):
+            resumo = self._reprecificar()
+        self.assertEqual((resumo["itens"], resumo["delta"]), (5, Decimal("120")))
+
+    def test_mes_fechado_fica_de_fora(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            fechar(self.mes_passado.year, self.mes_passado.month)
+        resumo = self._reprecificar()
+        self.assertEqual((resumo["itens"], resumo["delta"], resumo["bloqueados"]), (3, Decimal("80"), Decimal("80")))
+        self.assertEqual(self._valor("A", self.mes_passado), Decimal("10"))
+        self.assertEqual(self._valor("A", self.hoje), Decimal("30"))
+        self.assertFalse(Producao.divergentes().exists())
+
+    def test_mes_fechado_depois_da_simulacao(self):
+        # o cache de meses ainda não viu o fechamento: a transação relê no banco
+        Fechamento.meses_fechados()
+        Fechamento.objects.create(mes=self.mes_passado.replace(day=1))
+        resumo = self._reprecificar()
+        self.assertEqual((resumo["itens"], resumo["delta"], resumo["bloqueados"]), (3, Decimal("80"), Decimal("80")))
+        self.assertEqual(self._valor("B", self.mes_passado), Decimal("10"))
+        self.assertEqual(self._valor("B", self.hoje), Decimal("20"))
+
+
+@skipUnless(connection.vendor == "postgresql", "Acesso.com_dias usa date - date do PostgreSQL")
+class VisitaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hoje = timezone.localdate()
+        self.h1, self.h2 = Hospital.objects.create(nome="H1"), Hospital.objects.create(nome="H2")
+        self.ana = Paciente.objects.create(nome="Ana", hospital=self.h1, numero="1")
+        self.bia = Paciente.objects.create(nome="Bia", hospital=self.h1, numero="2")
+        self.caio = Paciente.objects.create(nome="Caio", hospital=self.h2, numero="1")
+
+    def _acesso(self, paciente, descricao, dias):
+        return Acesso.objects.create(
+            paciente=paciente, nome=AcessoDescricao.objects.get_or_create(descricao=descricao)[0],
+            data_implantacao=self.hoje - timedelta(days=dias),
+        )
+
+    def _quadro(self, hospital):
+        return {l["paciente"].nome: l for l in visita.quadro(hospital.pk)}
+
+    def test_ultimo_acesso_de_cada_paciente(self):
+        self._acesso(self.ana, "Cateter antigo", 10)
+        self._acesso(self.ana, "Cateter", 3)
+        # mesma data: vale o lançado por último
+        self._acesso(self.ana, "Fístula", 3)
+        self._acesso(self.bia, "Permcath", 5)
+        self._acesso(self.caio, "Outro hospital", 1)
+        quadro = self._quadro(self.h1)
+        self.assertEqual(list(quadro), ["Ana", "Bia"])
+        self.assertEqual(quadro["Ana"]["last_acesso"], {"nome": "Fístula", "data_implantacao": self.hoje - timedelta(days=3), "dias": 3})
+        self.assertEqual(quadro["Bia"]["last_acesso"]["nome"], "Permcath")
+        self.assertEqual(quadro["Bia"]["last_acesso"]["dias"], 5)
+
+    def test_acesso_novo_troca_a_versao_do_hospital(self):
+        self._acesso(self.ana, "Cateter", 3)
+        self._quadro(self.h1), self._quadro(self.h2)
+        with self.assertNumQueries(0):
+            self._quadro(self.h1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._acesso(self.ana, "Fístula", 0)
+        self.assertEqual(self._quadro(self.h1)["Ana"]["last_acesso"]["nome"], "Fístula")
+        # o quadro do outro hospital continua no cache
+        with self.assertNumQueries(0):
+            self._quadro(self.h2)
+
+    def test_transferencia_e_alta_trocam_a_versao_geral(self):
+        self.assertEqual(list(self._quadro(self.h1)), ["Ana", "Bia"])
+        self.assertEqual(list(self._quadro(self.h2)), ["Caio"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ana.hospital = self.h2
+            self.ana.save()
+        self.assertEqual(list(self._quadro(self.h1)), ["Bia"])
+        self.assertEqual(list(self._quadro(self.h2)), ["Ana", "Caio"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bia.alta = True
+            self.bia.save()
+        self.assertEqual(self._quadro(self.h1), {})
+
+
+class TotaisTests(TestCase):
+    """total_dia mantido por deltas tem de bater com a soma dos itens em toda operação."""
+
+    def setUp(self):
+        self.hoje = timezone.localdate()
+        hospital = Hospital.objects.create(nome="H1")
+        self.paciente = Paciente.objects.create(nome="P", hospital=hospital)
+        self.proc = Procedimento.objects.create(nome="HD", tipo=Procedimento.TIPO_INTEIRO)
+        self.producao = Producao.objects.create(paciente=self.paciente, data=self.hoje)
+        self.item = ItemProducao.objects.create(
+            producao=self.producao, procedimento=self.proc, quantidade=2, valor_unitario=Decimal("10"),
+        )
+
+    def assertTotal(self, producao, total):
+        self.assertFalse(Producao.divergentes().exists())
+        producao.refresh_from_db()
+        self.assertEqual(producao.total_dia, Decimal(total))
+
+    def test_criar(self):
+        self.assertTotal(self.producao, "20")
+
+    def test_editar(self):
+        item = ItemProducao.objects.get(pk=self.item.pk)
+        item.quantidade = 3
+        item.save()
+        self.assertTotal(self.producao, "30")
+
+    def test_apagar(self):
+        ItemProducao.objects.get(pk=self.item.pk).delete()
+        self.assertTotal(self.producao, "0")
+
+    def test_apagar_queryset(self):
+        outro = Procedimento.objects.create(nome="DP", tipo=Procedimento.TIPO_INTEIRO)
+        ItemProducao.objects.create(producao=self.producao, procedimento=outro, valor_unitario=Decimal("7"))
+        ItemProducao.objects.filter(producao=self.producao).delete()
+        self.assertTotal(self.producao, "0")
+
+    def test_mover_item_para_outra_producao(self):
+        outra = Producao.objects.create(paciente=self.paciente, data=self.hoje + timedelta(days=1))
+        item = ItemProducao.objects.get(pk=self.item.pk)
+        item.producao = outra
+        item.save()
+        self.assertTotal(self.producao, "0")
+        self.assertTotal(outra, "20")
+        item.refresh_from_db()
+        self.assertEqual(item.data, outra.data)
+
+    def test_trocar_data_da_producao(self):
+        producao = Producao.objects.get(pk=self.producao.pk)
+        producao.data = self.hoje + timedelta(days=40)
+        producao.save()
+        self.assertTotal(producao, "20")
+        self.assertEqual(list(producao.itens.values_list("data", flat=True)), [producao.data])
+
+    def test_duas_sessoes_editam_o_mesmo_item(self):
+        primeira, segunda = ItemProducao.objects.get(pk=self.item.pk), ItemProducao.objects.get(pk=self.item.pk)
+        primeira.quantidade = 3
+        primeira.save()
+        # a segunda carregou o item antes da gravação da primeira
+        segunda.quantidade = 5
+        segunda.save()
+        self.assertTotal(self.producao, "50")
+
+    def test_duas_sessoes_apagam_o_mesmo_item(self):
+        primeira, segunda = ItemProducao.objects.get(pk=self.item.pk), ItemProducao.objects.get(pk=self.item.pk)
+        primeira.delete()
+        segunda.delete()
+        self.assertTotal(self.producao, "0")
+
+    def test_verificar_totais_recusa_data_invalida(self):
+        for opcoes in ({"de": "ontem"}, {"ate": "2026-02-30"}):
+            with self.subTest(**opcoes), self.assertRaisesMessage(CommandError, "Data inválida"):
+                call_command("verificar_totais", **opcoes)
+
+    def test_verificar_totais_corrige(self):
+        Producao.objects.filter(pk=self.producao.pk).update(total_dia=Decimal("1"))
+        with self.assertRaisesMessage(CommandError, "1 produção(ões)"):
+            call_command("verificar_totais", de=self.hoje.isoformat(), stdout=StringIO())
+        call_command("verificar_totais", corrigir=True, stdout=StringIO())
+        self.assertTotal(self.producao, "20")
+
+
+class ProducaoDiariaTests(TestCase):
+    """ProducaoDiaria mantida incrementalmente tem de bater com reconstruir()."""
+
+    def setUp(self):
+        self.hoje = timezone.localdate()
+        self.h1, self.h2 = Hospital.objects.create(nome="H1"), Hospital.objects.create(nome="H2")
+        self.c1, self.c2 = Convenio.objects.create(nome="C1"), Convenio.objects.create(nome="C2")
+        self.proc = Procedimento.objects.create(nome="HD", tipo=Procedimento.TIPO_INTEIRO)
+        self.outro = Procedimento.objects.create(nome="DP", tipo=Procedimento.TIPO_INTEIRO)
+        self.p1 = Paciente.objects.create(nome="P1", hospital=self.h1, convenio=self.c1)
+        self.p2 = Paciente.objects.create(nome="P2", hospital=self.h2, convenio=self.c1)
+        self.producao = Producao.objects.create(paciente=self.p1, data=self.hoje)
+        self.item = self._item(self.producao, self.proc, 2, "10")
+        self._item(Producao.objects.create(paciente=self.p2, data=self.hoje), self.proc, 1, "10")
+
+    def _item(self, producao, proc, quantidade, valor):
+        return ItemProducao.objects.create(
+            producao=producao, procedimento=proc, quantidade=quantidade, valor_unitario=Decimal(valor),
+        )
+
+    def assertIgualReconstruida(self):
+        # linhas zeradas: o incremental só cria a linha no primeiro delta
+        def linhas():
+            return set(ProducaoDiaria.objects.exclude(total=0).values_list("data", "hospital", "convenio", "total"))
+        incremental = linhas()
+        ProducaoDiaria.reconstruir()
+        self.assertEqual(incremental, linhas())
+
+    def test_criar(self):
+        self.assertIgualReconstruida()
+
+    def test_editar_itens(self):
+        item = ItemProducao.objects.get(pk=self.item.pk)
+        item.quantidade = 5
+        item.save()
+        self.assertIgualReconstruida()
+        # formset: um item novo e o antigo removido, num único delta
+        novo = ItemProducao(procedimento=self.outro, quantidade=1, valor_unitario=Decimal("7"))
+        self.producao.salvar_itens([novo], removidos=[item])
+        self.assertIgualReconstruida()
+
+    def test_transferir_paciente(self):
+        paciente = Paciente.objects.get(pk=self.p1.pk)
+        paciente.hospital = self.h2
+        paciente.save()
+        self.assertIgualReconstruida()
+        paciente.convenio = self.c2
+        paciente.save()
+        self.assertIgualReconstruida()
+
+    def test_mover_item_e_trocar_data(self):
+        outra = Producao.objects.create(paciente=self.p2, data=self.hoje + timedelta(days=1))
+        item = ItemProducao.objects.get(pk=self.item.pk)
+        item.producao = outra
+        item.save()
+        self.assertIgualReconstruida()
+        producao = Producao.objects.get(pk=outra.pk)
+        producao.data = self.hoje + timedelta(days=40)
+        producao.save()
+        self.assertIgualReconstruida()
+
+    def test_apagar(self):
+        ItemProducao.objects.filter(producao__paciente=self.p2).delete()
+        self.assertIgualReconstruida()
+        Producao.objects.get(pk=self.producao.pk).delete()
+        self.assertIgualReconstruida()
+
+
+class PainelTests(TestCase):
+    def test_cateteres_conta_so_o_ultimo_acesso_do_paciente(self):
+        hospital = Hospital.objects.create(nome="H1")
+        cdl, fav = AcessoDescricao.objects.create(descricao="CDL"), AcessoDescricao.objects.create(descricao="FAV")
+        hoje = timezone.localdate()
+        trocou = Paciente.objects.create(nome="Trocou", hospital=hospital)
+        Acesso.objects.create(paciente=trocou, nome=cdl, data_implantacao=hoje - timedelta(days=30))
+        Acesso.objects.create(paciente=trocou, nome=fav, data_implantacao=hoje - timedelta(days=2))
+        Acesso.objects.create(paciente=Paciente.objects.create(nome="CDL", hospital=hospital), nome=cdl, data_implantacao=hoje)
+        alta = Paciente.objects.create(nome="Alta", hospital=hospital, alta=True)
+        Acesso.objects.create(paciente=alta, nome=cdl, data_implantacao=hoje)
+
+        dados = painel._montar(hoje)
+        self.assertEqual(
+            [(c["nome__descricao"], c["n"]) for c in dados["cateteres"]], [("CDL", 1), ("FAV", 1)],
+        )
+        self.assertEqual(dados["total_cateteres"], 2)
+
+
+class GradeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hoje = timezone.localdate()
+        hospital = Hospital.objects.create(nome="H1")
+        self.pacientes = [Paciente.objects.create(nome=n, hospital=hospital) for n in ("A", "B")]
+        self.proc = Procedimento.objects.create(nome="HD", tipo=Procedimento.TIPO_INTEIRO)
+        ProcedimentoValor.objects.create(
+            procedimento=self.proc, hospital=hospital, vigencia_inicio=self.hoje, valor=Decimal("10"),
+        )
+        a, b = self.pacientes
+        grade.salvar(self.pacientes, [self.proc], self.hoje, {(a.pk, self.proc.pk): 2, (b.pk, self.proc.pk): 1})
+
+    def test_celula_zerada_apaga_o_item(self):
+        a, b = self.pacientes
+        resumo = grade.salvar(self.pacientes, [self.proc], self.hoje, {(a.pk, self.proc.pk): 2})
+        self.assertEqual(resumo["removidos"], 1)
+        self.assertFalse(ItemProducao.objects.filter(producao__paciente=b).exists())
+        self.assertFalse(Producao.divergentes().exists())
+        self.assertEqual(ProducaoDiaria.objects.get(data=self.hoje).total, Decimal("20"))
+
+    def test_producao_criada_por_outra_sessao_nao_conta(self):
+        hospital = self.pacientes[0].hospital
+        c, d = [Paciente.objects.create(nome=n, hospital=hospital) for n in ("C", "D")]
+        bulk_create = QuerySet.bulk_create
+
+        def concorrente(qs, objs, *args, **kwargs):
+            if qs.model is Producao:
+                # outra sessão grava a produção de C antes do nosso INSERT
+                Producao.objects.create(paciente=c, data=self.hoje, total_dia=Decimal("0"))
+            return bulk_create(qs, objs, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, "bulk_create", autospec=True, side_effect=concorrente):
+            resumo = grade.salvar([c, d], [self.proc], self.hoje, {(c.pk, self.proc.pk): 1, (d.pk, self.proc.pk): 1})
+        self.assertEqual((resumo["producoes"], resumo["itens"]), (1, 2))
+        self.assertEqual(Producao.objects.filter(paciente__in=[c, d]).count(), 2)
+        self.assertFalse(Producao.divergentes().exists())
+
+    def test_mes_fechado_durante_a_grade_nao_apaga(self):
+        # o mês fecha entre a primeira conferência e o DELETE dentro da transação
+        fechado = frozenset({self.hoje.replace(day=1)})
+        a, _ = self.pacientes
+        with mock.patch.object(Fechamento, "meses_fechados", side_effect=[frozenset(), fechado]), \
+                self.assertRaises(ValidationError):
+            grade.salvar(self.pacientes, [self.proc], self.hoje, {(a.pk, self.proc.pk): 2})
+        self.assertEqual(ItemProducao.objects.count(), 2)
+
+
+@skipUnless(connection.vendor == "postgresql", "a relevância da busca usa pg_trgm")
+class BuscaPacientesTests(TestCase):
+    def test_cada_palavra_filtra_em_qualquer_ordem(self):
+        hospital = Hospital.objects.create(nome="H1")
+        jose = Paciente.objects.create(nome="José da Silva", hospital=hospital)
+        Paciente.objects.create(nome="Silvana Costa", hospital=hospital)
+        Paciente.objects.create(nome="José Pereira", hospital=hospital)
+        self.client.force_login(User.objects.create_user("medico", password="x"))
+        for q, esperados in (("silva jose", [jose.nome]), ("  SILVA   josé ", [jose.nome]), ("costa", ["Silvana Costa"])):
+            with self.subTest(q=q):
+                resposta = self.client.get("/pacientes/", {"q": q})
+                self.assertEqual([p.nome for p in resposta.context["pacientes"]], esperados)
+
+
+class ArquivoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hoje = timezone.localdate()
+        self.hospital = Hospital.objects.create(nome="H1")
+        proc = Procedimento.objects.create(nome="HD", tipo=Procedimento.TIPO_INTEIRO)
+        self.antigo = Paciente.objects.create(nome="Antigo", hospital=self.hospital, registro="R1")
+        self.internado = Paciente.objects.create(nome="Internado", hospital=self.hospital, registro="R2")
+        self.data = arquivo.limite(14, self.hoje)
+        self.producao = Producao.objects.create(paciente=self.antigo, data=self.data)
+        ItemProducao.objects.create(producao=self.producao, procedimento=proc, quantidade=2, valor_unitario=Decimal("10"))
+        Observacao.objects.create(paciente=self.antigo, descricao="estável")
+        Paciente.objects.filter(pk=self.antigo.pk).update(alta=True, alta_em=arquivo.limite(13, self.hoje))
+        self.criado_em = Producao.objects.get(pk=self.producao.pk).criado_em
+
+    def _fechar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            fechar(self.data.year, self.data.month)
+
+    def test_alta_em_acompanha_alta(self):
+        self.internado.alta = True
+        self.internado.save(update_fields=["alta"])
+        self.assertEqual(Paciente.objects.get(pk=self.internado.pk).alta_em, self.hoje)
+        self.internado.alta = False
+        self.internado.save()
+        self.assertIsNone(Paciente.objects.get(pk=self.internado.pk).alta_em)
+
+    def test_arquiva_e_restaura(self):
+        self._fechar()
+        chave = ProducaoDiaria.objects.filter(data=self.data, hospital=self.hospital)
+        self.assertEqual(chave.get().total, Decimal("20"))
+
+        r = arquivo.arquivar(meses=12)
+        self.assertEqual((r["paciente"], r["producao"], r["itemproducao"], r["observacao"]), (1, 1, 1, 1))
+        self.assertFalse(Paciente.objects.filter(pk=self.antigo.pk).exists())
+        self.assertFalse(ItemProducao.objects.filter(producao_id=self.producao.pk).exists())
+        self.assertTrue(Paciente.objects.filter(pk=self.internado.pk).exists())
+        self.assertEqual(ProducaoArquivo.objects.get(pk=self.producao.pk).itens.get().quantidade, 2)
+        self.assertFalse(chave.exists())
+        with self.assertRaises(ValidationError):
+            reabrir(self.data.year, self.data.month)
+
+        arquivo.restaurar([self.antigo.pk])
+        self.assertFalse(PacienteArquivo.objects.exists())
+        producao = Producao.objects.get(pk=self.producao.pk)
+        self.assertEqual((producao.paciente_id, producao.criado_em), (self.antigo.pk, self.criado_em))
+        self.assertEqual(producao.itens.get().data, self.data)
+        self.assertEqual(chave.get().total, Decimal("20"))
+
+    def test_producao_em_mes_aberto_fica(self):
+        r = arquivo.arquivar(meses=12)
+        self.assertEqual(r["ignorados"], 1)
+        self.assertTrue(Paciente.objects.filter(pk=self.antigo.pk).exists())
+        self.assertEqual(arquivo.arquivar(meses=12, meses_abertos=True)["paciente"], 1)
+
+    def test_restaurar_registro_recadastrado(self):
+        arquivo.arquivar(meses=12, meses_abertos=True)
+        Paciente.objects.create(nome="Antigo de novo", hospital=self.hospital, registro="R1")
+        with self.assertRaises(ValidationError):
+            arquivo.restaurar([self.antigo.pk])
+        self.assertTrue(PacienteArquivo.objects.filter(pk=self.antigo.pk).exists())
+
+
+@skipUnless(connection.vendor == "postgresql", "os cards da evolução usam ArraySubquery")
+class MetricasTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user("medico", password="x")
+        hospital = Hospital.objects.create(nome="H1")
+        self.paciente = Paciente.objects.create(nome="P", hospital=hospital)
+
+    async def test_view_async_conta_as_queries_das_threads(self):
+        # sob ASGI o ORM das views async roda em threads do sync_to_async, com outra conexão
+        await sync_to_async(self.async_client.force_login)(self.usuario)
+        url = f"/pacientes/{self.paciente.pk}/evolucao/"
+        with mock.patch.object(registro, "observar") as observar:
+            with override_settings(ORCAMENTO_QUERIES={"evolucao_paciente": 0}), \
+                    self.assertLogs("core.middleware", "WARNING"):
+                resposta = await self.async_client.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        view, _, queries, tempo_sql, estourou = observar.call_args.args
+        self.assertEqual(view, "evolucao_paciente")
+        self.assertGreater(queries, 0)
+        self.assertGreater(tempo_sql, 0)
+        self.assertTrue(estourou)
+
+
+class ViewsAsyncTests(TestCase):
+    def setUp(self):
+        hospital = Hospital.objects.create(nome="H1")
+        self.paciente = Paciente.objects.create(nome="Paciente Async", hospital=hospital)
+        self.async_client.force_login(User.objects.create_user("medico", password="x"))
+
+    async def test_anonimo_vai_para_o_login(self):
+        url = f"/pacientes/{self.paciente.pk}/observacao/nova/"
+        resposta = await self.async_client_class().get(url)
+        self.assertEqual(resposta.status_code, 302)
+        self.assertIn("next=", resposta.url)
+
+    async def test_get_do_modal(self):
+        resposta = await self.async_client.get(f"/pacientes/{self.paciente.pk}/observacao/nova/")
+        self.assertContains(resposta, "Nova observação")
+        resposta = await self.async_client.get(f"/pacientes/{self.paciente.pk + 1000}/observacao/nova/")
+        self.assertEqual(resposta.status_code, 404)
+
+    @skipUnless(connection.vendor == "postgresql", "os cards da evolução usam ArraySubquery")
+    async def test_post_do_modal_grava_e_devolve_os_cards(self):
+        url = f"/pacientes/{self.paciente.pk}/observacao/nova/"
+        resposta = await self.async_client.post(url, {"descricao": "estável, sem queixas"})
+        self.assertContains(resposta, "estável, sem queixas")
+        self.assertTrue(await Observacao.objects.filter(paciente=self.paciente).aexists())
+        resposta = await self.async_client.post(url, {"descricao": ""})
+        self.assertEqual(resposta.status_code, 400)
+
+    @skipUnless(connection.vendor == "postgresql", "os cards da evolução usam ArraySubquery")
+    async def test_evolucao(self):
+        resposta = await self.async_client.get(f"/pacientes/{self.paciente.pk}/evolucao/")
+        self.assertContains(resposta, "Paciente Async")
+        resposta = await self.async_client.get(f"/pacientes/{self.paciente.pk + 1000}/evolucao/")
+        self.assertEqual(resposta.status_code, 404)
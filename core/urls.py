@@ -5,8 +5,12 @@ from . import views
 urlpatterns = [
     path("", views.home, name="home"),
     path("hospitais/", views.hospitais_list, name="hospitais_list"),
+    path("hospitais/<int:hospital_id>/visita/", views.visita_hospital, name="visita_hospital"),
     path("pacientes/", views.pacientes_list, name="pacientes_list"),
     path("producao/", views.producao_list, name="producao_list"),
+    path("producao/exportar.csv", views.producao_exportar, name="producao_exportar"),
+    path("producao/mensal/", views.producao_mensal, name="producao_mensal"),
+    path("producao/grade/", views.producao_grade, name="producao_grade"),
     # detalhe HTMX: data no formato YYYY-MM-DD
     path("producao/detalhe/<slug:data_iso>/<int:hospital_id>/", views.producao_detalhe, name="producao_detalhe"),
     path("pacientes/<int:paciente_id>/evolucao/", views.evolucao_paciente, name="evolucao_paciente"),
@@ -16,4 +20,7 @@ urlpatterns = [
     path("pacientes/<int:paciente_id>/acesso/nova/",     views.acesso_novo, name="acesso_novo"),
     path("pacientes/<int:paciente_id>/conduta/nova/",    views.conduta_nova, name="conduta_nova"),
     path("pacientes/<int:paciente_id>/producao/nova/",   views.producao_nova, name="producao_nova"),
+
+    # métricas por view no formato do Prometheus (só staff)
+    path("metricas/", views.metricas, name="metricas"),
 ]
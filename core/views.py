@@ -1,236 +1,413 @@
 # core/views.py
+from functools import wraps
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import render, get_object_or_404
-from django.db.models import Sum, Value, DecimalField
+from django.db.models import Sum, Value, DecimalField, Q, Subquery
 from decimal import Decimal
 from django.db.models.functions import Coalesce
-from .models import Hospital, Paciente, Producao, ItemProducao, Observacao, Acesso, Conduta
-from .forms import ObservacaoForm, AcessoForm, CondutaForm, ProducaoForm, ItemProducaoFormSet
-from django.http import HttpResponseBadRequest
+from .models import normalizar_busca, Hospital, Setor, Paciente, Producao, ProducaoDiaria, ItemProducao
+from . import fragmentos, grade, painel, visita
+from .evolucao import acards, cards_context
+from .exportacao import alinhas_csv, itens_exportacao, linhas_csv
+from .fechamento import resumo_mensal
+from .metricas import registro
+from .forms import ObservacaoForm, AcessoForm, CondutaForm, ProducaoForm, ItemProducaoFormSet, ProducaoFiltroForm, ExportacaoFiltroForm, ResumoMensalForm, GradeFiltroForm, GradeProducaoForm
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.core.cache import cache
 from django.utils.dateparse import parse_date
 from django.db.models import Prefetch
 from django.utils import timezone
 from django.db.models import Max
 from django.contrib import messages
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.core.paginator import Paginator
+from django.core.exceptions import ValidationError
+from django.db import transaction
 
 @login_required
 def home(request):
-    ctx = {
-        "total_hospitais": Hospital.objects.count(),
-        "total_pacientes": Paciente.objects.count(),
-        "total_producao": Producao.objects.aggregate(s=Sum("total_dia"))["s"] or 0,
-    }
-    return render(request, "home.html", ctx)
+    # indicadores agregados e em cache (core.painel): custo constante por visita
+    return render(request, "home.html", painel.resumo())
 
 @login_required
 def hospitais_list(request):
     hospitais = Hospital.objects.all().order_by("nome")
     return render(request, "hospitais/list.html", {"hospitais": hospitais})
 
+@login_required
+def visita_hospital(request, hospital_id):
+    hospital = get_object_or_404(Hospital, pk=hospital_id)
+    setores = Setor.objects.filter(paciente__hospital=hospital, paciente__alta=False).distinct().order_by("nome")
+    setor_id = request.GET.get("setor") or None
+    if setor_id and not setor_id.isdigit():
+        return HttpResponseBadRequest("Setor inválido.")
+    # cards de todos os internados em consultas fixas, em cache até a próxima gravação (core.visita)
+    return render(request, "visita/quadro.html", {
+        "hospital": hospital,
+        "setores": setores,
+        "setor_id": int(setor_id) if setor_id else None,
+        "linhas": visita.quadro(hospital.pk, int(setor_id) if setor_id else None),
+        "hoje": timezone.localdate(),
+    })
+
+PACIENTES_POR_PAGINA = 25
+
+
 @login_required
 def pacientes_list(request):
     q = request.GET.get("q", "").strip()
-    qs = Paciente.objects.select_related("hospital")
+    alta = request.GET.get("alta", "")
+    qs = Paciente.objects.select_related("hospital", "setor")
+    if alta == "ativos":
+        qs = qs.filter(alta=False)
+    elif alta == "alta":
+        qs = qs.filter(alta=True)
     if q:
-        qs = qs.filter(nome__icontains=q)
-    return render(request, "pacientes/list.html", {"pacientes": qs, "q": q})
+        # nome, número e registro sem acento; LIKE em `busca` usa o índice GIN de trigramas.
+        # Cada palavra é um LIKE: "silva jose" acha "José da Silva"
+        termo = normalizar_busca(q)
+        for palavra in termo.split():
+            qs = qs.filter(busca__contains=palavra)
+        qs = (
+            qs.annotate(relevancia=TrigramWordSimilarity(termo, "busca"))
+              .order_by("-relevancia", "nome", "pk")
+        )
+    else:
+        qs = qs.order_by("nome", "pk")
+
+    pagina = Paginator(qs, PACIENTES_POR_PAGINA).get_page(request.GET.get("page"))
+    params = request.GET.copy()
+    params.pop("page", None)
+    return render(request, "pacientes/list.html", {
+        "pacientes": pagina,
+        "pagina": pagina,
+        "q": q,
+        "alta": alta,
+        "params": params.urlencode(),
+    })
+
+
+PRODUCAO_POR_PAGINA = 30
+
+
+def _ler_cursor(cursor):
+    """(data, hospital_id) do cursor "YYYY-MM-DD:id", ou None se vazio/inválido."""
+    data_iso, _, hospital_id = cursor.partition(":")
+    try:
+        data = parse_date(data_iso)
+    except ValueError:
+        # formato certo, data inexistente (2026-02-30)
+        data = None
+    if not data or not hospital_id.isdigit():
+        return None
+    return data, int(hospital_id)
 
 
 @login_required
 def producao_list(request):
-    qs = Producao.objects.select_related("paciente", "paciente__hospital")
+    # lê do agregado ProducaoDiaria (data × hospital × convênio), não de Producao
+    filtro = ProducaoFiltroForm(request.GET or None)
+    qs = ProducaoDiaria.objects.all()
+    if filtro.is_valid():
+        if filtro.cleaned_data["de"]:
+            qs = qs.filter(data__gte=filtro.cleaned_data["de"])
+        if filtro.cleaned_data["ate"]:
+            qs = qs.filter(data__lte=filtro.cleaned_data["ate"])
+        if filtro.cleaned_data["hospital"]:
+            qs = qs.filter(hospital=filtro.cleaned_data["hospital"])
 
     agregados = (
-        qs.values("data", "paciente__hospital_id", "paciente__hospital__nome")
+        # sem hospital não há detalhe para abrir; esses dias entram só no total geral
+        qs.filter(hospital__isnull=False)
+          .values("data", "hospital_id", "hospital__nome")
           .annotate(
               total=Coalesce(
-                  Sum("total_dia"),
+                  Sum("total"),
                   Value(Decimal("0")),
-                  output_field=DecimalField(max_digits=12, decimal_places=2),
+                  output_field=DecimalField(max_digits=14, decimal_places=2),
               )
           )
-          .order_by("-data", "paciente__hospital__nome")
+          .order_by("-data", "hospital__nome", "hospital_id")
     )
 
-    total_geral = (
+    # paginação por cursor (keyset): "data:hospital_id" da última linha já exibida;
+    # cursor inválido mostra a primeira página
+    cursor = _ler_cursor(request.GET.get("apos", ""))
+    if cursor:
+        data, hospital_id = cursor
+        # o nome do hospital do cursor sai numa subconsulta da mesma consulta
+        nome = Subquery(Hospital.objects.filter(pk=hospital_id).values("nome"))
+        agregados = agregados.filter(
+            Q(data__lt=data)
+            | Q(data=data, hospital__nome__gt=nome)
+            | Q(data=data, hospital__nome=nome, hospital_id__gt=hospital_id)
+        )
+
+    linhas = list(agregados[:PRODUCAO_POR_PAGINA + 1])
+    proximo = None
+    if len(linhas) > PRODUCAO_POR_PAGINA:
+        linhas = linhas[:PRODUCAO_POR_PAGINA]
+        params = request.GET.copy()
+        params["apos"] = f"{linhas[-1]['data']:%Y-%m-%d}:{linhas[-1]['hospital_id']}"
+        proximo = params.urlencode()
+
+    ctx = {"agregados": linhas, "proximo": proximo}
+    if cursor:
+        # rolagem infinita (HTMX): só as próximas linhas
+        return render(request, "producao/_linhas.html", ctx)
+
+    ctx["filtro"] = filtro
+    ctx["total_geral"] = (
         qs.aggregate(
-            s=Coalesce(Sum("total_dia"),
+            s=Coalesce(Sum("total"),
                        Value(Decimal("0")),
-                       output_field=DecimalField(max_digits=12, decimal_places=2))
+                       output_field=DecimalField(max_digits=14, decimal_places=2))
         )["s"]
     )
+    return render(request, "producao/list.html", ctx)
 
-    return render(request, "producao/list.html", {
-        "agregados": agregados,
-        "total_geral": total_geral,
-    })
+
+@login_required
+def producao_exportar(request):
+    filtro = ExportacaoFiltroForm(request.GET)
+    if not filtro.is_valid():
+        return HttpResponseBadRequest("Filtros inválidos")
+    qs = itens_exportacao(**filtro.cleaned_data)
+    nome = "producao"
+    if filtro.cleaned_data["de"]:
+        nome += f"_{filtro.cleaned_data['de']:%Y%m%d}"
+    if filtro.cleaned_data["ate"]:
+        nome += f"_{filtro.cleaned_data['ate']:%Y%m%d}"
+    # sob ASGI o gerador precisa ser async, senão o Django lê tudo para a memória antes de enviar
+    linhas = alinhas_csv(qs) if isinstance(request, ASGIRequest) else linhas_csv(qs)
+    response = StreamingHttpResponse(linhas, content_type="text/csv; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="{nome}.csv"'
+    return response
 
 
 @login_required
-def producao_detalhe(request, data_iso, hospital_id):
-    if request.method != "GET":
-        return HttpResponseBadRequest("Método inválido")
+def producao_mensal(request):
+    # mês fechado lê o snapshot do fechamento; mês aberto agrega os itens na hora
+    hoje = timezone.localdate()
+    filtro = ResumoMensalForm(request.GET or {"mes": f"{hoje:%Y-%m}"})
+    ctx = {"filtro": filtro, "linhas": [], "fechamento": None, "total_geral": Decimal("0")}
+    if filtro.is_valid():
+        mes = filtro.cleaned_data["mes"]
+        linhas, fechamento = resumo_mensal(mes.year, mes.month, filtro.cleaned_data["hospital"])
+        ctx.update(
+            mes=mes,
+            linhas=linhas,
+            fechamento=fechamento,
+            total_geral=sum((l[5] or Decimal("0") for l in linhas), Decimal("0")),
+        )
+    return render(request, "producao/mensal.html", ctx)
 
-    data = parse_date(data_iso)
-    if not data:
-        return HttpResponseBadRequest("Data inválida")
 
-    hospital = get_object_or_404(Hospital, pk=hospital_id)
+@login_required
+def producao_grade(request):
+    # hospital, setor e data ficam na querystring também no POST da grade
+    hoje = timezone.localdate()
+    filtro = GradeFiltroForm(request.GET or None, initial={"data": hoje})
+    ctx = {"filtro": filtro, "form": None}
+    if not filtro.is_valid():
+        return render(request, "producao/grade.html", ctx)
+
+    hospital, setor, data = (filtro.cleaned_data[k] for k in ("hospital", "setor", "data"))
+    pacientes = grade.pacientes_da_grade(hospital.pk, setor and setor.pk)
+    procedimentos = grade.procedimentos_da_grade()
+
+    def montar(dados=None):
+        return GradeProducaoForm(
+            dados, pacientes=pacientes, procedimentos=procedimentos,
+            quantidades=grade.quantidades(pacientes, data),
+        )
+
+    form = montar(request.POST if request.method == "POST" else None)
+    status = 200
+    if request.method == "POST":
+        if form.is_valid():
+            try:
+                ctx["resumo"] = grade.salvar(pacientes, procedimentos, data, form.celulas(), usuario=request.user)
+                form = montar()  # relê o que ficou gravado
+            except ValidationError as e:
+                ctx["erro"] = " ".join(e.messages)
+                status = 400
+        else:
+            status = 400
+    ctx.update(form=form, procedimentos=procedimentos, hospital=hospital, setor=setor, data=data)
+    return render(request, "producao/grade.html", ctx, status=status)
+
+
+def login_required_async(view):
+    """login_required para views async (o decorator do Django 4.2 só embrulha views síncronas)."""
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        # request.user é preguiçoso e consulta sessão/usuário: resolve fora do event loop
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return inner
+
 
-    producoes = (
-        Producao.objects
-        .filter(data=data, paciente__hospital=hospital)
-        .select_related("paciente")
-        .prefetch_related(
-            Prefetch(
-                "itens",
-                queryset=ItemProducao.objects.select_related("procedimento").order_by("procedimento__nome"),
+async def _objeto_ou_404(qs, **filtros):
+    try:
+        return await qs.aget(**filtros)
+    except qs.model.DoesNotExist:
+        raise Http404
+
+
+async def _render_modal(request, template, ctx):
+    # os selects dos formulários (ModelChoiceField) consultam o banco ao renderizar
+    return await sync_to_async(render)(request, template, ctx)
+
+
+async def _detalhe_html(request, data, hospital_id, carimbo):
+    chave = fragmentos.chave_html(data, hospital_id, carimbo)
+    html = await cache.aget(chave)
+    if html is None:
+        producoes = (
+            Producao.objects
+            .filter(data=data, paciente__hospital_id=hospital_id)
+            .select_related("paciente")
+            .prefetch_related(
+                Prefetch(
+                    "itens",
+                    queryset=ItemProducao.objects.select_related("procedimento").order_by("procedimento__nome"),
+                )
             )
+            .order_by("paciente__nome")
         )
-        .order_by("paciente__nome")
-    )
 
-    by_paciente = {}
-    for p in producoes:
-        by_paciente.setdefault(p.paciente, []).append(p)
+        # em sequência: no Django 4.2 o ORM async roda cada consulta na mesma thread,
+        # então asyncio.gather não as sobreporia
+        hospital = await _objeto_ou_404(Hospital.objects, pk=hospital_id)
+        producoes = [p async for p in producoes]
 
-    # devolve apenas o fragmento com a lista
-    return render(request, "producao/_detalhe_fragmento.html", {
-        "data": data,
-        "hospital": hospital,
-        "by_paciente": by_paciente,
-    })
+        by_paciente = {}
+        for p in producoes:
+            by_paciente.setdefault(p.paciente, []).append(p)
 
+        # devolve apenas o fragmento com a lista
+        html = render_to_string("producao/_detalhe_fragmento.html", {
+            "data": data,
+            "hospital": hospital,
+            "by_paciente": by_paciente,
+        }, request=request)
+        await cache.aset(chave, html, fragmentos.VERSAO_TTL)
+    return html
 
-@login_required
-def evolucao_paciente(request, paciente_id):
-    paciente = get_object_or_404(Paciente, pk=paciente_id)
 
-    last_obs = (Observacao.objects.filter(paciente=paciente)
-                .order_by("-criado_em").first())
-    last_acesso = (Acesso.objects.filter(paciente=paciente)
-                   .order_by("-data_implantacao").first())
-    last_conduta = (Conduta.objects.filter(paciente=paciente)
-                    .order_by("-criado_em").first())
-    hoje = timezone.now().date()
-    prod_hoje = (Producao.objects.filter(paciente=paciente, data=hoje)
-                 .order_by("-id").first())
-
-    ctx = {
-        "paciente": paciente,
-        "last_obs": last_obs,
-        "last_acesso": last_acesso,
-        "last_conduta": last_conduta,
-        "prod_hoje": prod_hoje,
-        "hoje": hoje,
-    }
-    return render(request, "evolucao/paciente.html", _cards_context(paciente))
+@login_required_async
+async def producao_detalhe(request, data_iso, hospital_id):
+    if request.method != "GET":
+        return HttpResponseBadRequest("Método inválido")
+
+    data = parse_date(data_iso)
+    if not data:
+        return HttpResponseBadRequest("Data inválida")
+
+    # HTML, ETag e Last-Modified saem da versão do grupo (data, hospital); muda quando algo do grupo é gravado
+    carimbo = await fragmentos.aversao(data, hospital_id)
+    etag = fragmentos.etag(data, hospital_id, carimbo)
+    ultima_alteracao = int(carimbo)
+    response = get_conditional_response(request, etag=etag, last_modified=ultima_alteracao)
+    if response is None:
+        response = HttpResponse(await _detalhe_html(request, data, hospital_id, carimbo))
+    response.headers.setdefault("ETag", etag)
+    response.headers.setdefault("Last-Modified", http_date(ultima_alteracao))
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required_async
+async def evolucao_paciente(request, paciente_id):
+    paciente = await _objeto_ou_404(Paciente.objects.select_related("hospital"), pk=paciente_id)
+    cards = await acards(paciente_id)
+    return render(request, "evolucao/paciente.html", {"paciente": paciente, **cards})
 
 # ---------- Modais HTMX ----------
+# GET (abrir o modal) é async; o POST grava numa transação síncrona via sync_to_async.
 
-@login_required
-def obs_nova(request, paciente_id):
+def _salvar_modal(request, paciente_id, form_class, template):
     paciente = get_object_or_404(Paciente, pk=paciente_id)
+    form = form_class(request.POST)
+    if form.is_valid():
+        obj = form.save(commit=False)
+        obj.paciente = paciente
+        obj.criado_por = request.user
+        obj.save()
+        # retorna OOB fragmento para atualizar card
+        return render(request, "evolucao/_cards_oob.html",  cards_context(paciente))
+    return render(request, template, {"form": form, "paciente":paciente}, status=400)
+
+@login_required_async
+async def obs_nova(request, paciente_id):
     if request.method == "POST":
-        form = ObservacaoForm(request.POST)
-        if form.is_valid():
-            obj = form.save(commit=False)
-            obj.paciente = paciente
-            obj.criado_por = request.user
-            obj.save()
-            # retorna OOB fragmento para atualizar card
-            return render(request, "evolucao/_cards_oob.html",  _cards_context(paciente))
-        return render(request, "evolucao/_modal_obs.html", {"form": form, "paciente":paciente}, status=400)
-    # GET
-    form = ObservacaoForm()
-    return render(request, "evolucao/_modal_obs.html", {"form": form, "paciente":paciente})
+        return await sync_to_async(_salvar_modal)(request, paciente_id, ObservacaoForm, "evolucao/_modal_obs.html")
+    paciente = await _objeto_ou_404(Paciente.objects, pk=paciente_id)
+    return await _render_modal(request, "evolucao/_modal_obs.html", {"form": ObservacaoForm(), "paciente":paciente})
 
-@login_required
-def acesso_novo(request, paciente_id):
-    paciente = get_object_or_404(Paciente, pk=paciente_id)
+@login_required_async
+async def acesso_novo(request, paciente_id):
     if request.method == "POST":
-        form = AcessoForm(request.POST)
-        if form.is_valid():
-            obj = form.save(commit=False)
-            obj.paciente = paciente
-            obj.criado_por = request.user
-            obj.save()
-            return render(request, "evolucao/_cards_oob.html",  _cards_context(paciente))
-        return render(request, "evolucao/_modal_acesso.html", {"form": form, "paciente":paciente}, status=400)
-    form = AcessoForm()
-    return render(request, "evolucao/_modal_acesso.html", {"form": form, "paciente":paciente})
+        return await sync_to_async(_salvar_modal)(request, paciente_id, AcessoForm, "evolucao/_modal_acesso.html")
+    paciente = await _objeto_ou_404(Paciente.objects, pk=paciente_id)
+    return await _render_modal(request, "evolucao/_modal_acesso.html", {"form": AcessoForm(), "paciente":paciente})
 
-@login_required
-def conduta_nova(request, paciente_id):
-    paciente = get_object_or_404(Paciente, pk=paciente_id)
+@login_required_async
+async def conduta_nova(request, paciente_id):
     if request.method == "POST":
-        form = CondutaForm(request.POST)
-        if form.is_valid():
-            obj = form.save(commit=False)
-            obj.paciente = paciente
-            obj.criado_por = request.user
-            obj.save()
-            return render(request, "evolucao/_cards_oob.html",  _cards_context(paciente))
-        return render(request, "evolucao/_modal_conduta.html", {"form": form, "paciente":paciente}, status=400)
-    form = CondutaForm()
-    return render(request, "evolucao/_modal_conduta.html", {"form": form, "paciente":paciente})
+        return await sync_to_async(_salvar_modal)(request, paciente_id, CondutaForm, "evolucao/_modal_conduta.html")
+    paciente = await _objeto_ou_404(Paciente.objects, pk=paciente_id)
+    return await _render_modal(request, "evolucao/_modal_conduta.html", {"form": CondutaForm(), "paciente":paciente})
 
-@login_required
-def producao_nova(request, paciente_id):
+def _salvar_producao(request, paciente_id):
     paciente = get_object_or_404(Paciente, pk=paciente_id)
-    if request.method == "POST":
-        form = ProducaoForm(request.POST)
-        formset = ItemProducaoFormSet(request.POST, prefix="itens")
-        if form.is_valid() and formset.is_valid():
+    form = ProducaoForm(request.POST)
+    formset = ItemProducaoFormSet(request.POST, prefix="itens")
+    if form.is_valid() and formset.is_valid():
+        with transaction.atomic():
             prod = form.save(commit=False)
             prod.paciente = paciente
             prod.criado_por = request.user
             prod.save()
             formset.instance = prod
-            formset.save()
-
-            # >>> RECARREGA o contexto do card de produção
-            hoje = timezone.now().date()
-            prod_hoje = (
-                Producao.objects
-                .filter(paciente=paciente, data=hoje)
-                .prefetch_related("itens__procedimento")
-                .order_by("-id")
-                .first()
-            )
-
-            return render(
-                request,
-                "evolucao/_cards_oob.html",
-                 _cards_context(paciente),
-            )
+            itens = formset.save(commit=False)
+            # grava todos os itens em lote e calcula o total do dia uma vez só
+            prod.salvar_itens(itens, removidos=formset.deleted_objects)
 
         return render(
             request,
-            "evolucao/_modal_producao.html",
-            {"form": form, "formset": formset, "paciente": paciente},
-            status=400,
+            "evolucao/_cards_oob.html",
+             cards_context(paciente),
         )
 
-    # GET
+    return render(
+        request,
+        "evolucao/_modal_producao.html",
+        {"form": form, "formset": formset, "paciente": paciente},
+        status=400,
+    )
+
+@login_required_async
+async def producao_nova(request, paciente_id):
+    if request.method == "POST":
+        return await sync_to_async(_salvar_producao)(request, paciente_id)
+    paciente = await _objeto_ou_404(Paciente.objects, pk=paciente_id)
     form = ProducaoForm(initial={"data": timezone.now().date()})
     formset = ItemProducaoFormSet(prefix="itens")
-    return render(request, "evolucao/_modal_producao.html", {"form": form, "formset": formset, "paciente": paciente})
-
-
-def _cards_context(paciente):
-    hoje = timezone.now().date()
-    return {
-        "paciente": paciente,
-        "hoje": hoje,
-        "last_obs": Observacao.objects.filter(paciente=paciente).order_by("-criado_em").first(),
-        "last_acesso": Acesso.objects.filter(paciente=paciente).order_by("-data_implantacao").first(),
-        "last_conduta": Conduta.objects.filter(paciente=paciente).order_by("-criado_em").first(),
-        "prod_hoje": (
-            Producao.objects
-            .filter(paciente=paciente, data=hoje)
-            .prefetch_related("itens__procedimento")
-            .order_by("-id")
-            .first()
-        ),
-    }
\ No newline at end of file
+    return await _render_modal(request, "evolucao/_modal_producao.html", {"form": form, "formset": formset, "paciente": paciente})
+
+
+@staff_member_required
+def metricas(request):
+    # formato texto do Prometheus; histogramas deste processo (core.metricas)
+    return HttpResponse(registro.exportar(), content_type="text/plain; version=0.0.4; charset=utf-8")
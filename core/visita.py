@@ -0,0 +1,120 @@
+# core/visita.py
+"""
+Quadro da visita: todos os pacientes internados de um hospital (ou setor) com
+os mesmos cards da evolução (última observação, último acesso com os dias
+de hoje, última conduta e produção do dia).
+
+Uma consulta por tipo de card para o hospital inteiro: o "último por paciente"
+sai de ROW_NUMBER() OVER (PARTITION BY paciente), filtrado em 1. O resultado
+fica no cache sob uma versão por hospital, trocada sempre que os cards de
+algum paciente dele são invalidados (core.evolucao.invalidar_cards), e uma
+versão geral, trocada quando qualquer Paciente é gravado (alta, transferência,
+troca de setor).
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Prefetch, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import Acesso, Conduta, ItemProducao, Observacao, Paciente, Producao
+
+QUADRO_TTL = 60 * 60 * 24
+VERSAO_TTL = 60 * 60 * 24 * 30
+CHAVE_GERAL = "visita:versao"
+
+
+def _versao(chave):
+    valor = cache.get(chave)
+    if valor is None:
+        cache.add(chave, timezone.now().timestamp(), VERSAO_TTL)
+        valor = cache.get(chave)
+    return valor
+
+
+def _chave_hospital(hospital_id):
+    return f"visita:versao:{hospital_id}"
+
+
+def _ultimos(qs, pacientes, *ordem):
+    """Último registro de cada paciente: ROW_NUMBER() por paciente, mantém a linha 1."""
+    return {
+        obj.paciente_id: obj
+        for obj in qs.filter(paciente__in=pacientes)
+        .annotate(ordem=Window(RowNumber(), partition_by=[F("paciente_id")], order_by=list(ordem)))
+        .filter(ordem=1)
+    }
+
+
+def _consultar(hospital_id, setor_id, hoje):
+    pacientes = Paciente.objects.filter(hospital_id=hospital_id, alta=False)
+    if setor_id:
+        pacientes = pacientes.filter(setor_id=setor_id)
+    lista = list(pacientes.select_related("setor", "convenio").order_by("setor__nome", "numero", "nome"))
+
+    obs = _ultimos(
+        Observacao.objects.select_related("criado_por"), pacientes,
+        F("criado_em").desc(), F("pk").desc(),
+    )
+    acessos = _ultimos(
+        Acesso.objects.com_dias().select_related("nome"), pacientes,
+        F("data_implantacao").desc(), F("pk").desc(),
+    )
+    condutas = _ultimos(
+        Conduta.objects.select_related("descricao", "criado_por"), pacientes,
+        F("criado_em").desc(), F("pk").desc(),
+    )
+    producoes = {
+        p.paciente_id: p
+        for p in Producao.objects.filter(paciente__in=pacientes, data=hoje).prefetch_related(
+            Prefetch("itens", queryset=ItemProducao.objects.select_related("procedimento").order_by("procedimento__nome"))
+        )
+    }
+
+    # mesmo formato de core.evolucao.cards_context
+    linhas = []
+    for p in lista:
+        o, a, c, prod = obs.get(p.pk), acessos.get(p.pk), condutas.get(p.pk), producoes.get(p.pk)
+        linhas.append({
+            "paciente": p,
+            "last_obs": o and {"descricao": o.descricao, "criado_em": o.criado_em,
+                               "criado_por": o.criado_por and o.criado_por.username},
+            "last_acesso": a and {"nome": a.nome and a.nome.descricao, "data_implantacao": a.data_implantacao,
+                                  "dias": a.dias},
+            "last_conduta": c and {"descricao": c.descricao.descricao, "criado_em": c.criado_em,
+                                   "criado_por": c.criado_por and c.criado_por.username},
+            "prod_hoje": prod and {
+                "total_dia": prod.total_dia,
+                "itens": [{"procedimento": it.procedimento.nome, "quantidade": it.quantidade} for it in prod.itens.all()],
+            },
+        })
+    return linhas
+
+
+def quadro(hospital_id, setor_id=None):
+    hoje = timezone.localdate()
+    chave = (
+        f"visita:quadro:{hospital_id}:{setor_id or ''}:{hoje:%Y-%m-%d}:"
+        f"{_versao(CHAVE_GERAL)}:{_versao(_chave_hospital(hospital_id))}"
+    )
+    linhas = cache.get(chave)
+    if linhas is None:
+        linhas = _consultar(hospital_id, setor_id, hoje)
+        cache.set(chave, linhas, QUADRO_TTL)
+    return linhas
+
+
+def invalidar_paciente(paciente_id, hospital_id=None):
+    """
+    Troca a versão do quadro do hospital do paciente (chamado por invalidar_cards).
+    Sem `hospital_id`, busca o hospital depois do commit.
+    """
+    def trocar():
+        hospital = hospital_id or Paciente.objects.filter(pk=paciente_id).values_list("hospital_id", flat=True).first()
+        if hospital:
+            cache.set(_chave_hospital(hospital), timezone.now().timestamp(), VERSAO_TTL)
+    transaction.on_commit(trocar)
+
+
+def invalidar_todos():
+    transaction.on_commit(lambda: cache.set(CHAVE_GERAL, timezone.now().timestamp(), VERSAO_TTL))